@@ -0,0 +1,149 @@
+"""
+Analítica de utilización de los barberos por día de la semana y hora.
+
+El historial de CITA del rango (vivo y archivado) se lee de una vez a arreglos
+de NumPy (una fila por cita: barbero, día, minuto de inicio, duración y
+estado) y todo se calcula con operaciones vectorizadas:
+
+- utilización: slots ocupados por citas no canceladas sobre slots abiertos
+  según el horario de cada día (horario base o especial), por barbero,
+  día de la semana y hora;
+- tasa de cancelación (canceladas / citas) y de inasistencia
+  (no asistio / completada + no asistio) por barbero y hora de inicio.
+
+El resultado son listas y dicts simples, así se puede guardar en
+`almacen_temporal` por rango de fechas.
+
+Requiere numpy (`pip install numpy`); si no está instalado el resto de la
+aplicación funciona igual y `disponible()` devuelve False.
+"""
+from datetime import timedelta
+
+try:
+    import numpy as np
+except ImportError:  # dependencia opcional
+    np = None
+
+# Orden de FIELD(estado, ...) en la consulta; 0 = estado desconocido
+ESTADOS = ('pendiente', 'confirmada', 'completada', 'cancelada', 'no asistio')
+CANCELADA = ESTADOS.index('cancelada') + 1
+COMPLETADA = ESTADOS.index('completada') + 1
+NO_ASISTIO = ESTADOS.index('no asistio') + 1
+
+FILAS_POR_LOTE = 10000
+
+def disponible():
+    return np is not None
+
+def consulta_citas(slot_minutos, desde, hasta, tablas=('CITA',)):
+    """
+    SQL y parámetros para leer el historial del rango de una o varias tablas
+    con la estructura de CITA (p. ej. la viva y la de archivo).
+    """
+    marcadores = ', '.join(['%s'] * len(ESTADOS))
+    partes = [f"""
+        SELECT barbero_id, DATEDIFF(fecha, %s) AS dia,
+               TIME_TO_SEC(hora) DIV 60 AS inicio,
+               COALESCE(duracion_minutos, %s) AS duracion,
+               FIELD(estado, {marcadores}) AS estado
+        FROM {tabla}
+        WHERE fecha BETWEEN %s AND %s
+    """ for tabla in tablas]
+    return ' UNION ALL '.join(partes), (desde, slot_minutos, *ESTADOS, desde, hasta) * len(tablas)
+
+def leer_citas(cursor):
+    """Lee el cursor por lotes a una matriz int32 de (barbero, dia, inicio, duracion, estado)."""
+    partes = []
+    while True:
+        filas = cursor.fetchmany(FILAS_POR_LOTE)
+        if not filas:
+            break
+        partes.append(np.array(filas, dtype=np.int32))
+    if not partes:
+        return np.zeros((0, 5), dtype=np.int32)
+    return np.concatenate(partes)
+
+def matriz_apertura(aperturas, slot_minutos):
+    """Máscaras de apertura (un int por día) -> matriz booleana días x slots."""
+    n_slots = -(-24 * 60 // slot_minutos)
+    bits = np.arange(n_slots, dtype=object)
+    mascaras = np.array(aperturas, dtype=object).reshape(-1, 1)
+    return ((mascaras >> bits) & 1).astype(bool)
+
+def _tasa(numerador, denominador):
+    con_datos = denominador > 0
+    tasa = np.divide(numerador, denominador, out=np.zeros(numerador.shape), where=con_datos)
+    return np.where(con_datos, np.round(tasa, 3), np.nan)
+
+def _listas(matriz):
+    """ndarray -> listas anidadas con None en lugar de NaN."""
+    if matriz.ndim == 1:
+        return [None if np.isnan(v) else float(v) for v in matriz]
+    return [_listas(fila) for fila in matriz]
+
+def calcular(citas, barberos, desde, aperturas, slot_minutos):
+    """
+    citas: matriz de leer_citas. barberos: ids a mostrar (se agregan los que
+    aparezcan en las citas). aperturas: máscara de apertura de cada día desde
+    `desde`, en orden.
+    """
+    abiertos = matriz_apertura(aperturas, slot_minutos)
+    n_dias, n_slots = abiertos.shape
+
+    barberos = np.union1d(np.asarray(barberos, dtype=np.int32), citas[:, 0])
+    b = np.searchsorted(barberos, citas[:, 0])
+    dia, inicio, duracion, estado = citas[:, 1], citas[:, 2], citas[:, 3], citas[:, 4]
+
+    # Slots [primero, ultimo) que toca cada cita no cancelada, expandidos a una
+    # fila por (cita, slot) sin bucles: repeat + desplazamiento dentro de la cita
+    activas = estado != CANCELADA
+    primero = inicio[activas] // slot_minutos
+    ultimo = -(-(inicio[activas] + np.maximum(duracion[activas], 1)) // slot_minutos)
+    cuantos = ultimo - primero
+    fila = np.repeat(np.arange(cuantos.size), cuantos)
+    desplazamiento = np.arange(fila.size) - np.repeat(np.cumsum(cuantos) - cuantos, cuantos)
+    slot = primero[fila] + desplazamiento
+    dentro = slot < n_slots
+
+    ocupado = np.zeros((barberos.size, n_dias, n_slots), dtype=bool)
+    ocupado[b[activas][fila][dentro], dia[activas][fila][dentro], slot[dentro]] = True
+    ocupado &= abiertos  # lo que cae fuera del horario no cuenta como utilización
+
+    # Agrupar días por día de la semana y slots por hora con matrices indicadoras
+    dias_semana = np.array([(desde + timedelta(days=int(d))).weekday() for d in range(n_dias)])
+    por_semana = np.eye(7, dtype=np.int32)[dias_semana]               # días x 7
+    por_hora = np.eye(24, dtype=np.int32)[np.arange(n_slots) * slot_minutos // 60]  # slots x 24
+    abiertos_sh = por_semana.T @ abiertos.astype(np.int32) @ por_hora                # 7 x 24
+    ocupados_bsh = np.einsum('bds,dw,sh->bwh', ocupado.astype(np.int32), por_semana, por_hora)
+
+    # Tasas por barbero y hora de inicio
+    hora_inicio = np.minimum(inicio // 60, 23)
+    celda = b * 24 + hora_inicio
+    largo = barberos.size * 24
+
+    def contar(filtro=None):
+        pesos = None if filtro is None else filtro.astype(np.int32)
+        return np.bincount(celda, weights=pesos, minlength=largo).reshape(barberos.size, 24)
+
+    citas_bh = contar()
+    canceladas_bh = contar(estado == CANCELADA)
+    no_asistio_bh = contar(estado == NO_ASISTIO)
+    resueltas_bh = no_asistio_bh + contar(estado == COMPLETADA)
+
+    # Sólo las horas con algún slot abierto o alguna cita
+    horas = np.flatnonzero((abiertos_sh.sum(axis=0) > 0) | (citas_bh.sum(axis=0) > 0))
+    abiertos_sh = abiertos_sh[:, horas]
+    ocupados_bsh = ocupados_bsh[:, :, horas]
+
+    return {
+        'barberos': [int(x) for x in barberos],
+        'horas': [int(h) for h in horas],
+        'citas': int(citas.shape[0]),
+        'utilizacion_total': _listas(_tasa(ocupados_bsh.sum(axis=0), abiertos_sh * barberos.size)),
+        'utilizacion': [_listas(_tasa(o, abiertos_sh)) for o in ocupados_bsh],
+        'utilizacion_barbero': _listas(_tasa(ocupados_bsh.sum(axis=(1, 2)),
+                                             np.full(barberos.size, abiertos_sh.sum()))),
+        'tasa_cancelacion': _listas(_tasa(canceladas_bh, citas_bh)[:, horas]),
+        'tasa_no_asistio': _listas(_tasa(no_asistio_bh, resueltas_bh)[:, horas]),
+        'citas_por_hora': citas_bh[:, horas].astype(int).tolist(),
+    }
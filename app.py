@@ -1,19 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
 import mysql.connector
 import os
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
-import smtplib
 from flask import jsonify
 from datetime import datetime, date, time, timedelta
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from functools import wraps
 import uuid  # para nombres únicos de archivos
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from io import StringIO
+import tempfile
 import csv
+import click
+import threading
+from time import monotonic, sleep
+import hashlib
+import math
+
+import migraciones
+import buzon_salida
+import exportar_columnar
+import resumenes
+import analitica
+import archivado
 
 
 # Cargar variables de entorno
@@ -22,19 +33,397 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY")
 
+# Detrás de un proxy inverso, cuántos proxies confiables agregan X-Forwarded-For
+# (sin esto todas las peticiones llegan con la IP del proxy y el límite de
+# intentos por IP las trataría como un solo cliente)
+PROXIES_CONFIABLES = int(os.getenv("PROXIES_CONFIABLES", 0))
+if PROXIES_CONFIABLES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIABLES)
+
 # Configuración del email
 EMAIL_HOST = os.getenv("EMAIL_HOST")
 EMAIL_PORT = os.getenv("EMAIL_PORT")
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+EMAIL_TLS = os.getenv("EMAIL_TLS", "1") != "0"  # 0 para un SMTP local de pruebas
+CORREO_INTERVALO = int(os.getenv("CORREO_INTERVALO", 30))  # segundos entre revisiones del buzón
+CORREO_POR_MINUTO = int(os.getenv("CORREO_POR_MINUTO", 60))  # tope de envíos por minuto (0 = sin tope)
+CORREO_TRABAJADOR = os.getenv("CORREO_TRABAJADOR", "1") != "0"  # 0 si otro proceso corre `flask enviar-correos --continuo`
+
+#--------------------------------------------------------------------------------------------------------------------
+# POOL DE CONEXIONES A LA BASE DE DATOS
+#--------------------------------------------------------------------------------------------------------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))          # conexiones máximas por proceso
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # segundos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 3600))  # vida máxima de una conexión (segundos)
+
+class PoolConexiones:
+    """
+    Pool de conexiones MySQL de tamaño fijo.
+    - Crea las conexiones bajo demanda hasta `tamano`.
+    - Al prestar verifica la conexión (ping) y recicla las caídas o muy viejas.
+    - Al devolver hace rollback de lo que haya quedado pendiente.
+    """
+
+    def __init__(self, tamano, timeout, reciclar, **config):
+        self.tamano = tamano
+        self.timeout = timeout
+        self.reciclar = reciclar
+        self._config = config
+        self._libres = []  # pila (conexion, creada_en): se reutiliza primero la más reciente
+        self._abiertas = 0
+        self._cond = threading.Condition()
+        self._prestadas = 0
+        self._esperando = 0
+        self._creadas = 0
+        self._recicladas = 0
+
+    def _crear(self):
+        conn = mysql.connector.connect(**self._config)
+        with self._cond:
+            self._creadas += 1
+        return conn, monotonic()
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._recicladas += 1
+
+    def _sano(self, conn, creada_en):
+        if self.reciclar and monotonic() - creada_en > self.reciclar:
+            return False
+        return conn.is_connected()
+
+    def obtener(self):
+        limite = monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._libres:
+                    conn, creada_en = self._libres.pop()
+                    break
+                if self._abiertas < self.tamano:
+                    self._abiertas += 1
+                    conn = None
+                    break
+                restante = limite - monotonic()
+                if restante <= 0:
+                    raise mysql.connector.errors.PoolError(
+                        f"No hay conexiones libres tras esperar {self.timeout}s (pool de {self.tamano})"
+                    )
+                self._esperando += 1
+                try:
+                    self._cond.wait(restante)
+                finally:
+                    self._esperando -= 1
+
+        # La verificación y la conexión se hacen fuera del lock
+        try:
+            if conn is not None and not self._sano(conn, creada_en):
+                self._descartar(conn)
+                conn = None
+            if conn is None:
+                conn, creada_en = self._crear()
+        except Exception:
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._prestadas += 1
+        return ConexionPool(self, conn, creada_en)
+
+    def devolver(self, conn, creada_en):
+        try:
+            # Deja la sesión limpia para el siguiente préstamo
+            if conn.in_transaction:
+                conn.rollback()
+            reutilizable = True
+        except Exception:
+            reutilizable = False
+
+        if not reutilizable:
+            self._descartar(conn)
+        with self._cond:
+            self._prestadas -= 1
+            if reutilizable:
+                self._libres.append((conn, creada_en))
+            else:
+                self._abiertas -= 1
+            self._cond.notify()
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                'tamano': self.tamano,
+                'abiertas': self._abiertas,
+                'libres': len(self._libres),
+                'prestadas': self._prestadas,
+                'esperando': self._esperando,
+                'creadas': self._creadas,
+                'recicladas': self._recicladas,
+            }
+
+class ConexionPool:
+    """
+    Envoltorio de una conexión prestada: se usa igual que la conexión original,
+    pero close() la devuelve al pool en vez de cerrarla.
+    """
+
+    def __init__(self, pool, conn, creada_en):
+        self._pool = pool
+        self._conn = conn
+        self._creada_en = creada_en
+
+    def __getattr__(self, nombre):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("La conexión ya fue devuelta al pool")
+        return getattr(self._conn, nombre)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.devolver(conn, self._creada_en)
+
+db_pool = PoolConexiones(
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    host=os.getenv("DB_HOST"),
+    user=os.getenv("DB_USER"),
+    password=os.getenv("DB_PASSWORD"),
+    database=os.getenv("DB_NAME"),
+    buffered=True  # varios cursores pueden convivir en la misma conexión
+)
 
 def get_db_connection():
-    return mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
+    return db_pool.obtener()
+
+def get_db():
+    """
+    Conexión de la petición actual (unidad de trabajo ligada al app context).
+    Se pide al pool la primera vez que se usa y se devuelve en el teardown,
+    así rutas y helpers comparten una sola conexión por petición.
+    """
+    if 'db' not in g:
+        g.db = get_db_connection()
+    return g.db
+
+@app.teardown_appcontext
+def cerrar_db(exc):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    try:
+        if exc is None:
+            conn.commit()
+        else:
+            conn.rollback()
+    finally:
+        conn.close()
+
+#--------------------------------------------------------------------------------------------------------------------
+# CACHÉS EN MEMORIA
+#--------------------------------------------------------------------------------------------------------------------
+class CacheMemoria:
+    """
+    Valor cacheado en memoria del proceso. Se recarga con `cargar()` cuando se
+    invalida explícitamente (tras una escritura) o cuando vence el TTL, que es el
+    respaldo para despliegues con varios workers: la invalidación sólo llega al
+    worker que hizo la escritura.
+    """
+
+    def __init__(self, cargar, ttl):
+        self._cargar = cargar
+        self.ttl = ttl
+        self._valor = None
+        self._cargado_en = None
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        with self._lock:
+            if self._cargado_en is None or monotonic() - self._cargado_en > self.ttl:
+                self._valor = self._cargar()
+                self._cargado_en = monotonic()
+            return self._valor
+
+    def cargado(self):
+        """Valor actual si ya está cargado y vigente, sin disparar una carga."""
+        with self._lock:
+            if self._cargado_en is None or monotonic() - self._cargado_en > self.ttl:
+                return None
+            return self._valor
+
+    def invalidar(self):
+        with self._lock:
+            self._valor = None
+            self._cargado_en = None
+
+class AlmacenMemoria:
+    """
+    Almacén clave -> valor con vencimiento por clave, local al proceso. Es el
+    respaldo por defecto y el que se usa en pruebas; con varios workers se
+    reemplaza `almacen_temporal` por un almacén compartido (p. ej. Redis) que
+    ofrezca los mismos métodos (`tomar_ficha` y los de grupos de campos como
+    scripts atómicos). Los valores deben ser serializables (dict, str).
+    """
+
+    PURGAR_CADA = 1000  # escrituras entre barridos de claves vencidas
+
+    def __init__(self):
+        self._datos = {}  # clave -> (valor, vence_en)
+        self._escrituras = 0
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave, ahora):
+        dato = self._datos.get(clave)
+        if dato is None or dato[1] <= ahora:
+            return None
+        return dato[0]
+
+    def _escribir(self, clave, valor, ttl, ahora):
+        self._escrituras += 1
+        if self._escrituras % self.PURGAR_CADA == 0:
+            for vencida in [c for c, (_, vence) in self._datos.items() if vence <= ahora]:
+                del self._datos[vencida]
+        self._datos[clave] = (valor, ahora + ttl)
+
+    def obtener(self, clave):
+        with self._lock:
+            return self._vigente(clave, monotonic())
+
+    def guardar(self, clave, valor, ttl):
+        with self._lock:
+            self._escribir(clave, valor, ttl, monotonic())
+
+    def agregar(self, clave, valor, ttl):
+        """Guarda sólo si la clave no existe o ya venció. Devuelve True si la guardó."""
+        with self._lock:
+            ahora = monotonic()
+            if self._vigente(clave, ahora) is not None:
+                return False
+            self._escribir(clave, valor, ttl, ahora)
+            return True
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def tomar_ficha(self, clave, capacidad, segundos_por_ficha):
+        """
+        Cubeta de fichas: la clave arranca llena con `capacidad` fichas y
+        recupera una cada `segundos_por_ficha`. Si hay una ficha la toma y
+        devuelve 0; si no, devuelve los segundos que faltan para la próxima.
+        """
+        with self._lock:
+            ahora = monotonic()
+            cubeta = self._vigente(clave, ahora)
+            if cubeta is None:
+                fichas = capacidad
+            else:
+                fichas = min(capacidad, cubeta['fichas'] + (ahora - cubeta['en']) / segundos_por_ficha)
+            if fichas < 1:
+                return (1 - fichas) * segundos_por_ficha
+            # Vence cuando se habría vuelto a llenar: una clave ausente es una cubeta llena
+            self._escribir(clave, {'fichas': fichas - 1, 'en': ahora},
+                           (capacidad - fichas + 1) * segundos_por_ficha, ahora)
+            return 0
+
+    # Grupos de campos (como un hash de Redis) en los que cada campo vence por su cuenta
+    def _campos_vigentes(self, clave, ahora):
+        grupo = self._vigente(clave, ahora) or {}
+        return {campo: dato for campo, dato in grupo.items() if dato[1] > ahora}
+
+    def _escribir_grupo(self, clave, grupo, ahora):
+        if grupo:
+            self._escribir(clave, grupo, max(vence for _, vence in grupo.values()) - ahora, ahora)
+        else:
+            self._datos.pop(clave, None)
+
+    def agregar_campos(self, clave, campos, ttl):
+        """
+        Guarda todos los `campos` {campo: valor} en el grupo `clave` sólo si
+        ninguno está ocupado (todo o nada). Devuelve True si los guardó.
+        """
+        with self._lock:
+            ahora = monotonic()
+            grupo = self._campos_vigentes(clave, ahora)
+            if any(campo in grupo for campo in campos):
+                return False
+            grupo.update({campo: (valor, ahora + ttl) for campo, valor in campos.items()})
+            self._escribir_grupo(clave, grupo, ahora)
+            return True
+
+    def campos(self, clave):
+        """{campo: valor} vigentes del grupo `clave`."""
+        with self._lock:
+            return {campo: valor for campo, (valor, _) in self._campos_vigentes(clave, monotonic()).items()}
+
+    def eliminar_campos(self, clave, campos, valor=None):
+        """Borra campos del grupo; si se da `valor`, sólo los que todavía lo tienen."""
+        with self._lock:
+            ahora = monotonic()
+            grupo = self._campos_vigentes(clave, ahora)
+            for campo in campos:
+                if campo in grupo and (valor is None or grupo[campo][0] == valor):
+                    del grupo[campo]
+            self._escribir_grupo(clave, grupo, ahora)
+
+    def buscar(self, prefijo):
+        """{clave: valor} de las claves vigentes que empiezan con `prefijo`."""
+        with self._lock:
+            ahora = monotonic()
+            return {
+                clave: valor
+                for clave, (valor, vence) in self._datos.items()
+                if clave.startswith(prefijo) and vence > ahora
+            }
+
+almacen_temporal = AlmacenMemoria()
+
+def cargar_catalogo_servicios():
+    """Lee la tabla de servicios en una sola consulta y la agrupa por tipo_servicio."""
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute("SELECT * FROM servicios ORDER BY nombre")
+    todos = cursor.fetchall()
+    cursor.close()
+
+    catalogo = {
+        'todos': todos,
+        'por_id': {s['servicio_id']: s for s in todos},
+        'destacados': sorted(todos, key=lambda s: s['servicio_id'])[:6],
+        'servicio': [],
+        'combos': [],
+        'extras': [],
+    }
+    for servicio in todos:
+        catalogo.setdefault(servicio['tipo_servicio'], []).append(servicio)
+    return catalogo
+
+catalogo_servicios = CacheMemoria(cargar_catalogo_servicios, int(os.getenv("SERVICIOS_CACHE_TTL", 300)))
+
+def cargar_plantilla_barberos():
+    """Lee todos los barberos (con sus datos de usuario) y separa los activos."""
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute("""
+        SELECT u.usuario_id, u.nombre, u.apellido, u.email, u.telefono,
+               b.barbero_id, b.fecha_contratacion, b.estado, b.biografia, b.foto_perfil
+        FROM Barbero b
+        JOIN USUARIO u ON b.usuario_id = u.usuario_id
+        ORDER BY u.nombre, u.apellido
+    """)
+    todos = cursor.fetchall()
+    cursor.close()
+    return {
+        'todos': todos,
+        'activos': [b for b in todos if b['estado'] == 1],
+    }
+
+plantilla_barberos = CacheMemoria(cargar_plantilla_barberos, int(os.getenv("BARBEROS_CACHE_TTL", 300)))
+
+def obtener_barberos(solo_activos=True):
+    return plantilla_barberos.obtener()['activos' if solo_activos else 'todos']
 
 def login_required(f):
     @wraps(f)
@@ -44,62 +433,208 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def send_confirmation_email(email, token):
+# --- CLAVES DE IDEMPOTENCIA ---
+# Cada formulario de reservar/cancelar lleva una clave única generada al
+# renderizarlo. Si el mismo envío llega otra vez (doble clic, reintento del
+# móvil) se responde con el resultado original sin tocar la base de datos.
+IDEMPOTENCIA_TTL = int(os.getenv("IDEMPOTENCIA_TTL", 600))
+
+@app.context_processor
+def inyectar_clave_idempotencia():
+    return {'clave_idempotencia': lambda: uuid.uuid4().hex}
+
+def idempotente(f):
+    """
+    Para rutas POST que responden con redirect + flash. La clave se toma del
+    campo `idempotencia` (o de la cabecera Idempotency-Key) y se combina con el
+    usuario y el contenido del formulario: si el cliente cambia los datos con el
+    mismo formulario abierto, es un envío nuevo.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        clave = request.form.get('idempotencia') or request.headers.get('Idempotency-Key')
+        if not clave:
+            return f(*args, **kwargs)
+
+        campos = sorted((k, v) for k, v in request.form.items(multi=True) if k != 'idempotencia')
+        huella = hashlib.sha256(repr((request.endpoint, campos)).encode()).hexdigest()[:32]
+        clave = f"idempotencia:{session.get('user_id')}:{clave}:{huella}"
+
+        if not almacen_temporal.agregar(clave, {'en_curso': True}, IDEMPOTENCIA_TTL):
+            original = almacen_temporal.obtener(clave) or {'en_curso': True}
+            if original.get('en_curso'):
+                flash('Tu solicitud ya se está procesando.', 'info')
+                return redirect(request.referrer or url_for('home'))
+            for categoria, mensaje in original['mensajes']:
+                flash(mensaje, categoria)
+            return redirect(original['destino'])
+
+        previos = len(session.get('_flashes', []))
+        try:
+            respuesta = f(*args, **kwargs)
+        except Exception:
+            almacen_temporal.eliminar(clave)
+            raise
+        if getattr(respuesta, 'status_code', None) not in (301, 302, 303):
+            # Sólo se recuerdan redirects; cualquier otra respuesta se puede repetir
+            almacen_temporal.eliminar(clave)
+            return respuesta
+        almacen_temporal.guardar(clave, {
+            'destino': respuesta.location,
+            'mensajes': [list(m) for m in session.get('_flashes', [])[previos:]],
+        }, IDEMPOTENCIA_TTL)
+        return respuesta
+    return decorated_function
+
+# --- LÍMITE DE INTENTOS ---
+# Cubetas de fichas en almacen_temporal por IP y por cuenta (el email del
+# formulario, o el token en restablecer). Se revisan antes que nada, así una
+# ráfaga de intentos se corta sin calcular hashes de contraseña ni encolar
+# correos. endpoint -> ((capacidad, segundos por ficha) por IP, ídem por cuenta)
+LIMITES_ACCESO = {
+    'login': ((20, 6), (5, 60)),
+    'registro': ((5, 120), (3, 600)),
+    'recuperar': ((5, 120), (3, 600)),
+    'restablecer': ((10, 30), (5, 120)),
+}
+
+def limitar_intentos(f):
+    """Para los POST de las rutas de LIMITES_ACCESO: responde con flash + redirect al agotarse."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        limites = LIMITES_ACCESO.get(request.endpoint)
+        if request.method != 'POST' or not limites:
+            return f(*args, **kwargs)
+
+        por_ip, por_cuenta = limites
+        espera = almacen_temporal.tomar_ficha(f"limite:{request.endpoint}:ip:{request.remote_addr}", *por_ip)
+        cuenta = (request.form.get('email') or '').strip().lower() or kwargs.get('token')
+        if not espera and cuenta:
+            espera = almacen_temporal.tomar_ficha(f"limite:{request.endpoint}:cuenta:{cuenta}", *por_cuenta)
+        if espera:
+            flash(f'Demasiados intentos. Vuelve a intentarlo en {max(1, math.ceil(espera / 60))} minuto(s).', 'warning')
+            respuesta = redirect(request.url)
+            respuesta.headers['Retry-After'] = str(int(espera) + 1)
+            return respuesta
+        return f(*args, **kwargs)
+    return decorated_function
+
+#--------------------------------------------------------------------------------------------------------------------
+# CORREO (buzón de salida)
+#--------------------------------------------------------------------------------------------------------------------
+config_smtp = buzon_salida.ConfigSMTP(EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD,
+                                      tls=EMAIL_TLS, por_minuto=CORREO_POR_MINUTO)
+trabajador_correo = buzon_salida.TrabajadorCorreo(get_db_connection, config_smtp, intervalo=CORREO_INTERVALO)
+
+@app.before_request
+def iniciar_trabajador_correo():
+    # En el proceso que atiende peticiones (no en los comandos de flask): así
+    # los correos que quedaron en el buzón salen aunque nadie encole uno nuevo
+    if CORREO_TRABAJADOR:
+        trabajador_correo.iniciar()
+
+def despertar_trabajador_correo():
+    if CORREO_TRABAJADOR:
+        trabajador_correo.despertar()
+
+def encolar_correo(destinatario, asunto, cuerpo_html):
+    """
+    Deja el correo en el buzón con la conexión de la petición: se envía sólo si
+    la transacción hace commit. Llamar a despertar_trabajador_correo() después.
+    """
+    cursor = get_db().cursor()
     try:
-        # Crear el mensaje
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = email
-        msg['Subject'] = "Confirma tu cuenta en BLANK concept"
-        
-        # Cuerpo del mensaje
-        confirmation_url = f"http://localhost:5000/confirmar/{token}"
-        body = f"""
-        <h2>Gracias por registrarte en BLANK concept!</h2>
-        <p>Por favor confirma tu cuenta haciendo clic en el siguiente enlace:</p>
-        <a href="{confirmation_url}">Confirmar cuenta</a>
-        <p>Si no has solicitado este registro, por favor ignora este mensaje.</p>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Enviar el email
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        
-        return True
-    except Exception as e:
-        print(f"Error al enviar email: {e}")
-        return False
+        buzon_salida.encolar(cursor, destinatario, asunto, cuerpo_html)
+    finally:
+        cursor.close()
+
+def encolar_recordatorios(fecha_obj):
+    """
+    Encola un recordatorio por cada cita pendiente/confirmada de `fecha_obj` que
+    no lo haya recibido ni lo tenga ya en el buzón. El buzón marca la cita al
+    enviarlo, así volver a correr el job nunca duplica correos y sí reencola los
+    que fallaron del todo. Devuelve cuántos encoló.
+    """
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Una sola consulta; FOR UPDATE hace esperar a otra corrida simultánea y
+        # FOR SHARE le hace ver los recordatorios que ésta dejó en el buzón
+        cursor.execute("""
+            SELECT c.cita_id, c.fecha, TIME_FORMAT(c.hora, '%H:%i') AS hora,
+                   uc.nombre AS cliente_nombre, uc.email,
+                   ub.nombre AS barbero_nombre, ub.apellido AS barbero_apellido,
+                   GROUP_CONCAT(s.nombre SEPARATOR ', ') AS servicios
+            FROM CITA c
+            JOIN USUARIO uc ON c.usuario_id = uc.usuario_id
+            JOIN Barbero b  ON c.barbero_id = b.barbero_id
+            JOIN USUARIO ub ON b.usuario_id = ub.usuario_id
+            LEFT JOIN Cita_servicio cs ON c.cita_id = cs.cita_id
+            LEFT JOIN Servicios s ON cs.servicio_id = s.servicio_id
+            WHERE c.fecha = %s
+              AND c.estado IN ('pendiente','confirmada')
+              AND c.recordatorio_enviado_en IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM correo_salida co
+                  WHERE co.cita_id = c.cita_id AND co.estado IN ('pendiente','enviando')
+                  FOR SHARE
+              )
+            GROUP BY c.cita_id
+            FOR UPDATE
+        """, (fecha_obj,))
+        citas = cursor.fetchall()
+        if not citas:
+            return 0
+
+        # Jinja compila la plantilla una vez y la reutiliza en cada render
+        plantilla = app.jinja_env.get_template('email_recordatorio.html')
+        asunto = "Recordatorio de tu cita en BLANK concept"
+        # --fecha puede pedir cualquier día, no sólo mañana
+        cuando = {0: 'hoy', 1: 'mañana'}.get((fecha_obj - date.today()).days,
+                                             f"el {fecha_obj.strftime('%d/%m/%Y')}")
+        buzon_salida.encolar_varios(
+            cursor, [(cita['email'], asunto, plantilla.render(cita=cita, cuando=cuando), cita['cita_id'])
+                     for cita in citas]
+        )
+        conn.commit()
+        return len(citas)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def send_confirmation_email(email, token):
+    confirmation_url = f"http://localhost:5000/confirmar/{token}"
+    body = f"""
+    <h2>Gracias por registrarte en BLANK concept!</h2>
+    <p>Por favor confirma tu cuenta haciendo clic en el siguiente enlace:</p>
+    <a href="{confirmation_url}">Confirmar cuenta</a>
+    <p>Si no has solicitado este registro, por favor ignora este mensaje.</p>
+    """
+    encolar_correo(email, "Confirma tu cuenta en BLANK concept", body)
 
 # muestra la página de bienvenida
 @app.route('/')
 def home():
     # Obtener servicios para mostrar en la página principal
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM servicios LIMIT 6")
-    servicios = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    servicios = catalogo_servicios.obtener()['destacados']
     
     return render_template('index.html', servicios=servicios)
 
 @app.route('/login', methods=['GET', 'POST'])
+@limitar_intentos
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         
         cursor.execute("SELECT * FROM USUARIO WHERE email = %s", (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
         
         if user and check_password_hash(user['contraseña'], password):
             if user['confirmado'] == 1:
@@ -125,6 +660,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/registro', methods=['GET', 'POST'])
+@limitar_intentos
 def registro():
     if request.method == 'POST':
         nombre = request.form.get('nombre')
@@ -146,13 +682,12 @@ def registro():
             return redirect(url_for('registro'))
         
         # Verificar si el email ya existe
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute("SELECT email FROM USUARIO WHERE email = %s", (email,))
         if cursor.fetchone():
             cursor.close()
-            conn.close()
             flash('Este correo electrónico ya está registrado', 'danger')
             return redirect(url_for('registro'))
         
@@ -168,14 +703,12 @@ def registro():
                 "INSERT INTO USUARIO (nombre, segundo_nombre, apellido, segundo_apellido, email, telefono, contraseña, token) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
                 (nombre, segundo_nombre, apellido, segundo_apellido, email, telefono, hashed_password, token)
             )
+            # El email de confirmación se guarda en la misma transacción
+            send_confirmation_email(email, token)
             conn.commit()
+            despertar_trabajador_correo()
             
-            # Enviar email de confirmación
-            if send_confirmation_email(email, token):
-                flash('Registro exitoso! Por favor revisa tu correo para confirmar tu cuenta.', 'success')
-            else:
-                flash('Registro exitoso, pero no pudimos enviar el email de confirmación. Contacta al soporte.', 'warning')
-            
+            flash('Registro exitoso! Por favor revisa tu correo para confirmar tu cuenta.', 'success')
             return redirect(url_for('login'))
         except Exception as e:
             conn.rollback()
@@ -183,14 +716,13 @@ def registro():
             return redirect(url_for('registro'))
         finally:
             cursor.close()
-            conn.close()
     
     return render_template('registro.html')
 
 
 @app.route('/confirmar/<token>')
 def confirmar(token):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -208,16 +740,16 @@ def confirmar(token):
         flash('Error al confirmar la cuenta: ' + str(e), 'danger')
     finally:
         cursor.close()
-        conn.close()
     
     return redirect(url_for('login'))
 
 @app.route('/recuperar', methods=['GET', 'POST'])
+@limitar_intentos
 def recuperar():
     if request.method == 'POST':
         email = request.form.get('email')
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         
         cursor.execute("SELECT usuario_id FROM USUARIO WHERE email = %s", (email,))
@@ -229,10 +761,10 @@ def recuperar():
             
             try:
                 cursor.execute("UPDATE USUARIO SET token = %s WHERE email = %s", (token, email))
-                conn.commit()
-                
-                # Enviar email con enlace para restablecer contraseña
+                # Email con enlace para restablecer contraseña (se envía en segundo plano)
                 send_reset_email(email, token)
+                conn.commit()
+                despertar_trabajador_correo()
                 
                 flash('Se ha enviado un enlace a tu correo para restablecer tu contraseña', 'success')
                 return redirect(url_for('login'))
@@ -241,42 +773,24 @@ def recuperar():
                 flash('Error al procesar la solicitud: ' + str(e), 'danger')
             finally:
                 cursor.close()
-                conn.close()
         else:
             flash('No existe una cuenta con ese correo electrónico', 'danger')
             cursor.close()
-            conn.close()
     
     return render_template('recuperar.html')
 
 def send_reset_email(email, token):
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = email
-        msg['Subject'] = "Restablecer contraseña - BLANK concept"
-        
-        reset_url = f"http://localhost:5000/restablecer/{token}"
-        body = f"""
-        <h2>Solicitud de restablecimiento de contraseña</h2>
-        <p>Para restablecer tu contraseña, haz clic en el siguiente enlace:</p>
-        <a href="{reset_url}">Restablecer contraseña</a>
-        <p>Si no solicitaste este cambio, por favor ignora este mensaje.</p>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        
-        return True
-    except Exception as e:
-        print(f"Error al enviar email de recuperación: {e}")
-        return False
+    reset_url = f"http://localhost:5000/restablecer/{token}"
+    body = f"""
+    <h2>Solicitud de restablecimiento de contraseña</h2>
+    <p>Para restablecer tu contraseña, haz clic en el siguiente enlace:</p>
+    <a href="{reset_url}">Restablecer contraseña</a>
+    <p>Si no solicitaste este cambio, por favor ignora este mensaje.</p>
+    """
+    encolar_correo(email, "Restablecer contraseña - BLANK concept", body)
 
 @app.route('/restablecer/<token>', methods=['GET', 'POST'])
+@limitar_intentos
 def restablecer(token):
     if request.method == 'POST':
         password = request.form.get('password')
@@ -292,7 +806,7 @@ def restablecer(token):
         
         hashed_password = generate_password_hash(password)
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
@@ -314,7 +828,6 @@ def restablecer(token):
             flash('Error al actualizar la contraseña: ' + str(e), 'danger')
         finally:
             cursor.close()
-            conn.close()
     
     return render_template('restablecer.html', token=token)
 
@@ -333,7 +846,32 @@ def admin_dashboard():
     if session.get('user_role') != 1:
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
-    return render_template('admin_dashboard.html')
+
+    # KPIs del rango (por defecto los últimos 30 días), leídos de las tablas resumen
+    hoy = date.today()
+    try:
+        desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        desde, hasta = hoy - timedelta(days=29), hoy
+
+    cursor = get_db().cursor(dictionary=True)
+    try:
+        kpis = resumenes.indicadores(cursor, desde, hasta)
+    finally:
+        cursor.close()
+
+    nombres = {b['barbero_id']: f"{b['nombre']} {b['apellido']}" for b in obtener_barberos(solo_activos=False)}
+    return render_template('admin_dashboard.html', kpis=kpis, nombres=nombres,
+                           desde=desde.isoformat(), hasta=hasta.isoformat())
+
+# Contadores del pool de conexiones de este proceso (para dimensionarlo por worker)
+@app.route('/admin/pool')
+@login_required
+def admin_pool():
+    if session.get('user_role') != 1:
+        return jsonify({'error': 'No autorizado'}), 403
+    return jsonify(db_pool.estadisticas())
 
 @app.route('/barbero/dashboard')
 @login_required
@@ -342,7 +880,7 @@ def barber_dashboard():
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     # 1) Barbero logueado
@@ -370,7 +908,7 @@ def barber_dashboard():
         ORDER BY c.hora ASC
     """, (barbero['barbero_id'], hoy))
     citas_hoy = cursor.fetchall()
-    cursor.close(); conn.close()
+    cursor.close()
 
     # 3) NUEVO: slots del día
     slots_hoy = generar_slots_dia(barbero['barbero_id'], hoy)
@@ -391,28 +929,12 @@ def client_dashboard():
 #---------------------------------------------------------------------------------------------------------------------------------------
 @app.route('/servicios')
 def servicios():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Obtener servicios normales
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'servicio' ORDER BY nombre")
-    servicios_normales = cursor.fetchall()
-    
-    # Obtener combos
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'combos' ORDER BY nombre")
-    servicios_combos = cursor.fetchall()
-    
-    # Obtener extras
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'extras' ORDER BY nombre")
-    servicios_extras = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
+    catalogo = catalogo_servicios.obtener()
     
     return render_template('servicios.html', 
-                         servicios_normales=servicios_normales,
-                         servicios_combos=servicios_combos,
-                         servicios_extras=servicios_extras)
+                         servicios_normales=catalogo['servicio'],
+                         servicios_combos=catalogo['combos'],
+                         servicios_extras=catalogo['extras'])
 
 
 #--------------------------------------------------------------------------------------------------------------------
@@ -426,12 +948,11 @@ def admin_servicios():
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT * FROM servicios")
     servicios = cursor.fetchall()
     cursor.close()
-    conn.close()
     
     return render_template('admin_servicios.html', servicios=servicios)
 
@@ -447,16 +968,18 @@ def agregar_servicio(): #FUNCION PARA AGREGAR SERVICIOS
         descripcion = request.form.get('descripcion')
         tipo_servicio = request.form.get('tipo_servicio')
         precio = request.form.get('precio')
+        duracion_minutos = request.form.get('duracion_minutos') or SLOT_MINUTOS
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
             cursor.execute(
-                "INSERT INTO servicios (nombre, descripcion, tipo_servicio, precio) VALUES (%s, %s, %s, %s)",
-                (nombre, descripcion, tipo_servicio, precio)
+                "INSERT INTO servicios (nombre, descripcion, tipo_servicio, precio, duracion_minutos) VALUES (%s, %s, %s, %s, %s)",
+                (nombre, descripcion, tipo_servicio, precio, duracion_minutos)
             )
             conn.commit()
+            catalogo_servicios.invalidar()
             flash('Servicio agregado exitosamente', 'success')
             return redirect(url_for('admin_servicios'))
         except Exception as e:
@@ -464,7 +987,6 @@ def agregar_servicio(): #FUNCION PARA AGREGAR SERVICIOS
             flash('Error al agregar el servicio: ' + str(e), 'danger')
         finally:
             cursor.close()
-            conn.close()
     
     return render_template('agregar_servicio.html')
 
@@ -475,7 +997,7 @@ def editar_servicio(id): #Funcion para modificar/editar un servicio
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     if request.method == 'POST':
@@ -483,13 +1005,15 @@ def editar_servicio(id): #Funcion para modificar/editar un servicio
         descripcion = request.form.get('descripcion')
         tipo_servicio = request.form.get('tipo_servicio')
         precio = request.form.get('precio')
+        duracion_minutos = request.form.get('duracion_minutos') or SLOT_MINUTOS
         
         try:
             cursor.execute(
-                "UPDATE servicios SET nombre = %s, descripcion = %s, tipo_servicio = %s, precio = %s WHERE servicio_id = %s",
-                (nombre, descripcion, tipo_servicio, precio, id)
+                "UPDATE servicios SET nombre = %s, descripcion = %s, tipo_servicio = %s, precio = %s, duracion_minutos = %s WHERE servicio_id = %s",
+                (nombre, descripcion, tipo_servicio, precio, duracion_minutos, id)
             )
             conn.commit()
+            catalogo_servicios.invalidar()
             flash('Servicio actualizado exitosamente', 'success')
             return redirect(url_for('admin_servicios'))
         except Exception as e:
@@ -497,7 +1021,6 @@ def editar_servicio(id): #Funcion para modificar/editar un servicio
             flash('Error al actualizar el servicio: ' + str(e), 'danger')
         finally:
             cursor.close()
-            conn.close()
     else:
         try:
             cursor.execute("SELECT * FROM servicios WHERE servicio_id = %s", (id,))
@@ -509,7 +1032,6 @@ def editar_servicio(id): #Funcion para modificar/editar un servicio
             return render_template('editar_servicio.html', servicio=servicio)
         finally:
             cursor.close()
-            conn.close()
 
 @app.route('/admin/servicios/eliminar/<int:id>', methods=['POST'])
 @login_required
@@ -518,19 +1040,19 @@ def eliminar_servicio(id): #Eleiminar servicio (Version que puede cambiar en un
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
         cursor.execute("DELETE FROM servicios WHERE servicio_id = %s", (id,))
         conn.commit()
+        catalogo_servicios.invalidar()
         flash('Servicio eliminado exitosamente', 'success')
     except Exception as e:
         conn.rollback()
         flash('Error al eliminar el servicio: ' + str(e), 'danger')
     finally:
         cursor.close()
-        conn.close()
     
     return redirect(url_for('admin_servicios'))
 
@@ -543,37 +1065,15 @@ def reservar_cita():
     servicio_inicial_id = request.args.get('servicio_id')
     barbero_inicial_id  = request.args.get('barbero_id')
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    # Obtener servicios
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'servicio' ORDER BY nombre")
-    servicios_normales = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'combos' ORDER BY nombre")
-    servicios_combos = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM servicios WHERE tipo_servicio = 'extras' ORDER BY nombre")
-    servicios_extras = cursor.fetchall()
-    
-    # Obtener barberos activos
-    cursor.execute("""
-        SELECT b.barbero_id, u.nombre, u.apellido, b.foto_perfil 
-        FROM Barbero b 
-        JOIN USUARIO u ON b.usuario_id = u.usuario_id 
-        WHERE b.estado = 1
-        ORDER BY u.nombre, u.apellido
-    """)
-    barberos = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    # Obtener servicios y barberos activos (desde las cachés en memoria)
+    catalogo = catalogo_servicios.obtener()
+    barberos = obtener_barberos()
     
     return render_template(
         'reservar_cita.html',
-        servicios_normales=servicios_normales,
-        servicios_combos=servicios_combos,
-        servicios_extras=servicios_extras,
+        servicios_normales=catalogo['servicio'],
+        servicios_combos=catalogo['combos'],
+        servicios_extras=catalogo['extras'],
         barberos=barberos,
         servicio_inicial_id=servicio_inicial_id,
         barbero_inicial_id=barbero_inicial_id, 
@@ -594,7 +1094,6 @@ def obtener_horarios_disponibles():
         # Convertir la fecha seleccionada
         fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
         hoy = date.today()
-        ahora = datetime.now().time()  # hora actual
 
         #Obtener horario del día (normal o especial)
         horario_dia = obtener_horario_dia(fecha_obj)
@@ -606,54 +1105,327 @@ def obtener_horarios_disponibles():
                 'mensaje': 'La barbería estará cerrada este día.'
             })
 
-        hora_inicio = horario_dia['hora_inicio']
-        hora_fin = horario_dia['hora_fin']
+        # Slots libres = abiertos y no ocupados ni pasados (operaciones de bits),
+        # y que dejen espacio para la duración de los servicios elegidos
+        barbero_id = int(barbero_id)
+        slots = slots_necesarios(duracion_solicitada(request.form.get('duracion')))
+        ocupados = ocupacion_citas(fecha_obj, fecha_obj, [barbero_id]).get((barbero_id, fecha_obj), 0)
+        ocupados |= retenciones_ajenas(session['user_id'], [fecha_obj]).get((barbero_id, fecha_obj), 0)
+        libres = mascara_inicios(mascara_apertura(horario_dia) & ~ocupados, slots) & ~mascara_pasados(fecha_obj)
+        horarios_disponibles = [hora_de_slot(i) for i in slots_de_mascara(libres)]
 
-        inicio_dt = datetime.combine(date.today(), hora_inicio)
-        fin_dt = datetime.combine(date.today(), hora_fin)
+        # Si ya no hay horarios disponibles para hoy
+        if fecha_obj == hoy and not horarios_disponibles:
+            return jsonify({'horarios': [], 'cerrado': True})
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        return jsonify({'horarios': horarios_disponibles})
 
-        # Citas ya ocupadas
-        cursor.execute("""
-            SELECT TIME_FORMAT(hora, '%H:%i') as hora_str 
-            FROM CITA 
-            WHERE barbero_id = %s AND fecha = %s AND estado IN ('pendiente', 'confirmada')
-        """, (barbero_id, fecha))
-        citas_existentes = [c['hora_str'] for c in cursor.fetchall()]
-
-        horarios_disponibles = []
-        actual = inicio_dt
-        while actual < fin_dt:
-            horario = actual.strftime("%H:%M")
-
-            # Ignorar horarios pasados si es hoy
-            if fecha_obj == hoy and actual.time() <= ahora:
-                actual += timedelta(minutes=30)
-                continue
+    except Exception as e:
+        print(f"ERROR en obtener_horarios_disponibles: {str(e)}")
+        return jsonify({'error': f'Error del servidor: {str(e)}'}), 500
 
-            if horario not in citas_existentes:
-                horarios_disponibles.append(horario)
 
-            actual += timedelta(minutes=30)
+DISPONIBILIDAD_MAX_DIAS = int(os.getenv("DISPONIBILIDAD_MAX_DIAS", 31))
 
-        cursor.close()
-        conn.close()
+@app.route('/disponibilidad')
+@login_required
+def disponibilidad_rango():
+    """
+    Disponibilidad de varios barberos en un rango de fechas con una sola consulta a CITA.
+    Parámetros: desde, hasta (YYYY-MM-DD), barberos (ids separados por coma, opcional)
+    y duracion (minutos que debe durar la cita, opcional).
+    Cada día se devuelve como máscara hexadecimal de slots (bit i = minuto i * slot_minutos):
+    'abiertos' por día (sin los slots ya pasados) y 'libres' por barbero y día
+    (sin los apartados por otros clientes).
+    """
+    try:
+        desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas, usa el formato YYYY-MM-DD'}), 400
+
+    if hasta < desde:
+        return jsonify({'error': 'El rango de fechas está invertido'}), 400
+    if (hasta - desde).days >= DISPONIBILIDAD_MAX_DIAS:
+        return jsonify({'error': f'El rango no puede superar {DISPONIBILIDAD_MAX_DIAS} días'}), 400
+
+    # Solo barberos activos (todos, o los pedidos)
+    activos = [b['barbero_id'] for b in obtener_barberos()]
+    pedidos = request.args.get('barberos')
+    if pedidos:
+        pedidos = {int(b) for b in pedidos.split(',') if b.strip().isdigit()}
+        activos = [b for b in activos if b in pedidos]
 
-        # Si ya no hay horarios disponibles para hoy
-        if fecha_obj == hoy and not horarios_disponibles:
-            return jsonify({'horarios': [], 'cerrado': True})
+    try:
+        ocupadas = ocupacion_citas(desde, hasta, activos)
+    except Exception as e:
+        print(f"ERROR en disponibilidad_rango: {str(e)}")
+        return jsonify({'error': f'Error del servidor: {str(e)}'}), 500
 
-        return jsonify({'horarios': horarios_disponibles})
+    slots = slots_necesarios(duracion_solicitada(request.args.get('duracion')))
+    dias = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+    retenidas = retenciones_ajenas(session['user_id'], dias)
+    abiertos = [mascara_apertura(obtener_horario_dia(dia)) & ~mascara_pasados(dia) for dia in dias]
+
+    return jsonify({
+        'slot_minutos': SLOT_MINUTOS,
+        'dias': [dia.isoformat() for dia in dias],
+        'abiertos': [format(m, 'x') for m in abiertos],
+        'libres': {
+            str(barbero_id): [
+                format(mascara_inicios(
+                    abierto & ~(ocupadas.get((barbero_id, dia), 0) | retenidas.get((barbero_id, dia), 0)), slots
+                ), 'x')
+                for dia, abierto in zip(dias, abiertos)
+            ]
+            for barbero_id in activos
+        }
+    })
+
+
+# --- ÍNDICE DE SLOTS LIBRES (próximo horario disponible) ---
+PROXIMO_HORIZONTE_DIAS = int(os.getenv("PROXIMO_HORIZONTE_DIAS", 14))
+
+class IndiceLibres:
+    """
+    Slots libres de todos los barberos activos en los próximos días:
+    {fecha: {barbero_id: mascara}} más la unión de cada día, que permite saltar
+    días completos con una sola operación. Se mantiene al día de forma
+    incremental al reservar, cancelar y cambiar horarios especiales.
+    """
+
+    def __init__(self, dias, abiertos, libres):
+        self.dias = dias              # fechas en orden
+        self._abiertos = abiertos     # {fecha: mascara de apertura}
+        self._libres = libres         # {fecha: {barbero_id: mascara}}
+        self._union = {dia: self._unir(dia) for dia in dias}
+        self._lock = threading.Lock()
+
+    def _unir(self, dia):
+        union = 0
+        for mascara in self._libres[dia].values():
+            union |= mascara
+        return union
+
+    def ocupar(self, barbero_id, dia, mascara):
+        with self._lock:
+            if dia in self._libres and barbero_id in self._libres[dia]:
+                self._libres[dia][barbero_id] &= ~mascara
+                self._union[dia] = self._unir(dia)
+
+    def liberar(self, barbero_id, dia, mascara):
+        with self._lock:
+            if dia in self._libres and barbero_id in self._libres[dia]:
+                self._libres[dia][barbero_id] |= mascara & self._abiertos[dia]
+                self._union[dia] |= self._libres[dia][barbero_id]
+
+    def recalcular_dia(self, dia, abiertos, ocupadas):
+        with self._lock:
+            if dia not in self._libres:
+                return
+            self._abiertos[dia] = abiertos
+            for barbero_id in self._libres[dia]:
+                self._libres[dia][barbero_id] = abiertos & ~ocupadas.get((barbero_id, dia), 0)
+            self._union[dia] = self._unir(dia)
+
+    def barberos(self):
+        return list(self._libres[self.dias[0]]) if self.dias else []
+
+    def proximo(self, barbero_id=None, dia_semana=None, ventana=-1, slots=1, ahora=None, excluir=None):
+        """
+        Primer slot libre (fecha, indice, barbero_id) que cumple los filtros, o None.
+        `ventana` es una máscara de los slots del día aceptables (-1 = todos),
+        `slots` cuántos slots seguidos debe haber libres desde el inicio y
+        `excluir` {(barbero_id, fecha): mascara} slots que no se deben ofrecer.
+        """
+        excluir = excluir or {}
+        ahora = ahora or datetime.now()
+        with self._lock:
+            for dia in self.dias:
+                if dia < ahora.date():
+                    continue
+                if dia_semana is not None and dia.weekday() != dia_semana:
+                    continue
+                filtro = ventana & ~mascara_pasados(dia, ahora)
+                if not self._union[dia] & filtro:
+                    continue
+                mejor = None
+                for barbero, mascara in self._libres[dia].items():
+                    if barbero_id is not None and barbero != barbero_id:
+                        continue
+                    mascara &= ~excluir.get((barbero, dia), 0)
+                    candidatos = mascara_inicios(mascara, slots) & filtro
+                    if candidatos:
+                        indice = (candidatos & -candidatos).bit_length() - 1
+                        if mejor is None or (indice, barbero) < mejor:
+                            mejor = (indice, barbero)
+                if mejor:
+                    return dia, mejor[0], mejor[1]
+        return None
+
+def cargar_indice_libres():
+    hoy = date.today()
+    dias = [hoy + timedelta(days=i) for i in range(PROXIMO_HORIZONTE_DIAS)]
+    barberos = [b['barbero_id'] for b in obtener_barberos()]
+    ocupadas = ocupacion_citas(dias[0], dias[-1], barberos)
+    abiertos = {dia: mascara_apertura(obtener_horario_dia(dia)) for dia in dias}
+    libres = {
+        dia: {b: abiertos[dia] & ~ocupadas.get((b, dia), 0) for b in barberos}
+        for dia in dias
+    }
+    return IndiceLibres(dias, abiertos, libres)
 
+indice_libres = CacheMemoria(cargar_indice_libres, int(os.getenv("INDICE_LIBRES_TTL", 300)))
+
+def marcar_ocupado(barbero_id, fecha_obj, mascara):
+    indice = indice_libres.cargado()
+    if indice is not None:
+        indice.ocupar(barbero_id, fecha_obj, mascara)
+
+def marcar_libre(barbero_id, fecha_obj, mascara):
+    indice = indice_libres.cargado()
+    if indice is not None:
+        indice.liberar(barbero_id, fecha_obj, mascara)
+
+def refrescar_dia_indice(fecha_obj):
+    """Recalcula un día del índice tras un cambio de horario especial."""
+    indice = indice_libres.cargado()
+    if indice is not None and fecha_obj in indice.dias:
+        abiertos = mascara_apertura(obtener_horario_dia(fecha_obj))
+        indice.recalcular_dia(fecha_obj, abiertos, ocupacion_citas(fecha_obj, fecha_obj, indice.barberos()))
+
+@app.route('/proximo_disponible')
+@login_required
+def proximo_disponible():
+    """
+    Primer horario libre con cualquier barbero (o con uno en concreto).
+    Filtros opcionales: barbero_id, dia_semana (0=lunes ... 6=domingo),
+    desde y hasta (HH:MM) para acotar la franja del día y duracion (minutos).
+    """
+    try:
+        barbero_id = request.args.get('barbero_id', type=int)
+        dia_semana = request.args.get('dia_semana', type=int)
+        desde = request.args.get('desde')
+        hasta = request.args.get('hasta')
+
+        ventana = -1
+        if desde or hasta:
+            ventana = mascara_rango(minutos_del_dia(desde or '00:00'), minutos_del_dia(hasta or '23:59') + 1)
+
+        slots = slots_necesarios(duracion_solicitada(request.args.get('duracion')))
+        libres = indice_libres.obtener()
+        encontrado = libres.proximo(
+            barbero_id, dia_semana, ventana, slots, excluir=retenciones_ajenas(session['user_id'], libres.dias)
+        )
+        if not encontrado:
+            return jsonify({'encontrado': False})
+
+        dia, indice, barbero = encontrado
+        datos = next((b for b in obtener_barberos() if b['barbero_id'] == barbero), {})
+        return jsonify({
+            'encontrado': True,
+            'fecha': dia.isoformat(),
+            'hora': hora_de_slot(indice),
+            'barbero_id': barbero,
+            'barbero_nombre': f"{datos.get('nombre', '')} {datos.get('apellido', '')}".strip()
+        })
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
     except Exception as e:
-        print(f"ERROR en obtener_horarios_disponibles: {str(e)}")
+        print(f"ERROR en proximo_disponible: {str(e)}")
         return jsonify({'error': f'Error del servidor: {str(e)}'}), 500
 
 
+# --- RETENCIÓN DE HORARIOS ---
+# Al elegir una hora el cliente la aparta unos minutos con un token: mientras
+# dure, los demás clientes no la ven libre y procesar_cita la convierte en la
+# cita. Las retenciones de un día forman un grupo en almacen_temporal con un
+# campo por (barbero, slot), así leer un día es una sola clave y apartar varios
+# slots es todo o nada. El vencimiento de cada campo lo maneja el almacén.
+RETENCION_MINUTOS = int(os.getenv("RETENCION_MINUTOS", 5))
+
+def clave_retenciones(fecha_obj):
+    return f"retenciones:{fecha_obj.isoformat()}"
+
+def retenciones_ajenas(usuario_id, dias):
+    """Slots de `dias` apartados por otros clientes: {(barbero_id, fecha): mascara}."""
+    mascaras = {}
+    for dia in dias:
+        for campo, retencion in almacen_temporal.campos(clave_retenciones(dia)).items():
+            if retencion['usuario_id'] == usuario_id:
+                continue
+            barbero_id, slot = map(int, campo.split(':'))
+            mascaras[(barbero_id, dia)] = mascaras.get((barbero_id, dia), 0) | (1 << slot)
+    return mascaras
+
+def soltar_retencion(usuario_id, token=None):
+    """Libera la retención vigente del usuario (sólo si coincide el token, si se da)."""
+    propia = almacen_temporal.obtener(f"retencion_usuario:{usuario_id}")
+    if not propia:
+        return
+    if token and propia['retencion']['token'] != token:
+        return
+    # Sólo los campos que siguen siendo suyos: si vencieron, otro pudo apartarlos
+    almacen_temporal.eliminar_campos(propia['clave'], propia['campos'], valor=propia['retencion'])
+    almacen_temporal.eliminar(f"retencion_usuario:{usuario_id}")
+
+@app.route('/retener_horario', methods=['POST'])
+@login_required
+def retener_horario():
+    """
+    Aparta (barbero_id, fecha, hora) durante RETENCION_MINUTOS para el cliente.
+    Cada cliente tiene a lo sumo una retención: elegir otra hora suelta la anterior.
+    """
+    try:
+        barbero_id = int(request.form.get('barbero_id', ''))
+        fecha_obj = datetime.strptime(request.form.get('fecha', ''), '%Y-%m-%d').date()
+        hora = a_hora(request.form.get('hora', '')).strftime('%H:%M')
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+
+    usuario_id = session['user_id']
+    duracion = duracion_solicitada(request.form.get('duracion'))
+    soltar_retencion(usuario_id)
+
+    ttl = RETENCION_MINUTOS * 60
+    retencion = {
+        'token': secrets.token_urlsafe(16),
+        'usuario_id': usuario_id,
+        'hora': hora,
+        'duracion': duracion,
+    }
+    clave = clave_retenciones(fecha_obj)
+    campos = [f"{barbero_id}:{slot}" for slot in slots_de_mascara(mascara_cita(hora, duracion))]
+    # Todo o nada: si otro cliente apartó cualquiera de esos slots, no se aparta ninguno
+    if not almacen_temporal.agregar_campos(clave, {campo: retencion for campo in campos}, ttl):
+        return jsonify({'error': 'Otro cliente está reservando ese horario. Elige otra hora.'}), 409
+    almacen_temporal.guardar(f"retencion_usuario:{usuario_id}",
+                             {'clave': clave, 'campos': campos, 'retencion': retencion}, ttl)
+
+    return jsonify({'token': retencion['token'], 'expira_en': ttl})
+
+
+class Contadores:
+    """Contadores de eventos de este proceso, p. ej. por qué se rechaza una reserva."""
+
+    def __init__(self):
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, nombre, cantidad=1):
+        with self._lock:
+            self._valores[nombre] = self._valores.get(nombre, 0) + cantidad
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._valores)
+
+# Resultados de procesar_cita (los lee `flask prueba-carga`)
+contadores_reserva = Contadores()
+
 @app.route('/procesar_cita', methods=['POST'])
 @login_required
+@idempotente
 def procesar_cita():
     try:
         barbero_id = request.form.get('barbero_id')
@@ -665,13 +1437,45 @@ def procesar_cita():
             flash('Todos los campos son obligatorios', 'danger')
             return redirect(url_for('reservar_cita'))
 
-        conn = get_db_connection()
+        # Los servicios se validan contra el catálogo antes de tocar la base de datos
+        por_id = catalogo_servicios.obtener()['por_id']
+        servicio_ids = []
+        for valor in servicios_seleccionados:
+            if not valor.isdigit() or int(valor) not in por_id:
+                flash('Alguno de los servicios elegidos ya no está disponible. Vuelve a seleccionarlos.', 'danger')
+                return redirect(url_for('reservar_cita'))
+            if int(valor) not in servicio_ids:
+                servicio_ids.append(int(valor))
+
+        barbero_id = int(barbero_id)
+        fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
+        duracion = duracion_servicios(servicio_ids)
+        inicio = minutos_del_dia(hora)
+
+        # La cita completa tiene que caber dentro del horario de ese día
+        horario_dia = obtener_horario_dia(fecha_obj)
+        if horario_dia.get('cerrado'):
+            flash('La barbería estará cerrada este día.', 'danger')
+            return redirect(url_for('reservar_cita'))
+        if mascara_cita(hora, duracion) & ~mascara_apertura(horario_dia):
+            flash('Los servicios elegidos no alcanzan a terminar dentro del horario de ese día. Elige otra hora.', 'danger')
+            return redirect(url_for('reservar_cita'))
+
+        # Un horario apartado por otro cliente se rechaza sin tocar la base de datos
+        if retenciones_ajenas(session['user_id'], [fecha_obj]).get((barbero_id, fecha_obj), 0) & mascara_cita(hora, duracion):
+            contadores_reserva.sumar('retenido')
+            flash('Otro cliente está terminando de reservar ese horario. Elige otra hora.', 'danger')
+            return redirect(url_for('reservar_cita'))
+
+        conn = get_db()
         cursor = conn.cursor()
 
-        # 1) Inserción atómica: sólo inserta si NO existe una cita activa del usuario ese día
+        # 1) Inserción atómica en un solo viaje: sólo inserta si el usuario NO tiene
+        #    una cita activa ese día y si el intervalo no se solapa con otra cita
+        #    activa del barbero (las filas leídas quedan bloqueadas hasta el commit)
         insert_sql = """
-            INSERT INTO CITA (usuario_id, barbero_id, fecha, hora, estado)
-            SELECT %s, %s, %s, %s, 'pendiente'
+            INSERT INTO CITA (usuario_id, barbero_id, fecha, hora, duracion_minutos, estado)
+            SELECT %s, %s, %s, %s, %s, 'pendiente'
             FROM DUAL
             WHERE NOT EXISTS (
                 SELECT 1
@@ -680,28 +1484,47 @@ def procesar_cita():
                   AND fecha = %s
                   AND estado IN ('pendiente','confirmada')
             )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM CITA
+                WHERE barbero_id = %s
+                  AND fecha = %s
+                  AND estado IN ('pendiente','confirmada')
+                  AND TIME_TO_SEC(hora) < %s
+                  AND TIME_TO_SEC(hora) + duracion_minutos * 60 > %s
+            )
         """
-        params = (session['user_id'], barbero_id, fecha, hora, session['user_id'], fecha)
+        params = (session['user_id'], barbero_id, fecha, hora, duracion,
+                  session['user_id'], fecha,
+                  barbero_id, fecha, (inicio + duracion) * 60, inicio * 60)
         cursor.execute(insert_sql, params)
 
         if cursor.rowcount == 0:
-            # No se insertó por existir ya una cita activa ese día
+            # No se insertó: o ya tiene cita ese día o el horario se ocupó
+            if usuario_tiene_cita_para_fecha(session['user_id'], fecha):
+                contadores_reserva.sumar('guardia_dia')
+                flash('Ya tienes una cita agendada para esta fecha. Solo puedes tener una cita por día.', 'danger')
+            else:
+                contadores_reserva.sumar('horario_solapado')
+                flash('Ese horario ya fue tomado para ese barbero. Elige otra hora.', 'danger')
             conn.rollback()
-            flash('Ya tienes una cita agendada para esta fecha. Solo puedes tener una cita por día.', 'danger')
             return redirect(url_for('reservar_cita'))
 
         cita_id = cursor.lastrowid
+        resumenes.mover_estado(cursor, fecha_obj, barbero_id, None, 'pendiente')
 
-        # 2) Insertar servicios de la cita
-        for servicio_id in servicios_seleccionados:
-            cursor.execute(
-                "INSERT INTO Cita_servicio (cita_id, servicio_id) VALUES (%s, %s)",
-                (cita_id, servicio_id)
-            )
+        # 2) Insertar servicios de la cita (executemany los envía como un único INSERT de varias filas)
+        cursor.executemany(
+            "INSERT INTO Cita_servicio (cita_id, servicio_id) VALUES (%s, %s)",
+            [(cita_id, servicio_id) for servicio_id in servicio_ids]
+        )
 
         conn.commit()
         cursor.close()
-        conn.close()
+        contadores_reserva.sumar('reservada')
+        marcar_ocupado(barbero_id, fecha_obj, mascara_cita(hora, duracion))
+        # La retención ya es una cita
+        soltar_retencion(session['user_id'], request.form.get('retencion_token'))
 
         flash('¡Cita reservada exitosamente! Te esperamos en la fecha y hora seleccionada.', 'success')
         return redirect(url_for('mis_citas'))
@@ -709,16 +1532,22 @@ def procesar_cita():
     except mysql.connector.IntegrityError as ie:
         # Por ejemplo: choque con UNIQUE(barbero_id, fecha, hora)
         if 'uniq_barbero_slot' in str(ie).lower():
+            contadores_reserva.sumar('uniq_barbero_slot')
             flash('Ese horario ya fue tomado para ese barbero. Elige otra hora.', 'danger')
         else:
+            contadores_reserva.sumar('integridad')
             flash('No se pudo reservar por una restricción de base de datos.', 'danger')
-        if 'conn' in locals():
-            conn.rollback(); cursor.close(); conn.close()
+        get_db().rollback()
         return redirect(url_for('reservar_cita'))
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback(); cursor.close(); conn.close()
-        flash('Error al procesar la cita: ' + str(e), 'danger')
+        get_db().rollback()
+        if getattr(e, 'errno', None) == 1213:
+            # Deadlock: otra reserva tomó el mismo horario al mismo tiempo
+            contadores_reserva.sumar('deadlock')
+            flash('Ese horario ya fue tomado para ese barbero. Elige otra hora.', 'danger')
+        else:
+            contadores_reserva.sumar('error')
+            flash('Error al procesar la cita: ' + str(e), 'danger')
         return redirect(url_for('reservar_cita'))
 
 
@@ -735,18 +1564,11 @@ def verificar_cita_usuario():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def usuario_tiene_cita_para_fecha(usuario_id, fecha, conn_ext=None):
+def usuario_tiene_cita_para_fecha(usuario_id, fecha):
     """
     True si el usuario ya tiene una cita ACTIVA (pendiente/confirmada) ese día.
     """
-    close_after = False
-    if conn_ext is None:
-        conn = get_db_connection()
-        close_after = True
-    else:
-        conn = conn_ext
-
-    cursor = conn.cursor(dictionary=True)
+    cursor = get_db().cursor(dictionary=True)
     try:
         cursor.execute("""
             SELECT 1
@@ -762,12 +1584,31 @@ def usuario_tiene_cita_para_fecha(usuario_id, fecha, conn_ext=None):
         return True 
     finally:
         cursor.close()
-        if close_after:
-            conn.close()
 
 
+# Estados en que la cita ocupa su horario y todavía se puede cancelar o confirmar
+ESTADOS_ACTIVOS = ('pendiente', 'confirmada')
+
+def registrar_cancelacion(cursor, cita_id, motivo, cancelado_por):
+    """
+    Marca la cita como cancelada e inserta su fila en Cancelacion. La cita guarda
+    además la última cancelación (motivo, fecha, quién) para que los listados
+    del administrador no tengan que buscarla en Cancelacion.
+    """
+    ahora = datetime.now().replace(microsecond=0)
+    cursor.execute("""
+        INSERT INTO Cancelacion (cita_id, motivo, cancelado_por, fecha_cancelacion)
+        VALUES (%s, %s, %s, %s)
+    """, (cita_id, motivo, cancelado_por, ahora))
+    cursor.execute("""
+        UPDATE CITA
+        SET estado = 'cancelada', cancelacion_motivo = %s, cancelacion_fecha = %s, cancelado_por = %s
+        WHERE cita_id = %s
+    """, (motivo, ahora, cancelado_por, cita_id))
+
 @app.route('/cancelar_cita', methods=['POST'])
 @login_required
+@idempotente
 def cancelar_cita():
     try:
         cita_id = request.form.get('cita_id')
@@ -777,38 +1618,38 @@ def cancelar_cita():
             flash('Debes seleccionar un motivo de cancelación', 'danger')
             return redirect(url_for('mis_citas'))
 
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
 
         # Verificar que la cita pertenece al usuario actual
-        cursor.execute("SELECT usuario_id FROM CITA WHERE cita_id = %s", (cita_id,))
+        cursor.execute("SELECT usuario_id, barbero_id, fecha, hora, duracion_minutos, estado FROM CITA WHERE cita_id = %s FOR UPDATE", (cita_id,))
         cita = cursor.fetchone()
 
         if not cita or cita[0] != session['user_id']:
             flash('No tienes permiso para cancelar esta cita', 'danger')
             return redirect(url_for('mis_citas'))
 
-        # Actualizar el estado de la cita
-        cursor.execute("UPDATE CITA SET estado = 'cancelada' WHERE cita_id = %s", (cita_id,))
+        # Otra pestaña o el barbero ya la cancelaron: su horario puede estar reservado de nuevo
+        if cita[5] not in ESTADOS_ACTIVOS:
+            flash(f'Esta cita ya no se puede cancelar (está {cita[5]}).', 'warning')
+            return redirect(url_for('mis_citas'))
+
+        # Registrar en la tabla Cancelacion y dejar el resumen en la cita
+        registrar_cancelacion(cursor, cita_id, motivo, 'cliente')
 
-        # Registrar en la tabla Cancelacion
-        cursor.execute("""
-            INSERT INTO Cancelacion (cita_id, motivo, cancelado_por)
-            VALUES (%s, %s, %s)
-        """, (cita_id, motivo, 'cliente'))
+        # Resúmenes del tablero, en la misma transacción
+        resumenes.mover_estado(cursor, cita[2], cita[1], cita[5], 'cancelada')
+        resumenes.sumar_cancelacion(cursor, cita[2], cita[1], 'cliente')
 
         conn.commit()
         cursor.close()
-        conn.close()
+        marcar_libre(cita[1], cita[2], mascara_cita(cita[3], cita[4]))
 
         flash('Cita cancelada exitosamente', 'success')
         return redirect(url_for('mis_citas'))
 
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            cursor.close()
-            conn.close()
+        get_db().rollback()
         flash('Error al cancelar la cita: ' + str(e), 'danger')
         return redirect(url_for('mis_citas'))
 
@@ -817,7 +1658,7 @@ def cancelar_cita():
 @app.route('/mis_citas')
 @login_required
 def mis_citas():
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     # Obtener citas del usuario
@@ -840,32 +1681,13 @@ def mis_citas():
     citas = cursor.fetchall()
     
     cursor.close()
-    conn.close()
     
     return render_template('mis_citas.html', citas=citas)
 
 # ------ VER BARBEROS ------------------------------------------------------------------------------------------------------------------------------------------------------
 @app.route('/barberos')
 def ver_barberos():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    cursor.execute("""
-        SELECT 
-            b.barbero_id,
-            b.biografia,
-            b.foto_perfil,
-            u.nombre,
-            u.apellido
-        FROM Barbero b
-        JOIN USUARIO u ON b.usuario_id = u.usuario_id
-        WHERE b.estado = 1       -- solo barberos activos
-        ORDER BY u.nombre, u.apellido
-    """)
-    barberos = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    barberos = obtener_barberos()  # solo barberos activos
 
     return render_template('barberos.html', barberos=barberos)
 
@@ -894,7 +1716,7 @@ def editar_perfil_barbero():
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     # Buscar datos del barbero logueado
@@ -930,6 +1752,7 @@ def editar_perfil_barbero():
                 WHERE barbero_id = %s
             """, (biografia, filename, barbero['barbero_id']))
             conn.commit()
+            plantilla_barberos.invalidar()
             flash('Perfil actualizado exitosamente', 'success')
             return redirect(url_for('editar_perfil_barbero'))
         except Exception as e:
@@ -937,10 +1760,8 @@ def editar_perfil_barbero():
             flash('Error al actualizar el perfil: ' + str(e), 'danger')
         finally:
             cursor.close()
-            conn.close()
     
     cursor.close()
-    conn.close()
     return render_template('barbero_perfil.html', barbero=barbero)
 
 # APARTADO PARA CAMBIAR EL ESTADO DE LA CITA
@@ -957,27 +1778,35 @@ def cambiar_estado_cita():
     if nuevo_estado not in ['confirmada', 'cancelada']:
         return jsonify({'error': 'Estado inválido'}), 400
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     try:
         # Verificar que la cita pertenece al barbero logueado
         cursor.execute("""
-            SELECT c.cita_id 
+            SELECT c.cita_id, c.barbero_id, c.fecha, c.hora, c.duracion_minutos, c.estado
             FROM CITA c
             JOIN Barbero b ON c.barbero_id = b.barbero_id
             WHERE c.cita_id = %s AND b.usuario_id = %s
+            FOR UPDATE
         """, (cita_id, session['user_id']))
         cita = cursor.fetchone()
 
         if not cita:
             cursor.close()
-            conn.close()
             return jsonify({'error': 'Cita no encontrada o no autorizada'}), 404
 
+        # Una cita cancelada o ya atendida no vuelve atrás: su horario pudo reservarse de nuevo
+        if cita[5] not in ESTADOS_ACTIVOS:
+            return jsonify({'error': f'La cita ya está {cita[5]}'}), 409
+
         # Actualizar estado
         cursor.execute("UPDATE CITA SET estado = %s WHERE cita_id = %s", (nuevo_estado, cita_id))
+        resumenes.mover_estado(cursor, cita[2], cita[1], cita[5], nuevo_estado)
         conn.commit()
+        # Sólo cambia el índice si la cita deja de ocupar su horario (confirmar no lo toca)
+        if nuevo_estado not in ESTADOS_ACTIVOS:
+            marcar_libre(cita[1], cita[2], mascara_cita(cita[3], cita[4]))
 
         return jsonify({'success': True, 'estado': nuevo_estado})
     except Exception as e:
@@ -985,11 +1814,11 @@ def cambiar_estado_cita():
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
-        conn.close()
 
 # CANCELACION DE CITA (DESDE EL BARBERO)
 @app.route('/barbero/cancelar_cita', methods=['POST'])
 @login_required
+@idempotente
 def barbero_cancelar_cita():
     if session.get('user_role') != 2:  # Solo barberos
         flash('No tienes permiso para esta acción', 'danger')
@@ -1006,16 +1835,17 @@ def barbero_cancelar_cita():
         flash('El motivo no puede superar los 255 caracteres.', 'danger')
         return redirect(url_for('barber_dashboard'))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     try:
         # Verificar que la cita pertenece al barbero logueado
         cursor.execute("""
-            SELECT c.cita_id 
+            SELECT c.cita_id, c.barbero_id, c.fecha, c.hora, c.duracion_minutos, c.estado
             FROM CITA c
             JOIN Barbero b ON c.barbero_id = b.barbero_id
             WHERE c.cita_id = %s AND b.usuario_id = %s
+            FOR UPDATE
         """, (cita_id, session['user_id']))
         cita = cursor.fetchone()
 
@@ -1023,23 +1853,26 @@ def barbero_cancelar_cita():
             flash('No tienes permiso para cancelar esta cita', 'danger')
             return redirect(url_for('barber_dashboard'))
 
-        # Cambiar estado de la cita
-        cursor.execute("UPDATE CITA SET estado = 'cancelada' WHERE cita_id = %s", (cita_id,))
+        # El cliente (u otra pestaña) ya la cancelaron: su horario puede estar reservado de nuevo
+        if cita[5] not in ESTADOS_ACTIVOS:
+            flash(f'Esta cita ya no se puede cancelar (está {cita[5]}).', 'warning')
+            return redirect(url_for('barber_dashboard'))
 
-        # Guardar motivo en Cancelacion
-        cursor.execute("""
-            INSERT INTO Cancelacion (cita_id, motivo, cancelado_por)
-            VALUES (%s, %s, 'barbero')
-        """, (cita_id, motivo))
+        # Guardar motivo en Cancelacion y dejar el resumen en la cita
+        registrar_cancelacion(cursor, cita_id, motivo, 'barbero')
+
+        # Resúmenes del tablero, en la misma transacción
+        resumenes.mover_estado(cursor, cita[2], cita[1], cita[5], 'cancelada')
+        resumenes.sumar_cancelacion(cursor, cita[2], cita[1], 'barbero')
 
         conn.commit()
+        marcar_libre(cita[1], cita[2], mascara_cita(cita[3], cita[4]))
         flash('Cita cancelada exitosamente con motivo registrado.', 'success')
     except Exception as e:
         conn.rollback()
         flash(f'Error al cancelar la cita: {str(e)}', 'danger')
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for('barber_dashboard'))
 
@@ -1051,7 +1884,7 @@ def barbero_agenda():
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     # 1. Obtener datos del barbero logueado
@@ -1086,11 +1919,125 @@ def barbero_agenda():
     citas_futuras = cursor.fetchall()
 
     cursor.close()
-    conn.close()
 
     return render_template("barbero_agenda.html", barbero=barbero, citas_futuras=citas_futuras)
 
-# --- NUEVO: helpers de slots para el día ---
+# --- MOTOR DE DISPONIBILIDAD ---
+# Un día de un barbero se representa como un entero donde el bit i es el slot que
+# empieza en el minuto i * SLOT_MINUTOS desde las 00:00. Abrir, ocupar, pasar y
+# liberar horarios son operaciones de bits sobre esas máscaras.
+SLOT_MINUTOS = int(os.getenv("SLOT_MINUTOS", 30))
+
+def minutos_del_dia(valor):
+    hora = a_hora(valor)
+    return hora.hour * 60 + hora.minute
+
+def hora_de_slot(indice):
+    minutos = indice * SLOT_MINUTOS
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def mascara_rango(desde_min, hasta_min):
+    """Máscara de los slots que empiezan dentro de [desde_min, hasta_min)."""
+    primero = -(-desde_min // SLOT_MINUTOS)
+    ultimo = -(-hasta_min // SLOT_MINUTOS)
+    if ultimo <= primero:
+        return 0
+    return ((1 << (ultimo - primero)) - 1) << primero
+
+def en_grilla(valor):
+    """True si la hora cae en el inicio de un slot (múltiplo de SLOT_MINUTOS desde las 00:00)."""
+    return minutos_del_dia(valor) % SLOT_MINUTOS == 0
+
+def mascara_apertura(horario):
+    # Los slots se cuentan desde las 00:00: una apertura fuera de la grilla
+    # perdería su primer slot, por eso admin_horarios sólo acepta horas en grilla
+    if horario.get('cerrado'):
+        return 0
+    return mascara_rango(minutos_del_dia(horario['hora_inicio']), minutos_del_dia(horario['hora_fin']))
+
+def mascara_pasados(fecha_obj, ahora=None):
+    """Slots que ya empezaron; sólo hay en el día de hoy."""
+    ahora = ahora or datetime.now()
+    if fecha_obj != ahora.date():
+        return 0
+    segundos = ahora.hour * 3600 + ahora.minute * 60 + ahora.second
+    return (1 << (segundos // (SLOT_MINUTOS * 60) + 1)) - 1
+
+def slots_de_mascara(mascara):
+    """Índices de los bits encendidos, de menor a mayor."""
+    indices = []
+    while mascara:
+        bajo = mascara & -mascara
+        indices.append(bajo.bit_length() - 1)
+        mascara ^= bajo
+    return indices
+
+def mascara_intervalo(inicio, fin):
+    """Slots que toca el intervalo [inicio, fin) en minutos, aunque sea en parte."""
+    primero = inicio // SLOT_MINUTOS
+    ultimo = -(-fin // SLOT_MINUTOS)
+    if ultimo <= primero:
+        return 0
+    return ((1 << (ultimo - primero)) - 1) << primero
+
+def mascara_cita(hora, duracion_minutos=None):
+    """Slots que ocupa una cita que empieza a `hora` y dura `duracion_minutos`."""
+    inicio = minutos_del_dia(hora)
+    return mascara_intervalo(inicio, inicio + (duracion_minutos or SLOT_MINUTOS))
+
+def slots_necesarios(duracion_minutos):
+    return max(1, -(-duracion_minutos // SLOT_MINUTOS))
+
+def mascara_inicios(libres, slots):
+    """Slots donde pueden empezar `slots` slots libres seguidos."""
+    inicios = libres
+    for desplazamiento in range(1, slots):
+        inicios &= libres >> desplazamiento
+    return inicios
+
+def duracion_servicios(servicio_ids):
+    """Duración total (minutos) de los servicios elegidos, según el catálogo."""
+    por_id = catalogo_servicios.obtener()['por_id']
+    total = 0
+    for servicio_id in servicio_ids:
+        servicio = por_id.get(int(servicio_id)) if str(servicio_id).isdigit() else None
+        if servicio:
+            total += servicio.get('duracion_minutos') or 0
+    return max(total, SLOT_MINUTOS)
+
+def duracion_solicitada(valor):
+    """Duración pedida por el cliente en las consultas de disponibilidad (minutos)."""
+    try:
+        return min(max(int(valor), SLOT_MINUTOS), 24 * 60)
+    except (TypeError, ValueError):
+        return SLOT_MINUTOS
+
+def ocupacion_citas(fecha_desde, fecha_hasta, barbero_ids):
+    """
+    Máscaras de slots ocupados (citas pendientes/confirmadas) en una sola consulta.
+    Devuelve {(barbero_id, fecha): mascara}; las combinaciones sin citas no aparecen.
+    El choque de una cita nueva no se busca aquí sino en el INSERT de
+    procesar_cita (NOT EXISTS sobre CITA), que también ve las reservas que otros
+    procesos hacen al mismo tiempo.
+    """
+    if not barbero_ids:
+        return {}
+    marcadores = ', '.join(['%s'] * len(barbero_ids))
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT barbero_id, fecha, hora, duracion_minutos
+        FROM CITA
+        WHERE barbero_id IN ({marcadores})
+          AND fecha BETWEEN %s AND %s
+          AND estado IN ('pendiente','confirmada')
+    """, (*barbero_ids, fecha_desde, fecha_hasta))
+    ocupados = {}
+    for fila in cursor.fetchall():
+        clave = (fila['barbero_id'], fila['fecha'])
+        ocupados[clave] = ocupados.get(clave, 0) | mascara_cita(fila['hora'], fila['duracion_minutos'])
+    cursor.close()
+    return ocupados
+
 def generar_slots_dia(barbero_id, fecha_obj):
     """
     Devuelve un dict con:
@@ -1103,33 +2050,20 @@ def generar_slots_dia(barbero_id, fecha_obj):
     if horario.get('cerrado'):
         return {'cerrado': True, 'desde': None, 'hasta': None, 'slots': []}
 
-    desde_dt = datetime.combine(fecha_obj, horario['hora_inicio'])
-    hasta_dt = datetime.combine(fecha_obj, horario['hora_fin'])
+    # Horas ya ocupadas por ese barbero ese día (pendiente/confirmada)
+    ocupados = ocupacion_citas(fecha_obj, fecha_obj, [barbero_id]).get((barbero_id, fecha_obj), 0)
+    pasados = mascara_pasados(fecha_obj)
 
-    # Buscar horas ya ocupadas por ese barbero hoy (pendiente/confirmada)
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("""
-        SELECT TIME_FORMAT(hora, '%H:%i') AS h
-        FROM CITA
-        WHERE barbero_id = %s AND fecha = %s AND estado IN ('pendiente','confirmada')
-    """, (barbero_id, fecha_obj))
-    ocupadas = {row['h'] for row in cur.fetchall()}
-    cur.close(); conn.close()
-
-    ahora_time = datetime.now().time()
     slots = []
-    actual = desde_dt
-    while actual < hasta_dt:
-        hhmm = actual.strftime('%H:%M')
-        if fecha_obj == date.today() and actual.time() <= ahora_time:
+    for i in slots_de_mascara(mascara_apertura(horario)):
+        bit = 1 << i
+        if pasados & bit:
             estado = 'pasado'
-        elif hhmm in ocupadas:
+        elif ocupados & bit:
             estado = 'reservado'
         else:
             estado = 'disponible'
-        slots.append({'hora': hhmm, 'estado': estado})
-        actual += timedelta(minutes=30)
+        slots.append({'hora': hora_de_slot(i), 'estado': estado})
 
     return {
         'cerrado': False,
@@ -1176,7 +2110,7 @@ def registrar_barbero():
         password_temp = "123456"
         hashed_password = generate_password_hash(password_temp)
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
@@ -1199,13 +2133,15 @@ def registrar_barbero():
                 (usuario_id, fecha_contratacion, 1)  # estado=1 (activo)
             )
             
+            # Email de notificación (en la misma transacción; se envía en segundo plano)
+            enviar_email_registro_barbero(email, f"{nombre} {apellido}", password_temp)
+            
             conn.commit()
+            plantilla_barberos.invalidar()
+            indice_libres.invalidar()
+            despertar_trabajador_correo()
             
-            # Enviar email de notificación
-            if enviar_email_registro_barbero(email, f"{nombre} {apellido}", password_temp):
-                flash(f'Barbero registrado exitosamente! Se ha enviado un email con las credenciales a {email}', 'success')
-            else:
-                flash(f'Barbero registrado exitosamente! Contraseña temporal: {password_temp} (No se pudo enviar el email)', 'warning')
+            flash(f'Barbero registrado exitosamente! Se enviará un email con las credenciales a {email}', 'success')
             
             return redirect(url_for('registrar_barbero'))
             
@@ -1214,7 +2150,6 @@ def registrar_barbero():
             flash('Error al registrar el barbero: ' + str(e), 'danger')
         finally:
             cursor.close()
-            conn.close()
     
     return render_template('registrar_barbero.html')
 
@@ -1226,7 +2161,7 @@ def editar_barbero(barbero_id):
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     if request.method == 'POST':
@@ -1264,6 +2199,7 @@ def editar_barbero(barbero_id):
             )
             
             conn.commit()
+            plantilla_barberos.invalidar()
             flash('Información del barbero actualizada exitosamente', 'success')
             return redirect(url_for('listar_barberos'))
             
@@ -1273,7 +2209,6 @@ def editar_barbero(barbero_id):
             return redirect(url_for('editar_barbero', barbero_id=barbero_id))
         finally:
             cursor.close()
-            conn.close()
     else:
         try:
             # Obtener información del barbero
@@ -1296,7 +2231,6 @@ def editar_barbero(barbero_id):
             return redirect(url_for('listar_barberos'))
         finally:
             cursor.close()
-            conn.close()
 
 # Lista de barberos
 @app.route('/admin/barberos')
@@ -1306,25 +2240,12 @@ def listar_barberos():
         flash('No tienes permiso para acceder a esta página', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     try:
-        # Consulta para obtener todos los barberos con su información de usuario
-        cursor.execute("""
-            SELECT u.usuario_id, u.nombre, u.apellido, u.email, u.telefono, 
-                   b.barbero_id, b.fecha_contratacion, b.estado
-            FROM USUARIO u
-            JOIN Barbero b ON u.usuario_id = b.usuario_id
-            ORDER BY u.nombre, u.apellido
-        """)
-        barberos = cursor.fetchall()
+        # Todos los barberos con su información de usuario
+        barberos = obtener_barberos(solo_activos=False)
     except Exception as e:
         flash('Error al obtener la lista de barberos: ' + str(e), 'danger')
         barberos = []
-    finally:
-        cursor.close()
-        conn.close()
     
     return render_template('listar_barberos.html', barberos=barberos)
 
@@ -1336,7 +2257,7 @@ def cambiar_estado_barbero(barbero_id):
         flash('No tienes permiso para realizar esta acción', 'danger')
         return redirect(url_for('client_dashboard'))
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     try:
@@ -1356,6 +2277,8 @@ def cambiar_estado_barbero(barbero_id):
             (nuevo_estado, barbero_id)
         )
         conn.commit()
+        plantilla_barberos.invalidar()
+        indice_libres.invalidar()
         
         estado_texto = "activado" if nuevo_estado == 1 else "desactivado"
         flash(f'Estado del barbero actualizado: {estado_texto}', 'success')
@@ -1364,44 +2287,80 @@ def cambiar_estado_barbero(barbero_id):
         flash('Error al cambiar el estado del barbero: ' + str(e), 'danger')
     finally:
         cursor.close()
-        conn.close()
     
     return redirect(url_for('listar_barberos'))
 
 # Función para enviar email de notificación al barbero
 def enviar_email_registro_barbero(email, nombre, password_temp):
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = email
-        msg['Subject'] = "Bienvenido a BLANK concept - Tus credenciales de acceso"
-        
-        body = f"""
-        <h2>¡Bienvenido {nombre}!</h2>
-        <p>Has sido registrado como barbero en BLANK concept.</p>
-        <p>Tus credenciales de acceso son:</p>
-        <ul>
-            <li><strong>Email:</strong> {email}</li>
-            <li><strong>Contraseña temporal:</strong> {password_temp}</li>
-        </ul>
-        <p>Por seguridad, te recomendamos cambiar tu contraseña después de iniciar sesión por primera vez.</p>
-        <p>Puedes acceder al sistema aquí: <a href="http://localhost:5000/login">Iniciar sesión</a></p>
-        <p>Si no reconoces este registro, por favor contacta al administrador.</p>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        
-        return True
-    except Exception as e:
-        print(f"Error al enviar email de registro: {e}")
-        return False
+    body = f"""
+    <h2>¡Bienvenido {nombre}!</h2>
+    <p>Has sido registrado como barbero en BLANK concept.</p>
+    <p>Tus credenciales de acceso son:</p>
+    <ul>
+        <li><strong>Email:</strong> {email}</li>
+        <li><strong>Contraseña temporal:</strong> {password_temp}</li>
+    </ul>
+    <p>Por seguridad, te recomendamos cambiar tu contraseña después de iniciar sesión por primera vez.</p>
+    <p>Puedes acceder al sistema aquí: <a href="http://localhost:5000/login">Iniciar sesión</a></p>
+    <p>Si no reconoces este registro, por favor contacta al administrador.</p>
+    """
+    encolar_correo(email, "Bienvenido a BLANK concept - Tus credenciales de acceso", body)
 
 # ---------------------- ADMIN: LISTADO DE TODAS LAS CITAS ----------------------
+ADMIN_CITAS_POR_PAGINA = int(os.getenv("ADMIN_CITAS_POR_PAGINA", 50))
+
+def filtros_citas(args):
+    """Condiciones SQL (sobre el alias c) y parámetros de los filtros del listado de citas."""
+    condiciones, params = [], []
+    if args.get('fecha_inicio'):
+        condiciones.append("c.fecha >= %s")
+        params.append(args['fecha_inicio'])
+    if args.get('fecha_fin'):
+        condiciones.append("c.fecha <= %s")
+        params.append(args['fecha_fin'])
+    if args.get('estado') and args['estado'] != 'todos':
+        condiciones.append("c.estado = %s")
+        params.append(args['estado'])
+    if args.get('barbero_id') and args['barbero_id'].isdigit():
+        condiciones.append("c.barbero_id = %s")
+        params.append(int(args['barbero_id']))
+    busqueda = busqueda_clientes(args.get('q'))
+    if busqueda:
+        # Índice FULLTEXT (ngram) sobre nombre, apellido, email y teléfono
+        condiciones.append("""c.usuario_id IN (
+            SELECT usuario_id FROM USUARIO
+            WHERE MATCH(nombre, apellido, email, telefono) AGAINST (%s IN BOOLEAN MODE)
+        )""")
+        params.append(busqueda)
+    elif termino_demasiado_corto(args.get('q')):
+        # Sólo palabras de un carácter: no se puede buscar, pero tampoco es "sin filtro"
+        condiciones.append("1=0")
+    return condiciones, params
+
+def busqueda_clientes(texto):
+    """
+    Convierte lo que escribe el administrador en una búsqueda booleana: cada
+    palabra debe aparecer (como frase, así el parser ngram la busca completa).
+    Las palabras de un solo carácter no alcanzan un ngram y se ignoran; si no
+    queda ninguna devuelve '' (ver termino_demasiado_corto).
+    """
+    palabras = [p.replace('"', '') for p in (texto or '').split()]
+    return ' '.join(f'+"{p}"' for p in palabras if len(p) >= 2)
+
+def termino_demasiado_corto(texto):
+    """Hay algo escrito en la búsqueda pero ninguna palabra alcanza para buscar."""
+    return bool((texto or '').strip()) and not busqueda_clientes(texto)
+
+def cursor_de_cita(cita):
+    return f"{cita['fecha'].isoformat()}_{cita['hora_orden']}_{cita['cita_id']}"
+
+def leer_cursor(valor):
+    """'YYYY-MM-DD_HH:MM:SS_id' -> (fecha, hora, cita_id), o None si no es válido."""
+    try:
+        fecha, hora, cita_id = valor.split('_')
+        return datetime.strptime(fecha, '%Y-%m-%d').date(), a_hora(hora).strftime('%H:%M:%S'), int(cita_id)
+    except (AttributeError, ValueError):
+        return None
 
 @app.route('/admin/citas')
 @login_required
@@ -1415,214 +2374,404 @@ def admin_citas():
     fecha_fin = request.args.get('fecha_fin')        # 'YYYY-MM-DD'
     estado = request.args.get('estado')              # pendiente, confirmada, completada, cancelada, no asistio
     barbero_id = request.args.get('barbero_id')      # int
+    q = request.args.get('q', '').strip()            # nombre, teléfono o email del cliente
+    if termino_demasiado_corto(q):
+        flash('Término de búsqueda demasiado corto: escribe al menos 2 caracteres por palabra.', 'warning')
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    # --- paginación por cursor sobre (fecha, hora, cita_id), de la más nueva a la más vieja ---
+    despues = leer_cursor(request.args.get('despues'))  # página siguiente (más viejas)
+    antes = leer_cursor(request.args.get('antes'))      # página anterior (más nuevas)
 
     # Para el selector de barberos
-    cursor.execute("""
-        SELECT b.barbero_id, u.nombre, u.apellido
-        FROM Barbero b
-        JOIN USUARIO u ON b.usuario_id = u.usuario_id
-        ORDER BY u.nombre, u.apellido
-    """)
-    barberos = cursor.fetchall()
-
-    # Construir SQL con filtros dinámicos
-    query = """
-    SELECT 
-        c.cita_id,
-        c.fecha,
-        TIME_FORMAT(c.hora, '%H:%i') AS hora,
-        c.estado,
-        uc.nombre  AS cliente_nombre,
-        uc.apellido AS cliente_apellido,
-        ub.nombre  AS barbero_nombre,
-        ub.apellido AS barbero_apellido,
-        GROUP_CONCAT(s.nombre ORDER BY s.nombre SEPARATOR ', ') AS servicios,
-        can.motivo AS motivo_cancelacion,
-        can.fecha_cancelacion,
-        can.cancelado_por
-    FROM CITA c
-    JOIN USUARIO uc         ON c.usuario_id = uc.usuario_id
-    JOIN Barbero b          ON c.barbero_id = b.barbero_id
-    JOIN USUARIO ub         ON b.usuario_id = ub.usuario_id
-    LEFT JOIN Cita_servicio cs ON c.cita_id = cs.cita_id
-    LEFT JOIN Servicios s      ON cs.servicio_id = s.servicio_id
-    /* ÚLTIMA cancelación por cita (si existiera) */
-    LEFT JOIN (
-        SELECT c1.*
-        FROM Cancelacion c1
-        JOIN (
-            SELECT cita_id, MAX(fecha_cancelacion) AS max_fecha
-            FROM Cancelacion
-            GROUP BY cita_id
-        ) c2 
-          ON c1.cita_id = c2.cita_id 
-         AND c1.fecha_cancelacion = c2.max_fecha
-    ) can ON can.cita_id = c.cita_id
-    WHERE 1=1
-    """
-    params = []
-
-    if fecha_inicio:
-        query += " AND c.fecha >= %s"
-        params.append(fecha_inicio)
-    if fecha_fin:
-        query += " AND c.fecha <= %s"
-        params.append(fecha_fin)
-    if estado and estado != 'todos':
-        query += " AND c.estado = %s"
-        params.append(estado)
-    if barbero_id and barbero_id.isdigit():
-        query += " AND c.barbero_id = %s"
-        params.append(int(barbero_id))
-
-    query += """
-        GROUP BY c.cita_id
-        ORDER BY c.fecha DESC, c.hora DESC
-        LIMIT 500
-    """  # LIMITE de seguridad
+    barberos = obtener_barberos(solo_activos=False)
 
-    cursor.execute(query, tuple(params))
-    citas = cursor.fetchall()
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+
+    # 1) Página de ids: recorrido acotado del índice (fecha, hora) desde el cursor
+    condiciones, params = filtros_citas(request.args)
+    clave = antes or despues
+    if clave:
+        op = '>' if antes else '<'
+        condiciones.append(f"(c.fecha {op} %s OR (c.fecha = %s AND (c.hora {op} %s OR (c.hora = %s AND c.cita_id {op} %s))))")
+        params += [clave[0], clave[0], clave[1], clave[1], clave[2]]
+    orden = 'ASC' if antes else 'DESC'
+    cursor.execute(f"""
+        SELECT c.cita_id
+        FROM CITA c
+        WHERE {' AND '.join(condiciones) or '1=1'}
+        ORDER BY c.fecha {orden}, c.hora {orden}, c.cita_id {orden}
+        LIMIT %s
+    """, (*params, ADMIN_CITAS_POR_PAGINA + 1))
+    ids = [fila['cita_id'] for fila in cursor.fetchall()]
+    hay_mas = len(ids) > ADMIN_CITAS_POR_PAGINA
+    ids = ids[:ADMIN_CITAS_POR_PAGINA]
+
+    # 2) Detalle sólo de las citas de la página
+    citas = []
+    if ids:
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"""
+        SELECT 
+            c.cita_id,
+            c.fecha,
+            TIME_FORMAT(c.hora, '%H:%i') AS hora,
+            TIME_FORMAT(c.hora, '%H:%i:%s') AS hora_orden,
+            c.estado,
+            uc.nombre  AS cliente_nombre,
+            uc.apellido AS cliente_apellido,
+            ub.nombre  AS barbero_nombre,
+            ub.apellido AS barbero_apellido,
+            GROUP_CONCAT(s.nombre ORDER BY s.nombre SEPARATOR ', ') AS servicios,
+            c.cancelacion_motivo AS motivo_cancelacion,
+            c.cancelacion_fecha AS fecha_cancelacion,
+            c.cancelado_por
+        FROM CITA c
+        JOIN USUARIO uc         ON c.usuario_id = uc.usuario_id
+        JOIN Barbero b          ON c.barbero_id = b.barbero_id
+        JOIN USUARIO ub         ON b.usuario_id = ub.usuario_id
+        LEFT JOIN Cita_servicio cs ON c.cita_id = cs.cita_id
+        LEFT JOIN Servicios s      ON cs.servicio_id = s.servicio_id
+        WHERE c.cita_id IN ({marcadores})
+        GROUP BY c.cita_id
+        ORDER BY c.fecha DESC, c.hora DESC, c.cita_id DESC
+        """, ids)
+        citas = cursor.fetchall()
 
     cursor.close()
-    conn.close()
+
+    filtros = dict(
+        fecha_inicio=fecha_inicio or '',
+        fecha_fin=fecha_fin or '',
+        estado=estado or 'todos',
+        barbero_id=barbero_id or '',
+        q=q
+    )
+    # Yendo hacia atrás la consulta se pidió en orden inverso: "hay más" es hacia las más nuevas
+    if antes:
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        hay_anterior, hay_siguiente = despues is not None, hay_mas
+    paginacion = dict(
+        anterior=url_for('admin_citas', antes=cursor_de_cita(citas[0]), **filtros) if citas and hay_anterior else None,
+        siguiente=url_for('admin_citas', despues=cursor_de_cita(citas[-1]), **filtros) if citas and hay_siguiente else None,
+    )
 
     return render_template('admin_citas.html',
                            citas=citas,
                            barberos=barberos,
-                           filtros=dict(
-                               fecha_inicio=fecha_inicio or '',
-                               fecha_fin=fecha_fin or '',
-                               estado=estado or 'todos',
-                               barbero_id=barbero_id or ''
-                           ))
+                           filtros=filtros,
+                           paginacion=paginacion)
 
-@app.route('/admin/citas/exportar')
-@login_required
-def admin_citas_exportar():
-    if session.get('user_role') != 1:
-        flash('No tienes permiso para acceder a esta página', 'danger')
-        return redirect(url_for('client_dashboard'))
+EXPORTAR_FILAS_POR_LOTE = 500
+EXPORTAR_BYTES_POR_ENVIO = 64 * 1024
 
-    fecha_inicio = request.args.get('fecha_inicio')
-    fecha_fin = request.args.get('fecha_fin')
-    estado = request.args.get('estado')
-    barbero_id = request.args.get('barbero_id')
+# Antigüedad (días) a partir de la cual `flask archivar-citas` mueve las citas al archivo
+ARCHIVO_HORIZONTE_DIAS = int(os.getenv("ARCHIVO_HORIZONTE_DIAS", 365))
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def cursores_por_fuente(conn, plantilla, params):
+    """
+    Ejecuta `plantilla` (con {cita} y {cita_servicio} en lugar de las tablas)
+    primero sobre las tablas vivas y luego sobre el archivo, y entrega cada
+    cursor sin buffer listo para leer. Las citas archivadas son más viejas que
+    las vivas, así el orden por fecha descendente se mantiene entre las dos.
+    """
+    for fuente in archivado.FUENTES:
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(plantilla.format(**fuente), params)
+            yield cursor
+        finally:
+            cursor.close()
 
-    query = """
+def filas_csv_citas(condiciones, params):
+    """
+    Genera el CSV del historial (vivo y archivado) por partes. Usa su propia
+    conexión y cursores sin buffer: las filas llegan de MySQL a medida que se
+    escriben, así la memoria no crece con el historial. Las citas salen en el
+    orden del índice (fecha, hora) y los servicios se concatenan por cita sin
+    agrupar todo el resultado, para que el servidor tampoco tenga que
+    materializarlo.
+    """
+    conn = get_db_connection()
+    cursores = cursores_por_fuente(conn, f"""
         SELECT 
             c.cita_id,
             c.fecha,
             TIME_FORMAT(c.hora, '%H:%i') AS hora,
             c.estado,
-            CONCAT(uc.nombre,' ',uc.apellido) AS cliente,85 
+            CONCAT(uc.nombre,' ',uc.apellido) AS cliente,
             CONCAT(ub.nombre,' ',ub.apellido) AS barbero,
-            GROUP_CONCAT(s.nombre ORDER BY s.nombre SEPARATOR ', ') AS servicios,
-            COALESCE(can.motivo,'') AS motivo_cancelacion,
-            COALESCE(DATE_FORMAT(can.fecha_cancelacion, '%Y-%m-%d %H:%i'), '') AS fecha_cancelacion
-        FROM CITA c
+            (SELECT GROUP_CONCAT(s.nombre ORDER BY s.nombre SEPARATOR ', ')
+               FROM {{cita_servicio}} cs
+               JOIN Servicios s ON cs.servicio_id = s.servicio_id
+              WHERE cs.cita_id = c.cita_id) AS servicios,
+            COALESCE(c.cancelacion_motivo,'') AS motivo_cancelacion,
+            COALESCE(DATE_FORMAT(c.cancelacion_fecha, '%Y-%m-%d %H:%i'), '') AS fecha_cancelacion
+        FROM {{cita}} c
         JOIN USUARIO uc         ON c.usuario_id = uc.usuario_id
         JOIN Barbero b          ON c.barbero_id = b.barbero_id
         JOIN USUARIO ub         ON b.usuario_id = ub.usuario_id
-        LEFT JOIN Cita_servicio cs ON c.cita_id = cs.cita_id
-        LEFT JOIN Servicios s      ON cs.servicio_id = s.servicio_id
-        LEFT JOIN Cancelacion can  ON can.cita_id = c.cita_id
-        WHERE 1=1
+        WHERE {' AND '.join(condiciones) or '1=1'}
+        ORDER BY c.fecha DESC, c.hora DESC, c.cita_id DESC
+    """, tuple(params))
+    try:
+        si = StringIO()
+        cw = csv.writer(si)
+        encabezado = False
+        for cursor in cursores:
+            if not encabezado:
+                cw.writerow([desc[0] for desc in cursor.description])
+                encabezado = True
+            while True:
+                rows = cursor.fetchmany(EXPORTAR_FILAS_POR_LOTE)
+                if not rows:
+                    break
+                cw.writerows(rows)
+                if si.tell() >= EXPORTAR_BYTES_POR_ENVIO:
+                    yield si.getvalue()
+                    si.seek(0)
+                    si.truncate()
+        yield si.getvalue()
+    finally:
+        try:
+            cursores.close()
+        finally:
+            # Si la descarga se cortó a medias el pool descarta la conexión con filas sin leer
+            conn.close()
+
+def archivo_columnar_citas(condiciones, params, formato):
+    """
+    Escribe el historial tipado (ver exportar_columnar), vivo y archivado, en
+    un archivo temporal por lotes y lo envía por partes. Parquet necesita el
+    archivo completo para escribir su pie, por eso no sale directo del cursor
+    como el CSV. La conexión vuelve al pool apenas termina la escritura.
     """
-    params = []
-    if fecha_inicio:
-        query += " AND c.fecha >= %s"; params.append(fecha_inicio)
-    if fecha_fin:
-        query += " AND c.fecha <= %s"; params.append(fecha_fin)
-    if estado and estado != 'todos':
-        query += " AND c.estado = %s"; params.append(estado)
-    if barbero_id and barbero_id.isdigit():
-        query += " AND c.barbero_id = %s"; params.append(int(barbero_id))
-
-    query += " GROUP BY c.cita_id ORDER BY c.fecha DESC, c.hora DESC"
-
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-    headers = [desc[0] for desc in cursor.description]
-
-    # Crear CSV en memoria
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(headers)
-    for r in rows:
-        cw.writerow(r)
-
-    cursor.close(); conn.close()
-
-    output = si.getvalue()
+    with tempfile.TemporaryFile() as destino:
+        conn = get_db_connection()
+        try:
+            cursores = cursores_por_fuente(conn, f"""
+                SELECT
+                    c.cita_id,
+                    c.fecha,
+                    c.hora,
+                    c.duracion_minutos,
+                    c.estado,
+                    c.usuario_id,
+                    CONCAT(uc.nombre,' ',uc.apellido),
+                    c.barbero_id,
+                    CONCAT(ub.nombre,' ',ub.apellido),
+                    (SELECT GROUP_CONCAT(s.nombre ORDER BY s.nombre SEPARATOR %s)
+                       FROM {{cita_servicio}} cs
+                       JOIN Servicios s ON cs.servicio_id = s.servicio_id
+                      WHERE cs.cita_id = c.cita_id),
+                    c.cancelacion_motivo,
+                    c.cancelacion_fecha,
+                    c.cancelado_por
+                FROM {{cita}} c
+                JOIN USUARIO uc         ON c.usuario_id = uc.usuario_id
+                JOIN Barbero b          ON c.barbero_id = b.barbero_id
+                JOIN USUARIO ub         ON b.usuario_id = ub.usuario_id
+                WHERE {' AND '.join(condiciones) or '1=1'}
+                ORDER BY c.fecha DESC, c.hora DESC, c.cita_id DESC
+            """, (exportar_columnar.SEPARADOR_SERVICIOS, *params))
+            try:
+                exportar_columnar.escribir(cursores, destino, formato)
+            finally:
+                cursores.close()
+        finally:
+            conn.close()
+
+        destino.seek(0)
+        while True:
+            parte = destino.read(EXPORTAR_BYTES_POR_ENVIO)
+            if not parte:
+                break
+            yield parte
+
+@app.route('/admin/citas/exportar')
+@login_required
+def admin_citas_exportar():
+    if session.get('user_role') != 1:
+        flash('No tienes permiso para acceder a esta página', 'danger')
+        return redirect(url_for('client_dashboard'))
+
+    condiciones, params = filtros_citas(request.args)
+    formato = request.args.get('formato', 'csv')
+
+    if formato in exportar_columnar.FORMATOS:
+        if not exportar_columnar.disponible():
+            flash('La exportación en Parquet/Arrow requiere instalar pyarrow en el servidor.', 'danger')
+            return redirect(url_for('admin_citas'))
+        mimetype, nombre = exportar_columnar.FORMATOS[formato]
+        return app.response_class(
+            archivo_columnar_citas(condiciones, params, formato),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={nombre}'}
+        )
+
     return app.response_class(
-        output,
+        filas_csv_citas(condiciones, params),
         mimetype='text/csv',
         headers={'Content-Disposition': 'attachment; filename=citas.csv'}
     )
 
-def obtener_horario_dia(fecha_obj):
+# --- ANALÍTICA DE UTILIZACIÓN ---
+ANALITICA_TTL = int(os.getenv("ANALITICA_TTL", 600))
+ANALITICA_MAX_DIAS = int(os.getenv("ANALITICA_MAX_DIAS", 731))
+
+def calcular_analitica(desde, hasta):
     """
-    Devuelve un diccionario con las horas de apertura y cierre reales del día.
-    Soporta TIME en base de datos como str, time o timedelta.
+    Utilización y tasas del rango [desde, hasta], cacheadas en almacen_temporal
+    por rango: el historial se lee una vez y se calcula en NumPy.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM horario_especial WHERE fecha = %s", (fecha_obj,))
-    especial = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    clave = f"analitica:{desde.isoformat()}:{hasta.isoformat()}"
+    resultado = almacen_temporal.obtener(clave)
+    if resultado is not None:
+        return resultado
+
+    # Horario de cada día del rango, incluidos los especiales ya pasados
+    calendario = CalendarioHorarios(
+        HORARIO_BASE,
+        leer_horarios_especiales("fecha BETWEEN %s AND %s", (desde, hasta))
+    )
+    dias = (hasta - desde).days + 1
+    aperturas = [mascara_apertura(calendario.dia(desde + timedelta(days=d))) for d in range(dias)]
 
-    if especial:
-        if especial.get('cerrado') == 1:
-            return {'cerrado': True}
+    sql, params = analitica.consulta_citas(SLOT_MINUTOS, desde, hasta,
+                                           [fuente['cita'] for fuente in archivado.FUENTES])
+    cursor = get_db().cursor()
+    try:
+        cursor.execute(sql, params)
+        citas = analitica.leer_citas(cursor)
+    finally:
+        cursor.close()
 
-        hora_inicio = especial.get('hora_apertura')
-        hora_fin = especial.get('hora_cierre')
+    barberos = [b['barbero_id'] for b in obtener_barberos(solo_activos=True)]
+    resultado = analitica.calcular(citas, barberos, desde, aperturas, SLOT_MINUTOS)
+    almacen_temporal.guardar(clave, resultado, ANALITICA_TTL)
+    return resultado
 
-        # ✅ Convertir timedelta → time
-        if isinstance(hora_inicio, timedelta):
-            segundos = hora_inicio.total_seconds()
-            hora_inicio = time(int(segundos // 3600), int((segundos % 3600) // 60))
-        if isinstance(hora_fin, timedelta):
-            segundos = hora_fin.total_seconds()
-            hora_fin = time(int(segundos // 3600), int((segundos % 3600) // 60))
+@app.route('/admin/analitica')
+@login_required
+def admin_analitica():
+    if session.get('user_role') != 1:
+        flash('No tienes permiso para acceder a esta página', 'danger')
+        return redirect(url_for('client_dashboard'))
 
-        # ✅ Convertir string → time
-        if isinstance(hora_inicio, str):
-            try:
-                hora_inicio = datetime.strptime(hora_inicio, "%H:%M:%S").time()
-            except ValueError:
-                hora_inicio = datetime.strptime(hora_inicio, "%H:%M").time()
-        if isinstance(hora_fin, str):
-            try:
-                hora_fin = datetime.strptime(hora_fin, "%H:%M:%S").time()
-            except ValueError:
-                hora_fin = datetime.strptime(hora_fin, "%H:%M").time()
-
-        return {
-            'hora_inicio': hora_inicio,
-            'hora_fin': hora_fin,
-            'cerrado': False
+    if not analitica.disponible():
+        flash('La analítica de utilización requiere instalar numpy en el servidor.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    # Por defecto las últimas 12 semanas completas hasta hoy
+    hoy = date.today()
+    try:
+        desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        desde, hasta = hoy - timedelta(weeks=12) + timedelta(days=1), hoy
+    if hasta < desde:
+        desde, hasta = hasta, desde
+    if (hasta - desde).days >= ANALITICA_MAX_DIAS:
+        desde = hasta - timedelta(days=ANALITICA_MAX_DIAS - 1)
+        flash(f'El rango se limitó a {ANALITICA_MAX_DIAS} días.', 'warning')
+
+    datos = calcular_analitica(desde, hasta)
+    nombres = {b['barbero_id']: f"{b['nombre']} {b['apellido']}" for b in obtener_barberos(solo_activos=False)}
+    return render_template('admin_analitica.html', datos=datos, nombres=nombres,
+                           dias_semana=['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom'],
+                           desde=desde.isoformat(), hasta=hasta.isoformat())
+
+# Horario base semanal: weekday() -> (apertura, cierre)
+HORARIO_BASE = {
+    0: (time(12, 0), time(21, 0)),  # Lunes
+    1: (time(12, 0), time(21, 0)),
+    2: (time(12, 0), time(21, 0)),
+    3: (time(12, 0), time(21, 0)),
+    4: (time(12, 0), time(21, 0)),  # Viernes
+    5: (time(10, 0), time(20, 0)),  # Sábado
+    6: (time(12, 0), time(18, 0)),  # Domingo
+}
+
+def a_hora(valor):
+    """Convierte un TIME de la base de datos (str, time o timedelta) a datetime.time."""
+    if isinstance(valor, timedelta):
+        segundos = valor.total_seconds()
+        return time(int(segundos // 3600), int((segundos % 3600) // 60))
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor, "%H:%M:%S").time()
+        except ValueError:
+            return datetime.strptime(valor, "%H:%M").time()
+    return valor
+
+class CalendarioHorarios:
+    """
+    Horario de apertura en memoria: el horario base semanal más los horarios
+    especiales (ya convertidos a time) indexados por fecha.
+    """
+
+    def __init__(self, base, especiales):
+        self._base = {
+            dia: {'hora_inicio': inicio, 'hora_fin': fin, 'cerrado': False}
+            for dia, (inicio, fin) in base.items()
         }
+        self._especiales = especiales
+
+    def dia(self, fecha_obj):
+        especial = self._especiales.get(fecha_obj)
+        if especial is not None:
+            return especial
+        return self._base[fecha_obj.weekday()]
+
+def leer_horarios_especiales(condicion, params=()):
+    """Horarios especiales que cumplen `condicion`, ya convertidos: {fecha: horario}."""
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT fecha, hora_apertura, hora_cierre, cerrado
+        FROM horario_especial
+        WHERE {condicion}
+    """, params)
+    especiales = {}
+    for fila in cursor.fetchall():
+        if fila['cerrado'] == 1:
+            especiales[fila['fecha']] = {'cerrado': True}
+        else:
+            especiales[fila['fecha']] = {
+                'hora_inicio': a_hora(fila['hora_apertura']),
+                'hora_fin': a_hora(fila['hora_cierre']),
+                'cerrado': False
+            }
+    cursor.close()
+    return especiales
 
-    # Horario base si no hay especial
-    dia_semana = fecha_obj.weekday()
-    if dia_semana == 5:  # Sábado
-        return {'hora_inicio': time(10, 0), 'hora_fin': time(20, 0), 'cerrado': False}
-    elif dia_semana == 6:  # Domingo
-        return {'hora_inicio': time(12, 0), 'hora_fin': time(18, 0), 'cerrado': False}
-    else:
-        return {'hora_inicio': time(12, 0), 'hora_fin': time(21, 0), 'cerrado': False}
+def cargar_calendario_horarios():
+    """Lee de una vez todos los horarios especiales de hoy en adelante."""
+    return CalendarioHorarios(HORARIO_BASE, leer_horarios_especiales("fecha >= CURDATE()"))
 
+calendario_horarios = CacheMemoria(cargar_calendario_horarios, int(os.getenv("HORARIOS_CACHE_TTL", 300)))
+
+def obtener_horario_dia(fecha_obj):
+    """
+    Devuelve un diccionario con las horas de apertura y cierre reales del día
+    (horario especial si existe, si no el horario base). No toca la base de datos:
+    responde desde el calendario en memoria.
+    """
+    return calendario_horarios.obtener().dia(fecha_obj)
 
 
+def error_horario_especial(form):
+    """Mensaje de error si las horas de un día abierto no sirven para la grilla de slots."""
+    if form.get('cerrado'):
+        return None
+    try:
+        validas = en_grilla(form.get('hora_apertura')) and en_grilla(form.get('hora_cierre'))
+    except (AttributeError, TypeError, ValueError):
+        return 'Indica la hora de apertura y de cierre.'
+    if not validas:
+        return (f'Las horas de apertura y cierre deben ir en bloques de {SLOT_MINUTOS} minutos '
+                f'(p. ej. 09:00 o 09:{SLOT_MINUTOS:02d}).')
+    return None
 
 @app.route('/admin/horarios', methods=['GET', 'POST'])
 @login_required
@@ -1631,7 +2780,13 @@ def admin_horarios():
         flash('Acceso no autorizado', 'danger')
         return redirect(url_for('client_dashboard'))
 
-    conn = get_db_connection()
+    if request.method == 'POST':
+        error = error_horario_especial(request.form)
+        if error:
+            flash(error, 'danger')
+            return redirect(url_for('admin_horarios'))
+
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     if request.method == 'POST':
@@ -1649,6 +2804,8 @@ def admin_horarios():
                                         cerrado=VALUES(cerrado), motivo=VALUES(motivo)
             """, (fecha, hora_apertura, hora_cierre, cerrado, motivo))
             conn.commit()
+            calendario_horarios.invalidar()
+            refrescar_dia_indice(datetime.strptime(fecha, '%Y-%m-%d').date())
             flash('Horario guardado correctamente', 'success')
         except Exception as e:
             conn.rollback()
@@ -1657,7 +2814,6 @@ def admin_horarios():
     cursor.execute("SELECT * FROM horario_especial ORDER BY fecha DESC LIMIT 15")
     horarios = cursor.fetchall()
     cursor.close()
-    conn.close()
     return render_template('admin_horarios.html', horarios=horarios)
 
 @app.route('/admin/horarios/eliminar/<int:id>', methods=['POST'])
@@ -1667,22 +2823,155 @@ def eliminar_horario_especial(id):
         flash('Acceso no autorizado', 'danger')
         return redirect(url_for('client_dashboard'))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT fecha FROM horario_especial WHERE id = %s", (id,))
+        horario = cursor.fetchone()
         cursor.execute("DELETE FROM horario_especial WHERE id = %s", (id,))
         conn.commit()
+        calendario_horarios.invalidar()
+        if horario:
+            refrescar_dia_indice(horario[0])
         flash('Horario eliminado correctamente', 'success')
     except Exception as e:
         conn.rollback()
         flash(f'Error al eliminar horario: {e}', 'danger')
     finally:
         cursor.close()
-        conn.close()
     return redirect(url_for('admin_horarios'))
 
+#--------------------------------------------------------------------------------------------------------------------
+# COMANDOS DE MANTENIMIENTO (flask <comando>)
+#--------------------------------------------------------------------------------------------------------------------
+@app.cli.command('migrar')
+def comando_migrar():
+    """Aplica las migraciones de esquema pendientes."""
+    nuevas = migraciones.aplicar_migraciones(get_db(), informar=click.echo)
+    click.echo(f"{len(nuevas)} migración(es) aplicada(s)." if nuevas else "El esquema ya está al día.")
+
+@app.cli.command('verificar-indices')
+def comando_verificar_indices():
+    """Falla si alguna consulta caliente hace un escaneo completo de tabla o la búsqueda no encuentra clientes."""
+    problemas = migraciones.verificar_consultas(get_db())
+    for nombre, plan in problemas:
+        click.echo(f"ESCANEO COMPLETO en '{nombre}': {plan}", err=True)
+    perdido = migraciones.verificar_busqueda(get_db())
+    if perdido:
+        click.echo(f"La búsqueda de clientes no encuentra '{perdido}': corre `flask migrar` "
+                   "(índice con palabras vacías).", err=True)
+    if problemas or perdido:
+        raise SystemExit(1)
+    click.echo("Todas las consultas calientes usan índice.")
+
+@app.cli.command('enviar-correos')
+@click.option('--continuo', is_flag=True, help='Seguir revisando el buzón cada CORREO_INTERVALO segundos.')
+def comando_enviar_correos(continuo):
+    """Envía los correos pendientes del buzón de salida."""
+    trabajador = buzon_salida.TrabajadorCorreo(get_db_connection, config_smtp, intervalo=CORREO_INTERVALO, informar=click.echo)
+    while True:
+        enviados, fallidos = trabajador.vaciar()
+        if enviados or fallidos or not continuo:
+            click.echo(f"{enviados} correo(s) enviado(s), {fallidos} para reintentar.")
+        if not continuo:
+            break
+        sleep(CORREO_INTERVALO)
+
+@app.cli.command('enviar-recordatorios')
+@click.option('--fecha', default=None, help='Día de las citas (YYYY-MM-DD); por defecto mañana.')
+def comando_enviar_recordatorios(fecha):
+    """Recuerda por correo las citas de mañana. Pensado para un cron diario."""
+    fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date() if fecha else date.today() + timedelta(days=1)
+    encolados = encolar_recordatorios(fecha_obj)
+    click.echo(f"{encolados} recordatorio(s) encolado(s) para el {fecha_obj.isoformat()}.")
+    trabajador = buzon_salida.TrabajadorCorreo(get_db_connection, config_smtp, informar=click.echo)
+    enviados, fallidos = trabajador.vaciar()
+    click.echo(f"{enviados} correo(s) enviado(s), {fallidos} para reintentar.")
+
+@app.cli.command('reconstruir-resumenes')
+@click.option('--desde', default=None, help='Primer día a recalcular (YYYY-MM-DD); sin rango, todo el historial.')
+@click.option('--hasta', default=None, help='Último día a recalcular (YYYY-MM-DD).')
+def comando_reconstruir_resumenes(desde, hasta):
+    """Recalcula las tablas resumen del tablero desde CITA y Cancelacion."""
+    if bool(desde) != bool(hasta):
+        raise click.UsageError("Indica --desde y --hasta juntos, o ninguno.")
+    resumenes.reconstruir(get_db(), desde, hasta)
+    click.echo(f"Resúmenes recalculados ({f'{desde} a {hasta}' if desde else 'todo el historial'}).")
+
+@app.cli.command('archivar-citas')
+@click.option('--dias', type=int, default=None,
+              help='Archivar las citas de hace más de estos días; por defecto ARCHIVO_HORIZONTE_DIAS.')
+@click.option('--lote', default=archivado.TAMANO_LOTE, show_default=True, help='Citas por transacción.')
+def comando_archivar_citas(dias, lote):
+    """Mueve las citas viejas (con sus servicios y cancelaciones) a las tablas de archivo."""
+    dias = ARCHIVO_HORIZONTE_DIAS if dias is None else dias
+    if dias < 1:
+        raise click.UsageError("--dias debe ser al menos 1.")
+    antes_de = date.today() - timedelta(days=dias)
+    total = archivado.archivar(get_db(), antes_de, lote, informar=click.echo)
+    click.echo(f"{total} cita(s) anteriores al {antes_de.isoformat()} archivada(s).")
+
+@app.cli.command('rellenar-cancelaciones')
+def comando_rellenar_cancelaciones():
+    """Copia la última cancelación de cada cita (tabla Cancelacion) a sus columnas en CITA."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        filas = migraciones.rellenar_ultima_cancelacion(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+    click.echo(f"{filas} cita(s) actualizada(s).")
+
+@app.cli.command('prueba-carga')
+@click.option('--clientes', default=20, show_default=True, help='Clientes simultáneos.')
+@click.option('--segundos', default=30, show_default=True, help='Duración de la prueba.')
+@click.option('--dias', default=7, show_default=True, help='Días hacia adelante en que se reserva.')
+@click.option('--pausa', default=0.5, show_default=True, help='Pausa media entre acciones de un cliente (s).')
+@click.option('--semilla', type=int, default=None, help='Semilla para repetir la misma secuencia.')
+@click.option('--conservar', is_flag=True, help='No borrar los clientes de prueba ni sus citas al terminar.')
+def comando_prueba_carga(clientes, segundos, dias, pausa, semilla, conservar):
+    """Simula clientes reservando, consultando y cancelando a la vez. ¡Usar sólo contra una base local!"""
+    import prueba_carga  # herramienta de pruebas: no se carga con la aplicación
+    conn = get_db_connection()
+    try:
+        emails = prueba_carga.preparar_clientes(conn, clientes)
+    finally:
+        conn.close()
 
-
+    # Contexto propio para que su conexión vuelva al pool antes de empezar la carga
+    with app.app_context():
+        barberos = [b['barbero_id'] for b in obtener_barberos()]
+        servicios = [(s['servicio_id'], s.get('duracion_minutos') or SLOT_MINUTOS)
+                     for s in catalogo_servicios.obtener()['todos']]
+    if not barberos or not servicios:
+        raise click.ClickException("Hace falta al menos un barbero activo y un servicio.")
+
+    antes = contadores_reserva.estadisticas()
+    duracion, rutas, resultados = prueba_carga.ejecutar_prueba(
+        app, emails, barberos, servicios, segundos, dias, pausa, semilla
+    )
+    despues = contadores_reserva.estadisticas()
+
+    total = sum(r['peticiones'] for r in rutas.values())
+    click.echo(f"{total} peticiones en {duracion:.1f}s ({total / duracion:.1f} req/s) con {clientes} clientes")
+    click.echo(f"{'ruta':<40}{'n':>7}{'5xx':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for ruta, r in rutas.items():
+        click.echo(f"{ruta:<40}{r['peticiones']:>7}{r['errores']:>6}"
+                   f"{r['p50'] * 1000:>9.1f}{r['p95'] * 1000:>9.1f}{r['p99'] * 1000:>9.1f}")
+    click.echo("Clientes: " + ', '.join(f"{k}={v}" for k, v in sorted(resultados.items())))
+    click.echo("procesar_cita: " + ', '.join(
+        f"{k}={despues[k] - antes.get(k, 0)}" for k in sorted(despues)
+    ))
+    click.echo(f"Pool: {db_pool.estadisticas()}")
+
+    if not conservar:
+        conn = get_db_connection()
+        try:
+            prueba_carga.limpiar_clientes(conn)
+        finally:
+            conn.close()
+        indice_libres.invalidar()
 
 
 if __name__ == "__main__":
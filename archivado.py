@@ -0,0 +1,83 @@
+"""
+Archivo del historial de citas.
+
+CITA, Cita_servicio y Cancelacion sólo crecen y las consultas calientes
+(mis_citas, disponibilidad, admin_citas) no necesitan las citas viejas. El
+trabajo `archivar` mueve por lotes las citas anteriores a una fecha de corte,
+con sus servicios y cancelaciones, a tablas *_archivo con la misma estructura
+(migración 9). Cada lote se copia y se borra en una sola transacción, así una
+cita nunca queda en las dos tablas ni en ninguna.
+
+Como las citas se reservan hacia adelante, después de archivar todo lo que
+queda en CITA es más nuevo que lo archivado: las lecturas históricas
+(exportación, analítica, resúmenes) recorren primero las tablas vivas y luego
+el archivo con la misma consulta (`FUENTES`) y el orden por fecha se mantiene.
+
+Las migraciones que agreguen columnas a CITA, Cita_servicio o Cancelacion
+deben agregarlas también a su tabla de archivo; si falta alguna, `archivar`
+falla en lugar de perder datos.
+"""
+
+# (cita, servicios, cancelaciones): primero las tablas vivas, luego el archivo
+FUENTES = (
+    {'cita': 'CITA', 'cita_servicio': 'Cita_servicio', 'cancelacion': 'Cancelacion'},
+    {'cita': 'CITA_archivo', 'cita_servicio': 'Cita_servicio_archivo', 'cancelacion': 'Cancelacion_archivo'},
+)
+
+# Se borran en orden inverso: las tablas hijas antes que CITA (claves foráneas)
+TABLAS = (
+    ('CITA', 'CITA_archivo'),
+    ('Cita_servicio', 'Cita_servicio_archivo'),
+    ('Cancelacion', 'Cancelacion_archivo'),
+)
+
+TAMANO_LOTE = 1000
+
+def columnas(cursor, tabla):
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY ordinal_position
+    """, (tabla,))
+    return [fila[0] for fila in cursor.fetchall()]
+
+def archivar(conn, antes_de, tamano=TAMANO_LOTE, informar=print):
+    """
+    Mueve al archivo las citas con fecha < `antes_de`. Devuelve cuántas movió.
+    Las columnas se leen de las tablas vivas y se copian por nombre.
+    """
+    cursor = conn.cursor()
+    total = 0
+    try:
+        lista_columnas = {tabla: ', '.join(f"`{c}`" for c in columnas(cursor, tabla)) for tabla, _ in TABLAS}
+        while True:
+            try:
+                cursor.execute("""
+                    SELECT cita_id FROM CITA
+                    WHERE fecha < %s
+                    ORDER BY fecha, hora
+                    LIMIT %s
+                    FOR UPDATE
+                """, (antes_de, tamano))
+                ids = [fila[0] for fila in cursor.fetchall()]
+                if not ids:
+                    conn.commit()
+                    return total
+
+                marcadores = ', '.join(['%s'] * len(ids))
+                for tabla, archivo in TABLAS:
+                    cols = lista_columnas[tabla]
+                    cursor.execute(f"""
+                        INSERT INTO {archivo} ({cols})
+                        SELECT {cols} FROM {tabla} WHERE cita_id IN ({marcadores})
+                    """, ids)
+                for tabla, _ in reversed(TABLAS):
+                    cursor.execute(f"DELETE FROM {tabla} WHERE cita_id IN ({marcadores})", ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            total += len(ids)
+            informar(f"{total} cita(s) archivada(s)...")
+    finally:
+        cursor.close()
@@ -0,0 +1,272 @@
+"""
+Buzón de salida de correos de BLANK concept.
+
+Las rutas no hablan con el servidor SMTP: `encolar` guarda el correo en la
+tabla correo_salida dentro de la misma transacción que el cambio que lo
+origina (un registro, un token de recuperación...). Un trabajador en segundo
+plano reclama lotes de pendientes con SELECT ... FOR UPDATE SKIP LOCKED y los
+marca 'enviando' en una transacción corta (así varios procesos no envían el
+mismo correo y ningún bloqueo queda abierto durante la sesión SMTP), los manda
+por una sola sesión (renovando el reclamo mientras dure) y reprograma los
+que fallan con espera exponencial hasta MAX_INTENTOS. La aplicación arranca
+el trabajador con la primera petición.
+
+Para desarrollo basta un SMTP local sin TLS ni usuario, p. ej.
+`python -m aiosmtpd -n -l localhost:1025` con EMAIL_PORT=1025 y EMAIL_TLS=0.
+"""
+import smtplib
+import threading
+from time import monotonic, sleep
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+TAMANO_LOTE = 50
+MAX_INTENTOS = 5
+ESPERA_BASE = 60  # segundos antes del primer reintento; se duplica en cada uno
+RECLAMO_SEGUNDOS = 300  # cuánto tiempo un lote reclamado es de un solo trabajador
+TIMEOUT_SMTP = 30  # segundos por operación con el servidor
+# Cada cuánto se renueva el reclamo de lo que falta enviar. Entre dos
+# renovaciones pasan a lo sumo RENOVAR_CADA + la pausa del tope por minuto +
+# TIMEOUT_SMTP, menos que RECLAMO_SEGUNDOS con cualquier CORREO_POR_MINUTO >= 1:
+# un lote lento nunca vence a mitad del envío y otro trabajador no lo repite
+RENOVAR_CADA = RECLAMO_SEGUNDOS // 3
+
+class ConfigSMTP:
+    def __init__(self, host, puerto, usuario, contrasena, tls=True, remitente=None, por_minuto=0):
+        self.host = host
+        self.puerto = int(puerto or 25)
+        self.usuario = usuario
+        self.contrasena = contrasena
+        self.tls = tls
+        self.remitente = remitente or usuario
+        self.por_minuto = por_minuto  # tope de envíos por minuto del proveedor (0 = sin tope)
+
+    def conectar(self):
+        servidor = smtplib.SMTP(self.host, self.puerto, timeout=TIMEOUT_SMTP)
+        if self.tls:
+            servidor.starttls()
+        if self.usuario and self.contrasena:
+            servidor.login(self.usuario, self.contrasena)
+        return servidor
+
+def encolar(cursor, destinatario, asunto, cuerpo_html, cita_id=None):
+    """
+    Agrega un correo pendiente. Queda visible para el trabajador al hacer commit.
+    `cita_id` sólo lo llevan los recordatorios: al enviarse marcan la cita.
+    """
+    cursor.execute("""
+        INSERT INTO correo_salida (destinatario, asunto, cuerpo_html, cita_id)
+        VALUES (%s, %s, %s, %s)
+    """, (destinatario, asunto, cuerpo_html, cita_id))
+
+def encolar_varios(cursor, correos):
+    """Agrega varios (destinatario, asunto, cuerpo_html, cita_id) en un solo INSERT."""
+    cursor.executemany("""
+        INSERT INTO correo_salida (destinatario, asunto, cuerpo_html, cita_id)
+        VALUES (%s, %s, %s, %s)
+    """, correos)
+
+def construir_mensaje(config, correo):
+    msg = MIMEMultipart()
+    msg['From'] = config.remitente
+    msg['To'] = correo['destinatario']
+    msg['Subject'] = correo['asunto']
+    msg.attach(MIMEText(correo['cuerpo_html'], 'html'))
+    return msg
+
+def espera_reintento(intentos):
+    return ESPERA_BASE * 2 ** (intentos - 1)
+
+def reclamar(conn, tamano=TAMANO_LOTE):
+    """
+    Toma hasta `tamano` correos listos y los marca 'enviando' por RECLAMO_SEGUNDOS
+    en una transacción corta. Otro trabajador se los salta mientras dure el
+    reclamo; si este proceso muere a mitad del envío, al vencer vuelven a estar
+    disponibles. Cada reclamo cuenta como un intento.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT correo_id, destinatario, asunto, cuerpo_html, intentos
+            FROM correo_salida
+            WHERE estado IN ('pendiente','enviando') AND proximo_intento <= NOW()
+            ORDER BY proximo_intento
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (tamano,))
+        correos = cursor.fetchall()
+        if correos:
+            marcadores = ', '.join(['%s'] * len(correos))
+            cursor.execute(f"""
+                UPDATE correo_salida
+                SET estado = 'enviando', intentos = intentos + 1,
+                    proximo_intento = NOW() + INTERVAL %s SECOND
+                WHERE correo_id IN ({marcadores})
+            """, [RECLAMO_SEGUNDOS] + [c['correo_id'] for c in correos])
+            for correo in correos:
+                correo['intentos'] += 1
+        conn.commit()
+        return correos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def renovar(conn, correos):
+    """Extiende RECLAMO_SEGUNDOS el reclamo de `correos` (los que aún no se enviaron)."""
+    cursor = conn.cursor()
+    try:
+        marcadores = ', '.join(['%s'] * len(correos))
+        cursor.execute(f"""
+            UPDATE correo_salida
+            SET proximo_intento = NOW() + INTERVAL %s SECOND
+            WHERE correo_id IN ({marcadores}) AND estado = 'enviando'
+        """, [RECLAMO_SEGUNDOS] + [c['correo_id'] for c in correos])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def enviar(config, correos, renovar_reclamo=None):
+    """
+    Manda los correos por una sola sesión SMTP. Sólo toca la base de datos a
+    través de `renovar_reclamo(pendientes)`, cada RENOVAR_CADA segundos.
+    Devuelve (enviados, [(correo, error), ...]).
+    """
+    enviados, fallidos = [], []
+    servidor = None
+    renovado = monotonic()
+    try:
+        servidor = config.conectar()
+        pausa = 60 / config.por_minuto if config.por_minuto else 0
+        siguiente = monotonic()
+        for i, correo in enumerate(correos):
+            if pausa:
+                # Reparte los envíos para no pasar el tope del proveedor
+                espera = siguiente - monotonic()
+                if espera > 0:
+                    sleep(espera)
+                siguiente = max(siguiente, monotonic()) + pausa
+            if renovar_reclamo and monotonic() - renovado >= RENOVAR_CADA:
+                renovar_reclamo(correos[i:])
+                renovado = monotonic()
+            try:
+                servidor.send_message(construir_mensaje(config, correo))
+                enviados.append(correo)
+            except smtplib.SMTPServerDisconnected as e:
+                # La sesión se cayó: este y los que faltan se reintentan después
+                fallidos.extend((c, str(e)) for c in correos[len(enviados) + len(fallidos):])
+                servidor = None
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                fallidos.append((correo, str(e)))
+    except (smtplib.SMTPException, OSError) as e:
+        # No se pudo abrir la sesión: todo el lote se reintenta después
+        fallidos = [(c, str(e)) for c in correos]
+    finally:
+        if servidor is not None:
+            try:
+                servidor.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+    return enviados, fallidos
+
+def registrar(conn, enviados, fallidos, informar=print):
+    """Guarda el resultado del envío y reprograma los fallidos con espera exponencial."""
+    cursor = conn.cursor()
+    try:
+        if enviados:
+            marcadores = ', '.join(['%s'] * len(enviados))
+            cursor.execute(f"""
+                UPDATE correo_salida
+                SET estado = 'enviado', enviado_en = NOW(), ultimo_error = NULL
+                WHERE correo_id IN ({marcadores})
+            """, [c['correo_id'] for c in enviados])
+            # Recién ahora el recordatorio cuenta como enviado; si falla del todo
+            # la cita queda sin marca y la próxima corrida lo vuelve a encolar
+            cursor.execute(f"""
+                UPDATE CITA c JOIN correo_salida cs ON cs.cita_id = c.cita_id
+                SET c.recordatorio_enviado_en = cs.enviado_en
+                WHERE cs.correo_id IN ({marcadores})
+            """, [c['correo_id'] for c in enviados])
+        for correo, error in fallidos:
+            intentos = correo['intentos']
+            informar(f"No se pudo enviar el correo {correo['correo_id']} (intento {intentos}): {error}")
+            cursor.execute("""
+                UPDATE correo_salida
+                SET ultimo_error = %s,
+                    estado = IF(intentos >= %s, 'fallido', 'pendiente'),
+                    proximo_intento = NOW() + INTERVAL %s SECOND
+                WHERE correo_id = %s
+            """, (error[:255], MAX_INTENTOS, espera_reintento(intentos), correo['correo_id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def enviar_lote(conn, config, tamano=TAMANO_LOTE, informar=print):
+    """
+    Reclama un lote, lo envía sin bloqueos abiertos y registra el resultado.
+    Devuelve (enviados, fallidos).
+    """
+    correos = reclamar(conn, tamano)
+    if not correos:
+        return 0, 0
+    enviados, fallidos = enviar(config, correos, lambda pendientes: renovar(conn, pendientes))
+    registrar(conn, enviados, fallidos, informar)
+    return len(enviados), len(fallidos)
+
+class TrabajadorCorreo:
+    """
+    Hilo que vacía el buzón: procesa lotes mientras haya pendientes y después
+    duerme `intervalo` segundos o hasta que alguien llame a despertar().
+    """
+
+    def __init__(self, obtener_conexion, config, intervalo=30, informar=print):
+        self._obtener_conexion = obtener_conexion
+        self._config = config
+        self.intervalo = intervalo
+        self._informar = informar
+        self._evento = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Arranca el hilo si no está corriendo. Lo primero que hace es vaciar el buzón."""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name='trabajador-correo', daemon=True)
+                self._hilo.start()
+
+    def despertar(self):
+        """Avisa que hay correo nuevo; arranca el hilo si hace falta."""
+        self.iniciar()
+        self._evento.set()
+
+    def vaciar(self):
+        """Envía lotes hasta que no quede nada listo para enviar. Devuelve (enviados, fallidos)."""
+        total_enviados = total_fallidos = 0
+        while True:
+            conn = self._obtener_conexion()
+            try:
+                enviados, fallidos = enviar_lote(conn, self._config, informar=self._informar)
+            finally:
+                conn.close()
+            total_enviados += enviados
+            total_fallidos += fallidos
+            if enviados + fallidos < TAMANO_LOTE:
+                return total_enviados, total_fallidos
+
+    def _ciclo(self):
+        while True:
+            self._evento.clear()
+            try:
+                self.vaciar()
+            except Exception as e:
+                self._informar(f"Error en el trabajador de correo: {e}")
+            self._evento.wait(self.intervalo)
@@ -0,0 +1,121 @@
+"""
+Exportación del historial de citas en formatos columnares (Parquet y Arrow).
+
+A diferencia del CSV, las columnas conservan su tipo: fecha como date, hora
+como time, los servicios como lista de textos y la cancelación como timestamp.
+Las filas se convierten y escriben por lotes, así la memoria depende del
+tamaño del lote y no del historial.
+
+Requiere pyarrow (`pip install pyarrow`); si no está instalado el resto de la
+aplicación funciona igual y `disponible()` devuelve False.
+"""
+from datetime import datetime, time, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # dependencia opcional
+    pa = pq = None
+
+# formato -> (mimetype, nombre del archivo)
+FORMATOS = {
+    'parquet': ('application/vnd.apache.parquet', 'citas.parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'citas.arrow'),
+}
+
+FILAS_POR_LOTE = 10000
+
+# Separador de GROUP_CONCAT para partir los servicios en una lista
+SEPARADOR_SERVICIOS = '\x1f'
+
+# Columnas en el orden de la consulta de exportación
+COLUMNAS = (
+    'cita_id', 'fecha', 'hora', 'duracion_minutos', 'estado',
+    'cliente_id', 'cliente', 'barbero_id', 'barbero', 'servicios',
+    'motivo_cancelacion', 'fecha_cancelacion', 'cancelado_por',
+)
+
+# Diccionarios fijos de las columnas categóricas: el archivo Arrow admite un
+# solo diccionario por campo para todos los lotes
+DICCIONARIOS = {
+    'estado': ('pendiente', 'confirmada', 'completada', 'cancelada', 'no asistio'),
+    'cancelado_por': ('cliente', 'barbero'),
+}
+
+def disponible():
+    return pa is not None
+
+def esquema():
+    return pa.schema([
+        ('cita_id', pa.int32()),
+        ('fecha', pa.date32()),
+        ('hora', pa.time32('s')),
+        ('duracion_minutos', pa.int16()),
+        ('estado', pa.dictionary(pa.int8(), pa.string())),
+        ('cliente_id', pa.int32()),
+        ('cliente', pa.string()),
+        ('barbero_id', pa.int32()),
+        ('barbero', pa.string()),
+        ('servicios', pa.list_(pa.string())),
+        ('motivo_cancelacion', pa.string()),
+        ('fecha_cancelacion', pa.timestamp('s')),
+        ('cancelado_por', pa.dictionary(pa.int8(), pa.string())),
+    ])
+
+def _hora(valor):
+    # MySQL devuelve TIME como timedelta
+    if isinstance(valor, timedelta):
+        segundos = int(valor.total_seconds())
+        return time(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+    return valor
+
+def lote(filas, esquema_lote):
+    """Convierte filas (tuplas en el orden de COLUMNAS) en un RecordBatch tipado."""
+    columnas = [list(col) for col in zip(*filas)]
+    datos = dict(zip(COLUMNAS, columnas))
+    datos['hora'] = [_hora(h) for h in datos['hora']]
+    datos['servicios'] = [s.split(SEPARADOR_SERVICIOS) if s else [] for s in datos['servicios']]
+    datos['fecha_cancelacion'] = [
+        f if f is None or isinstance(f, datetime) else datetime.fromisoformat(str(f))
+        for f in datos['fecha_cancelacion']
+    ]
+    return pa.RecordBatch.from_arrays(
+        [_diccionario(campo, datos[campo.name]) if campo.name in DICCIONARIOS
+         else pa.array(datos[campo.name], type=campo.type) for campo in esquema_lote],
+        schema=esquema_lote
+    )
+
+def _diccionario(campo, valores):
+    """Codifica `valores` con el diccionario fijo del campo (None queda nulo)."""
+    diccionario = DICCIONARIOS[campo.name]
+    posiciones = {valor: i for i, valor in enumerate(diccionario)}
+    try:
+        indices = [None if v is None else posiciones[v] for v in valores]
+    except KeyError as e:
+        raise ValueError(f"Valor inesperado en {campo.name}: {e.args[0]!r}") from None
+    return pa.DictionaryArray.from_arrays(
+        pa.array(indices, type=campo.type.index_type), pa.array(diccionario, type=campo.type.value_type)
+    )
+
+def escribir(cursores, destino, formato):
+    """
+    Lee cada cursor por lotes, uno tras otro, y escribe `formato` en el
+    archivo `destino`. Devuelve la cantidad de citas escritas.
+    """
+    esquema_lote = esquema()
+    if formato == 'parquet':
+        escritor = pq.ParquetWriter(destino, esquema_lote, compression='zstd')
+    else:
+        escritor = pa.ipc.new_file(destino, esquema_lote)
+    total = 0
+    try:
+        for cursor in cursores:
+            while True:
+                filas = cursor.fetchmany(FILAS_POR_LOTE)
+                if not filas:
+                    break
+                escritor.write_table(pa.Table.from_batches([lote(filas, esquema_lote)]))
+                total += len(filas)
+    finally:
+        escritor.close()
+    return total
@@ -0,0 +1,320 @@
+"""
+Migraciones versionadas del esquema de BLANK concept.
+
+Cada migración se registra con @migracion(version, descripcion) y recibe un
+cursor. Las versiones aplicadas se guardan en la tabla schema_migraciones, así
+que `flask migrar` sólo ejecuta las pendientes y en orden.
+
+`flask verificar-indices` corre EXPLAIN sobre las consultas calientes de la
+aplicación y falla si alguna termina en un escaneo completo de tabla.
+"""
+from datetime import date
+
+MIGRACIONES = []
+
+def migracion(version, descripcion):
+    def registrar(funcion):
+        MIGRACIONES.append((version, descripcion, funcion))
+        MIGRACIONES.sort(key=lambda m: m[0])
+        return funcion
+    return registrar
+
+# ---------------------------------------------------------------------------
+# Helpers idempotentes (MySQL no tiene CREATE INDEX IF NOT EXISTS)
+# ---------------------------------------------------------------------------
+def existe_indice(cursor, tabla, nombre):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (tabla, nombre))
+    return cursor.fetchone() is not None
+
+def crear_indice(cursor, tabla, nombre, columnas, tipo=''):
+    if not existe_indice(cursor, tabla, nombre):
+        cursor.execute(f"CREATE {tipo} INDEX {nombre} ON {tabla} ({columnas})")
+
+def existe_columna(cursor, tabla, columna):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (tabla, columna))
+    return cursor.fetchone() is not None
+
+def agregar_columna(cursor, tabla, columna, definicion):
+    if not existe_columna(cursor, tabla, columna):
+        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+# ---------------------------------------------------------------------------
+# Migraciones
+# ---------------------------------------------------------------------------
+@migracion(1, "Índices compuestos para las consultas calientes de CITA, Cancelacion y USUARIO")
+def _indices_consultas_calientes(cursor):
+    # Disponibilidad y slots del barbero (incluye hora para que el índice cubra la consulta)
+    crear_indice(cursor, 'CITA', 'idx_cita_barbero_fecha_estado', 'barbero_id, fecha, estado, hora')
+    # Guardia de una cita activa por día en procesar_cita
+    crear_indice(cursor, 'CITA', 'idx_cita_usuario_fecha_estado', 'usuario_id, fecha, estado')
+    # Última cancelación por cita (hoy sólo la usa el relleno de la migración 7)
+    crear_indice(cursor, 'Cancelacion', 'idx_cancelacion_cita_fecha', 'cita_id, fecha_cancelacion')
+    # Confirmación de cuenta y restablecimiento de contraseña
+    crear_indice(cursor, 'USUARIO', 'idx_usuario_token', 'token')
+
+@migracion(2, "Duración de servicios y citas")
+def _duracion_servicios(cursor):
+    # Minutos que toma cada servicio; la cita guarda la suma al reservarse
+    agregar_columna(cursor, 'servicios', 'duracion_minutos', 'INT NOT NULL DEFAULT 30')
+    agregar_columna(cursor, 'CITA', 'duracion_minutos', 'INT NOT NULL DEFAULT 30')
+
+@migracion(3, "Buzón de salida de correos")
+def _buzon_salida(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS correo_salida (
+            correo_id INT AUTO_INCREMENT PRIMARY KEY,
+            destinatario VARCHAR(255) NOT NULL,
+            asunto VARCHAR(255) NOT NULL,
+            cuerpo_html TEXT NOT NULL,
+            estado ENUM('pendiente','enviado','fallido') NOT NULL DEFAULT 'pendiente',
+            intentos INT NOT NULL DEFAULT 0,
+            ultimo_error VARCHAR(255) NULL,
+            proximo_intento DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            creado_en DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            enviado_en DATETIME NULL
+        )
+    """)
+    # El trabajador busca los pendientes listos para enviar
+    crear_indice(cursor, 'correo_salida', 'idx_correo_estado_proximo', 'estado, proximo_intento')
+
+@migracion(4, "Marca de recordatorio enviado en CITA")
+def _recordatorios(cursor):
+    agregar_columna(cursor, 'CITA', 'recordatorio_enviado_en', 'DATETIME NULL')
+    # Citas de un día sin importar barbero ni cliente (recordatorios)
+    crear_indice(cursor, 'CITA', 'idx_cita_fecha_estado', 'fecha, estado')
+
+@migracion(5, "Índices para paginar el listado de citas por (fecha, hora, cita_id)")
+def _indices_listado_citas(cursor):
+    # La clave primaria va implícita al final de cada índice secundario de InnoDB,
+    # así que cada uno da el orden (fecha, hora, cita_id) para su filtro
+    crear_indice(cursor, 'CITA', 'idx_cita_fecha_hora', 'fecha, hora')
+    crear_indice(cursor, 'CITA', 'idx_cita_barbero_fecha_hora', 'barbero_id, fecha, hora')
+    crear_indice(cursor, 'CITA', 'idx_cita_estado_fecha_hora', 'estado, fecha, hora')
+
+@migracion(6, "Tablas resumen diarias para el tablero del administrador")
+def _resumenes_diarios(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_citas_dia (
+            fecha DATE NOT NULL,
+            barbero_id INT NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            total INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, barbero_id, estado)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_cancelaciones_dia (
+            fecha DATE NOT NULL,
+            barbero_id INT NOT NULL,
+            cancelado_por VARCHAR(20) NOT NULL,
+            total INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, barbero_id, cancelado_por)
+        )
+    """)
+
+def rellenar_ultima_cancelacion(cursor):
+    """Copia la última fila de Cancelacion de cada cita a sus columnas en CITA."""
+    cursor.execute("""
+        UPDATE CITA c
+        JOIN (
+            SELECT cita_id, MAX(fecha_cancelacion) AS max_fecha
+            FROM Cancelacion
+            GROUP BY cita_id
+        ) ult ON ult.cita_id = c.cita_id
+        JOIN Cancelacion can
+          ON can.cita_id = ult.cita_id AND can.fecha_cancelacion = ult.max_fecha
+        SET c.cancelacion_motivo = can.motivo,
+            c.cancelacion_fecha = can.fecha_cancelacion,
+            c.cancelado_por = can.cancelado_por
+    """)
+    return cursor.rowcount
+
+@migracion(7, "Última cancelación desnormalizada en CITA")
+def _ultima_cancelacion_en_cita(cursor):
+    agregar_columna(cursor, 'CITA', 'cancelacion_motivo', 'VARCHAR(255) NULL')
+    agregar_columna(cursor, 'CITA', 'cancelacion_fecha', 'DATETIME NULL')
+    agregar_columna(cursor, 'CITA', 'cancelado_por', 'VARCHAR(20) NULL')
+    rellenar_ultima_cancelacion(cursor)
+
+def crear_indice_busqueda(cursor):
+    """
+    Índice FULLTEXT (ngram) de la búsqueda de clientes, sin palabras vacías: el
+    parser ngram descarta todo token que contenga una ("a", "de", "la", "en"...
+    de la lista por defecto de InnoDB), así "Ana" no quedaría indexada y de
+    "María García" casi nada. La lista se toma al crear el índice.
+    """
+    cursor.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+    try:
+        cursor.execute("""
+            CREATE FULLTEXT INDEX ft_usuario_busqueda
+            ON USUARIO (nombre, apellido, email, telefono) WITH PARSER ngram
+        """)
+    finally:
+        cursor.execute("SET SESSION innodb_ft_enable_stopword = DEFAULT")
+
+@migracion(8, "Búsqueda de clientes por nombre, email o teléfono")
+def _busqueda_clientes(cursor):
+    # El parser ngram también encuentra fragmentos (parte del teléfono o del email)
+    if not existe_indice(cursor, 'USUARIO', 'ft_usuario_busqueda'):
+        crear_indice_busqueda(cursor)
+
+@migracion(9, "Tablas de archivo para el historial de citas")
+def _archivo_citas(cursor):
+    # Misma estructura e índices que las tablas vivas, sin claves foráneas:
+    # una cita archivada puede apuntar a un servicio o barbero ya borrado
+    for tabla in ('CITA', 'Cita_servicio', 'Cancelacion'):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {tabla}_archivo LIKE {tabla}")
+
+@migracion(10, "Estado 'enviando' para los correos reclamados por un trabajador")
+def _correo_enviando(cursor):
+    cursor.execute("""
+        ALTER TABLE correo_salida
+        MODIFY estado ENUM('pendiente','enviando','enviado','fallido') NOT NULL DEFAULT 'pendiente'
+    """)
+
+@migracion(11, "Cita de cada recordatorio en el buzón de salida")
+def _correo_cita(cursor):
+    # Sin clave foránea: la cita puede archivarse con el correo aún en el buzón
+    agregar_columna(cursor, 'correo_salida', 'cita_id', 'INT NULL')
+    # Recordatorios aún en cola de una cita (enviar-recordatorios)
+    crear_indice(cursor, 'correo_salida', 'idx_correo_cita_estado', 'cita_id, estado')
+
+@migracion(12, "Índice de búsqueda de clientes sin palabras vacías")
+def _busqueda_sin_palabras_vacias(cursor):
+    # La migración 8 lo creaba con la lista por defecto: hay que reconstruirlo
+    if existe_indice(cursor, 'USUARIO', 'ft_usuario_busqueda'):
+        cursor.execute("DROP INDEX ft_usuario_busqueda ON USUARIO")
+    crear_indice_busqueda(cursor)
+
+# ---------------------------------------------------------------------------
+# Ejecución
+# ---------------------------------------------------------------------------
+def versiones_aplicadas(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migraciones (
+            version INT PRIMARY KEY,
+            descripcion VARCHAR(255) NOT NULL,
+            aplicada_en DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migraciones")
+    return {fila['version'] for fila in cursor.fetchall()}
+
+def aplicar_migraciones(conn, informar=print):
+    """Aplica en orden las migraciones pendientes. Devuelve las versiones aplicadas."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        aplicadas = versiones_aplicadas(cursor)
+        nuevas = []
+        for version, descripcion, funcion in MIGRACIONES:
+            if version in aplicadas:
+                continue
+            informar(f"Aplicando migración {version}: {descripcion}")
+            funcion(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migraciones (version, descripcion) VALUES (%s, %s)",
+                (version, descripcion)
+            )
+            conn.commit()
+            nuevas.append(version)
+        return nuevas
+    finally:
+        cursor.close()
+
+# (nombre, alias de la tabla en el plan, consulta, parámetros de ejemplo)
+CONSULTAS_CALIENTES = [
+    ("horarios ocupados de los barberos (disponibilidad)", "CITA", """
+        SELECT barbero_id, fecha, hora, duracion_minutos FROM CITA
+        WHERE barbero_id IN (%s, %s) AND fecha BETWEEN %s AND %s
+          AND estado IN ('pendiente','confirmada')
+    """, (0, 1, date.today(), date.today())),
+    ("una cita activa por día (procesar_cita)", "CITA", """
+        SELECT 1 FROM CITA
+        WHERE usuario_id = %s AND fecha = %s AND estado IN ('pendiente','confirmada')
+        LIMIT 1
+    """, (0, date.today())),
+    ("página del listado de citas (admin_citas)", "c", """
+        SELECT c.cita_id FROM CITA c
+        WHERE (c.fecha < %s OR (c.fecha = %s AND (c.hora < %s OR (c.hora = %s AND c.cita_id < %s))))
+        ORDER BY c.fecha DESC, c.hora DESC, c.cita_id DESC
+        LIMIT 51
+    """, (date.today(), date.today(), '12:00:00', '12:00:00', 0)),
+    ("búsqueda de clientes (admin_citas)", "USUARIO", """
+        SELECT usuario_id FROM USUARIO
+        WHERE MATCH(nombre, apellido, email, telefono) AGAINST (%s IN BOOLEAN MODE)
+    """, ('+"Ana"',)),
+    ("cuenta por token (confirmar/restablecer)", "USUARIO", """
+        SELECT usuario_id FROM USUARIO WHERE token = %s
+    """, ('0',)),
+    ("citas de mañana sin recordatorio (enviar-recordatorios)", "CITA", """
+        SELECT cita_id FROM CITA
+        WHERE fecha = %s AND estado IN ('pendiente','confirmada')
+          AND recordatorio_enviado_en IS NULL
+    """, (date.today(),)),
+    ("recordatorio aún en cola de una cita (enviar-recordatorios)", "correo_salida", """
+        SELECT 1 FROM correo_salida
+        WHERE cita_id = %s AND estado IN ('pendiente','enviando')
+    """, (0,)),
+    ("lote de citas a archivar (archivar-citas)", "CITA", """
+        SELECT cita_id FROM CITA
+        WHERE fecha < %s
+        ORDER BY fecha, hora
+        LIMIT 1000
+    """, (date.today(),)),
+    ("correos pendientes (trabajador de correo)", "correo_salida", """
+        SELECT correo_id FROM correo_salida
+        WHERE estado IN ('pendiente','enviando') AND proximo_intento <= NOW()
+        ORDER BY proximo_intento
+        LIMIT 50
+    """, ()),
+]
+
+def verificar_busqueda(conn):
+    """
+    Busca a un cliente por su propio nombre con el índice FULLTEXT. Devuelve
+    el nombre si no lo encuentra (p. ej. índice creado con palabras vacías).
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT usuario_id, nombre FROM USUARIO
+            WHERE CHAR_LENGTH(nombre) >= 2 AND LOCATE('"', nombre) = 0
+            ORDER BY usuario_id
+            LIMIT 1
+        """)
+        usuario = cursor.fetchone()
+        if usuario is None:
+            return None
+        cursor.execute("""
+            SELECT usuario_id FROM USUARIO
+            WHERE MATCH(nombre, apellido, email, telefono) AGAINST (%s IN BOOLEAN MODE)
+        """, ('+"%s"' % usuario['nombre'],))
+        encontrados = {fila['usuario_id'] for fila in cursor.fetchall()}
+        return None if usuario['usuario_id'] in encontrados else usuario['nombre']
+    finally:
+        cursor.close()
+
+def verificar_consultas(conn):
+    """
+    Corre EXPLAIN sobre cada consulta caliente. Devuelve una lista de
+    (nombre, plan) con las que recorren su tabla completa (type = ALL).
+    """
+    cursor = conn.cursor(dictionary=True)
+    problemas = []
+    try:
+        for nombre, tabla, sql, params in CONSULTAS_CALIENTES:
+            cursor.execute("EXPLAIN " + sql, params)
+            for fila in cursor.fetchall():
+                if fila.get('table') == tabla and fila.get('type') == 'ALL':
+                    problemas.append((nombre, fila))
+        return problemas
+    finally:
+        cursor.close()
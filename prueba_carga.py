@@ -0,0 +1,257 @@
+"""
+Prueba de carga de la reserva de citas de BLANK concept.
+
+`flask prueba-carga` crea clientes de prueba confirmados en la base de datos
+configurada, lanza un hilo por cliente y cada uno repite, con pausas al azar,
+alguna de estas acciones:
+
+- consultar horarios (obtener_horarios_disponibles) de un día y barbero,
+- reservar: consultar, apartar la hora (retener_horario) y procesar_cita,
+- cancelar: abrir mis_citas y cancelar una de sus citas activas.
+
+Las peticiones pasan por la aplicación completa (sesión, pool, cachés) con un
+cliente de pruebas de Flask por hilo. Al final se informa el rendimiento, las
+latencias p50/p95/p99 por ruta y los rechazos de procesar_cita según su causa
+(guardia de una cita por día, choque con uniq_barbero_slot, etc.).
+"""
+import random
+import re
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from time import monotonic, sleep
+
+from werkzeug.security import generate_password_hash
+
+import resumenes
+
+PREFIJO_EMAIL = 'carga-'
+DOMINIO_EMAIL = '@prueba.local'
+CONTRASENA = 'carga123'
+
+# Peso de cada acción de un cliente: la mayoría sólo mira horarios
+ACCIONES = (('consultar', 60), ('reservar', 25), ('cancelar', 15))
+
+MOTIVOS_CANCELACION = ('Cambio de planes', 'Enfermedad', 'Otro')
+
+# ---------------------------------------------------------------------------
+# Datos de prueba
+# ---------------------------------------------------------------------------
+def email_cliente(numero):
+    return f"{PREFIJO_EMAIL}{numero}{DOMINIO_EMAIL}"
+
+def preparar_clientes(conn, cantidad):
+    """Crea (o reutiliza) `cantidad` clientes confirmados. Devuelve sus emails."""
+    cursor = conn.cursor()
+    try:
+        emails = [email_cliente(i) for i in range(cantidad)]
+        marcadores = ', '.join(['%s'] * len(emails))
+        cursor.execute(f"SELECT email FROM USUARIO WHERE email IN ({marcadores})", emails)
+        existentes = {fila[0] for fila in cursor.fetchall()}
+        nuevos = [e for e in emails if e not in existentes]
+        if nuevos:
+            # El hash es lento a propósito: se calcula una sola vez para todos
+            hashed = generate_password_hash(CONTRASENA)
+            cursor.executemany(
+                "INSERT INTO USUARIO (nombre, apellido, email, telefono, contraseña, confirmado) VALUES (%s, %s, %s, %s, %s, %s)",
+                [('Carga', e.split('@')[0], e, '0000000000', hashed, 1) for e in nuevos]
+            )
+        conn.commit()
+        return emails
+    finally:
+        cursor.close()
+
+def limpiar_clientes(conn):
+    """
+    Borra los clientes de prueba junto con sus citas, servicios y cancelaciones,
+    y recalcula los resúmenes de los días que tenían citas de prueba.
+    """
+    cursor = conn.cursor()
+    try:
+        filtro = "SELECT usuario_id FROM USUARIO WHERE email LIKE %s"
+        patron = PREFIJO_EMAIL + '%' + DOMINIO_EMAIL
+        cursor.execute(f"SELECT MIN(fecha), MAX(fecha) FROM CITA WHERE usuario_id IN ({filtro})", (patron,))
+        desde, hasta = cursor.fetchone()
+        for tabla in ('Cancelacion', 'Cita_servicio'):
+            cursor.execute(f"""
+                DELETE FROM {tabla}
+                WHERE cita_id IN (SELECT cita_id FROM CITA WHERE usuario_id IN ({filtro}))
+            """, (patron,))
+        cursor.execute(f"DELETE FROM CITA WHERE usuario_id IN ({filtro})", (patron,))
+        cursor.execute("DELETE FROM USUARIO WHERE email LIKE %s", (patron,))
+        if desde:
+            # En la misma transacción: el borrado y los resúmenes sin esas citas se confirman juntos
+            resumenes.reconstruir(conn, desde, hasta)
+        else:
+            conn.commit()
+    finally:
+        cursor.close()
+
+# ---------------------------------------------------------------------------
+# Mediciones
+# ---------------------------------------------------------------------------
+class Mediciones:
+    """Latencias por ruta y resultados de las reservas, compartidos por los hilos."""
+
+    def __init__(self):
+        self._latencias = defaultdict(list)
+        self._resultados = defaultdict(int)
+        self._errores = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def registrar(self, ruta, segundos, estado_http):
+        with self._lock:
+            self._latencias[ruta].append(segundos)
+            if estado_http >= 500:
+                self._errores[ruta] += 1
+
+    def resultado(self, nombre):
+        with self._lock:
+            self._resultados[nombre] += 1
+
+    def resumen(self):
+        with self._lock:
+            rutas = {
+                ruta: {
+                    'peticiones': len(valores),
+                    'errores': self._errores[ruta],
+                    'p50': percentil(valores, 50),
+                    'p95': percentil(valores, 95),
+                    'p99': percentil(valores, 99),
+                }
+                for ruta, valores in sorted(self._latencias.items())
+            }
+            return rutas, dict(self._resultados)
+
+def percentil(valores, p):
+    """Percentil por rango más cercano (en segundos)."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    rango = max(1, -(-p * len(ordenados) // 100))
+    return ordenados[rango - 1]
+
+# ---------------------------------------------------------------------------
+# Clientes virtuales
+# ---------------------------------------------------------------------------
+class ClienteVirtual:
+    """Un cliente con su propia sesión que elige acciones con los pesos de ACCIONES."""
+
+    def __init__(self, app, email, mediciones, barberos, servicios, dias, pausa_media, semilla, direccion='127.0.0.1'):
+        self.cliente = app.test_client()
+        # Cada cliente con su propia IP, como clientes reales (límite de intentos por IP)
+        self.cliente.environ_base['REMOTE_ADDR'] = direccion
+        self.email = email
+        self.mediciones = mediciones
+        self.barberos = barberos
+        self.servicios = servicios
+        self.dias = dias
+        self.pausa_media = pausa_media
+        self.azar = random.Random(semilla)
+
+    def _pedir(self, metodo, ruta, **kwargs):
+        inicio = monotonic()
+        respuesta = self.cliente.open(ruta, method=metodo, **kwargs)
+        self.mediciones.registrar(f"{metodo} {ruta}", monotonic() - inicio, respuesta.status_code)
+        return respuesta
+
+    def _mensajes(self):
+        """Saca los mensajes flash pendientes de la sesión."""
+        with self.cliente.session_transaction() as sesion:
+            return [mensaje for _, mensaje in sesion.pop('_flashes', [])]
+
+    def iniciar_sesion(self):
+        self._pedir('POST', '/login', data={'email': self.email, 'password': CONTRASENA})
+        self._mensajes()
+
+    def _elegir_dia_y_barbero(self):
+        # Los días cercanos y los primeros barberos de la lista se piden más
+        dia = self.azar.choices(self.dias, weights=[1 / (i + 1) for i in range(len(self.dias))])[0]
+        barbero = self.azar.choices(self.barberos, weights=[1 / (i + 1) for i in range(len(self.barberos))])[0]
+        return dia, barbero
+
+    def _horarios(self, dia, barbero, duracion):
+        respuesta = self._pedir('POST', '/obtener_horarios_disponibles', data={
+            'fecha': dia.isoformat(), 'barbero_id': barbero, 'duracion': duracion
+        })
+        if respuesta.status_code != 200:
+            return []
+        return respuesta.get_json().get('horarios', [])
+
+    def consultar(self):
+        dia, barbero = self._elegir_dia_y_barbero()
+        self._horarios(dia, barbero, self.servicios[0][1])
+
+    def reservar(self):
+        dia, barbero = self._elegir_dia_y_barbero()
+        elegidos = self.azar.sample(self.servicios, k=min(len(self.servicios), self.azar.choice((1, 1, 2))))
+        duracion = sum(d for _, d in elegidos)
+        horarios = self._horarios(dia, barbero, duracion)
+        if not horarios:
+            self.mediciones.resultado('sin_horarios')
+            return
+        # Las primeras horas del día son las más buscadas
+        hora = self.azar.choices(horarios, weights=[1 / (i + 1) for i in range(len(horarios))])[0]
+
+        datos = {'barbero_id': barbero, 'fecha': dia.isoformat(), 'hora': hora, 'duracion': duracion}
+        respuesta = self._pedir('POST', '/retener_horario', data=datos)
+        if respuesta.status_code == 409:
+            self.mediciones.resultado('retenido_por_otro')
+            return
+        token = (respuesta.get_json() or {}).get('token', '')
+
+        datos.update({'servicios[]': [s for s, _ in elegidos], 'retencion_token': token})
+        respuesta = self._pedir('POST', '/procesar_cita', data=datos)
+        self._mensajes()
+        destino = respuesta.headers.get('Location', '')
+        self.mediciones.resultado('reservada' if destino.endswith('/mis_citas') else 'rechazada')
+
+    def cancelar(self):
+        respuesta = self._pedir('GET', '/mis_citas')
+        # Sólo las citas activas tienen formulario de cancelación
+        activas = re.findall(r'name="cita_id" value="(\d+)"', respuesta.get_data(as_text=True))
+        if not activas:
+            return
+        respuesta = self._pedir('POST', '/cancelar_cita', data={
+            'cita_id': self.azar.choice(activas), 'motivo': self.azar.choice(MOTIVOS_CANCELACION)
+        })
+        # Éxito y rechazo redirigen a mis_citas: sólo el mensaje dice cuál fue
+        mensajes = self._mensajes()
+        exito = respuesta.status_code < 400 and any('cancelada exitosamente' in m for m in mensajes)
+        self.mediciones.resultado('cancelada' if exito else 'cancelacion_rechazada')
+
+    def ejecutar(self, hasta):
+        self.iniciar_sesion()
+        nombres = [nombre for nombre, _ in ACCIONES]
+        pesos = [peso for _, peso in ACCIONES]
+        while monotonic() < hasta:
+            getattr(self, self.azar.choices(nombres, weights=pesos)[0])()
+            if self.pausa_media:
+                sleep(self.azar.expovariate(1 / self.pausa_media))
+
+def ejecutar_prueba(app, emails, barberos, servicios, segundos, dias=7, pausa_media=0.5, semilla=None):
+    """
+    Lanza un hilo por email durante `segundos`. `barberos` es la lista de
+    barbero_id y `servicios` pares (servicio_id, duracion_minutos).
+    Devuelve (segundos reales, resumen por ruta, resultados de las reservas).
+    """
+    mediciones = Mediciones()
+    azar = random.Random(semilla)
+    hoy = date.today()
+    proximos = [hoy + timedelta(days=i) for i in range(dias)]
+    clientes = [
+        ClienteVirtual(app, email, mediciones, barberos, servicios, proximos, pausa_media, azar.random(),
+                       direccion=f"10.0.{i // 256}.{i % 256}")
+        for i, email in enumerate(emails)
+    ]
+
+    inicio = monotonic()
+    hasta = inicio + segundos
+    hilos = [threading.Thread(target=c.ejecutar, args=(hasta,), daemon=True) for c in clientes]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    rutas, resultados = mediciones.resumen()
+    return monotonic() - inicio, rutas, resultados
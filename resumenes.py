@@ -0,0 +1,112 @@
+"""
+Tablas resumen (rollups) diarias para el tablero del administrador.
+
+- resumen_citas_dia: cuántas citas hay por (fecha, barbero_id, estado).
+- resumen_cancelaciones_dia: cuántas cancelaciones registró cada lado
+  (cliente/barbero) por (fecha de la cita, barbero_id).
+
+Las rutas que crean una cita o le cambian el estado llaman a `mover_estado` /
+`sumar_cancelacion` con su propio cursor, dentro de la misma transacción que
+el cambio, así los contadores nunca quedan a medias. `reconstruir` los vuelve
+a calcular desde CITA y Cancelacion, vivas y archivadas
+(`flask reconstruir-resumenes`).
+"""
+from archivado import FUENTES
+
+def _sumar(cursor, tabla, columna, fecha, barbero_id, valor, cantidad):
+    cursor.execute(f"""
+        INSERT INTO {tabla} (fecha, barbero_id, {columna}, total)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total)
+    """, (fecha, barbero_id, valor, cantidad))
+
+def mover_estado(cursor, fecha, barbero_id, anterior, nuevo):
+    """Pasa una cita de `anterior` a `nuevo` (None = la cita no existía / se borró)."""
+    if anterior == nuevo:
+        return
+    if anterior is not None:
+        _sumar(cursor, 'resumen_citas_dia', 'estado', fecha, barbero_id, anterior, -1)
+    if nuevo is not None:
+        _sumar(cursor, 'resumen_citas_dia', 'estado', fecha, barbero_id, nuevo, 1)
+
+def sumar_cancelacion(cursor, fecha, barbero_id, cancelado_por):
+    _sumar(cursor, 'resumen_cancelaciones_dia', 'cancelado_por', fecha, barbero_id, cancelado_por, 1)
+
+def reconstruir(conn, desde=None, hasta=None):
+    """
+    Recalcula los resúmenes (de todo el historial o del rango dado) en una
+    transacción, contando tanto las citas vivas como las archivadas.
+    """
+    condicion, condicion_cita, params = "1=1", "1=1", ()
+    if desde and hasta:
+        condicion, condicion_cita = "fecha BETWEEN %s AND %s", "c.fecha BETWEEN %s AND %s"
+        params = (desde, hasta)
+    citas = ' UNION ALL '.join(
+        f"SELECT fecha, barbero_id, estado FROM {f['cita']} WHERE {condicion}"
+        for f in FUENTES
+    )
+    cancelaciones = ' UNION ALL '.join(
+        f"""SELECT c.fecha, c.barbero_id, can.cancelado_por
+            FROM {f['cancelacion']} can
+            JOIN {f['cita']} c ON c.cita_id = can.cita_id
+            WHERE {condicion_cita}"""
+        for f in FUENTES
+    )
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM resumen_citas_dia WHERE {condicion}", params)
+        cursor.execute(f"""
+            INSERT INTO resumen_citas_dia (fecha, barbero_id, estado, total)
+            SELECT fecha, barbero_id, estado, COUNT(*)
+            FROM ({citas}) t
+            GROUP BY fecha, barbero_id, estado
+        """, params * len(FUENTES))
+        cursor.execute(f"DELETE FROM resumen_cancelaciones_dia WHERE {condicion}", params)
+        cursor.execute(f"""
+            INSERT INTO resumen_cancelaciones_dia (fecha, barbero_id, cancelado_por, total)
+            SELECT fecha, barbero_id, COALESCE(cancelado_por, 'desconocido'), COUNT(*)
+            FROM ({cancelaciones}) t
+            GROUP BY fecha, barbero_id, COALESCE(cancelado_por, 'desconocido')
+        """, params * len(FUENTES))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def indicadores(cursor, desde, hasta):
+    """
+    KPIs del rango [desde, hasta] leyendo sólo los resúmenes:
+    citas por barbero y estado, cancelaciones por quién canceló y tasa de
+    citas completadas sobre las ya resueltas (completada, cancelada, no asistio).
+    """
+    cursor.execute("""
+        SELECT barbero_id, estado, SUM(total) AS total
+        FROM resumen_citas_dia
+        WHERE fecha BETWEEN %s AND %s
+        GROUP BY barbero_id, estado
+    """, (desde, hasta))
+    por_barbero = {}
+    por_estado = {}
+    for fila in cursor.fetchall():
+        total = int(fila['total'])
+        por_barbero.setdefault(fila['barbero_id'], {})[fila['estado']] = total
+        por_estado[fila['estado']] = por_estado.get(fila['estado'], 0) + total
+
+    cursor.execute("""
+        SELECT cancelado_por, SUM(total) AS total
+        FROM resumen_cancelaciones_dia
+        WHERE fecha BETWEEN %s AND %s
+        GROUP BY cancelado_por
+    """, (desde, hasta))
+    cancelaciones = {fila['cancelado_por']: int(fila['total']) for fila in cursor.fetchall()}
+
+    resueltas = sum(por_estado.get(e, 0) for e in ('completada', 'cancelada', 'no asistio'))
+    return {
+        'por_barbero': por_barbero,
+        'por_estado': por_estado,
+        'total': sum(por_estado.values()),
+        'cancelaciones': cancelaciones,
+        'tasa_completadas': por_estado.get('completada', 0) / resueltas if resueltas else None,
+    }
@@ -2,6 +2,7 @@
 (function () {
   const fecha = document.getElementById('fechaSelect');
   const horaHidden = document.getElementById('horaHidden');
+  const retencionToken = document.getElementById('retencionToken');
   const horaSelectFallback = document.getElementById('horaSelect'); // respaldo
   const reservarBtn = document.getElementById('btnReservar');
   const slotsContainer = document.getElementById('slotsContainer');
@@ -82,7 +83,7 @@
     });
   }
 
-  function selectSlot(btn) {
+  async function selectSlot(btn) {
     if (selectedSlotBtn) selectedSlotBtn.classList.remove('selected');
     selectedSlotBtn = btn;
     btn.classList.add('selected');
@@ -90,6 +91,41 @@
     // mantener el select de respaldo sincronizado, por si el backend lo usa
     syncFallbackSelect(btn.dataset.time);
     reservarBtn.disabled = false;
+
+    // Apartar la hora unos minutos mientras se termina el formulario
+    if (retencionToken) retencionToken.value = '';
+    const ok = await retenerHorario(btn.dataset.time);
+    if (!ok && selectedSlotBtn === btn) {
+      btn.classList.remove('selected');
+      btn.disabled = true;
+      selectedSlotBtn = null;
+      horaHidden.value = '';
+      reservarBtn.disabled = true;
+      slotsMessage.textContent = 'Otro cliente está reservando esa hora. Elige otra.';
+      slotsContainer.querySelector('.slots-empty').classList.remove('d-none');
+      delete cacheDisponibilidad[`${selectedBarbero}|${fecha.value}|${duracionSeleccionada()}`];
+    }
+  }
+
+  // Devuelve false sólo si otro cliente ya apartó la hora; ante otros errores
+  // se deja seguir (procesar_cita vuelve a validar el horario)
+  async function retenerHorario(hhmm) {
+    const formData = new FormData();
+    formData.append('barbero_id', selectedBarbero);
+    formData.append('fecha', fecha.value);
+    formData.append('hora', hhmm);
+    formData.append('duracion', duracionSeleccionada());
+    try {
+      const resp = await fetch('/retener_horario', { method: 'POST', body: formData });
+      if (resp.status === 409) return false;
+      if (resp.ok) {
+        const data = await resp.json();
+        if (retencionToken && horaHidden.value === hhmm) retencionToken.value = data.token;
+      }
+    } catch (err) {
+      console.error(err);
+    }
+    return true;
   }
 
   function syncFallbackSelect(hhmm) {
@@ -102,22 +138,103 @@
     horaSelectFallback.disabled = false;
   }
 
+  // ----- Disponibilidad por semana: una sola petición para todos los barberos -----
+  const DIAS_SEMANA = 7;
+  const VIGENCIA_MS = 60 * 1000;
+  const cacheDisponibilidad = {}; // 'barbero|fecha|duracion' -> { data, cargado }
+
+  // Minutos que ocuparán los servicios marcados (el servidor redondea al slot)
+  function duracionSeleccionada() {
+    let total = 0;
+    document.querySelectorAll('.servicio-checkbox:checked').forEach(cb => {
+      total += parseInt(cb.getAttribute('data-duracion') || '0', 10);
+    });
+    return total;
+  }
+
+  function fechaIso(d) {
+    const mm = String(d.getMonth() + 1).padStart(2, '0');
+    const dd = String(d.getDate()).padStart(2, '0');
+    return `${d.getFullYear()}-${mm}-${dd}`;
+  }
+
+  function sumarDias(iso, dias) {
+    const d = new Date(iso + 'T00:00:00');
+    d.setDate(d.getDate() + dias);
+    return fechaIso(d);
+  }
+
+  // Convierte una máscara hexadecimal de slots en horas 'HH:MM'
+  function horasDeMascara(hex, slotMinutos) {
+    const horas = [];
+    let mascara = BigInt('0x' + hex);
+    let i = 0;
+    while (mascara > 0n) {
+      if (mascara & 1n) {
+        const min = i * slotMinutos;
+        horas.push(`${String(Math.floor(min / 60)).padStart(2, '0')}:${String(min % 60).padStart(2, '0')}`);
+      }
+      mascara >>= 1n;
+      i++;
+    }
+    return horas;
+  }
+
+  async function cargarSemana(desde, duracion) {
+    const hasta = sumarDias(desde, DIAS_SEMANA - 1);
+    const resp = await fetch(`/disponibilidad?desde=${desde}&hasta=${hasta}&duracion=${duracion}`);
+    if (!resp.ok) return;
+    const data = await resp.json();
+    const hoy = fechaIso(new Date());
+    const ahora = Date.now();
+
+    data.dias.forEach((dia, i) => {
+      const cerrado = data.abiertos[i] === '0';
+      Object.entries(data.libres).forEach(([barberoId, mascaras]) => {
+        const horarios = horasDeMascara(mascaras[i], data.slot_minutos);
+        let resultado = { horarios };
+        if (cerrado && dia !== hoy) {
+          resultado = { horarios: [], cerrado: true, mensaje: 'La barbería estará cerrada este día.' };
+        } else if (dia === hoy && horarios.length === 0) {
+          resultado = { horarios: [], cerrado: true };
+        }
+        cacheDisponibilidad[`${barberoId}|${dia}|${duracion}`] = { data: resultado, cargado: ahora };
+      });
+    });
+  }
+
+  async function disponibilidadDe(barberoId, dia) {
+    const duracion = duracionSeleccionada();
+    const clave = `${barberoId}|${dia}|${duracion}`;
+    const enCache = cacheDisponibilidad[clave];
+    if (enCache && Date.now() - enCache.cargado < VIGENCIA_MS) return enCache.data;
+
+    try {
+      await cargarSemana(dia, duracion);
+      if (cacheDisponibilidad[clave]) return cacheDisponibilidad[clave].data;
+    } catch (err) {
+      console.error(err);
+    }
+
+    // Respaldo: consulta puntual de un barbero y un día
+    const formData = new FormData();
+    formData.append('barbero_id', barberoId);
+    formData.append('fecha', dia);
+    formData.append('duracion', duracion);
+    const resp = await fetch('/obtener_horarios_disponibles', {
+      method: 'POST',
+      body: formData
+    });
+    if (!resp.ok) throw new Error('No se pudieron cargar los horarios.');
+    return resp.json();
+  }
+
   async function fetchHorarios() {
     if (!selectedBarbero || !fecha.value) return;
     try {
       renderLoading();
 
-      const formData = new FormData();
-      formData.append('barbero_id', selectedBarbero);
-      formData.append('fecha', fecha.value);
-
-      const resp = await fetch('/obtener_horarios_disponibles', {
-        method: 'POST',
-        body: formData
-      });
-
-      if (!resp.ok) throw new Error('No se pudieron cargar los horarios.');
-      const data = await resp.json();
+      const data = await disponibilidadDe(selectedBarbero, fecha.value);
 
       // Manejo de barbería cerrada
       if (data.cerrado) {
@@ -180,6 +297,15 @@
   }
 
   checkboxes.forEach(cb => cb.addEventListener('change', updateExtrasAndTotal));
+
+  // La duración cambia con los servicios: los horarios libres también
+  checkboxes.forEach(cb => cb.addEventListener('change', () => {
+    if (selectedBarbero && fecha.value) {
+      horaHidden.value = '';
+      reservarBtn.disabled = true;
+      fetchHorarios();
+    }
+  }));
   updateExtrasAndTotal();
    if (window.BARBERO_INICIAL_ID) {
     const rbInicial = document.querySelector(
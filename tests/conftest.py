@@ -0,0 +1,124 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Las pruebas no arrancan el hilo del buzón de salida
+os.environ['CORREO_TRABAJADOR'] = '0'
+
+
+@pytest.fixture
+def modulo_app():
+    """El módulo app (se salta la prueba si faltan Flask o el conector de MySQL)."""
+    modulo = pytest.importorskip('app')
+    modulo.app.config.update(TESTING=True)
+    return modulo
+
+
+@pytest.fixture
+def m(modulo_app, monkeypatch):
+    """El módulo app con slots de 30 minutos."""
+    monkeypatch.setattr(modulo_app, 'SLOT_MINUTOS', 30)
+    return modulo_app
+
+
+@pytest.fixture
+def cliente_con_sesion(modulo_app):
+    """Crea clientes de pruebas con sesión iniciada (sin sesión si usuario_id es None)."""
+    def crear(usuario_id, rol=3, ip=None):
+        cliente = modulo_app.app.test_client()
+        if ip:
+            cliente.environ_base['REMOTE_ADDR'] = ip
+        if usuario_id is not None:
+            with cliente.session_transaction() as sesion:
+                sesion['user_id'] = usuario_id
+                sesion['user_role'] = rol
+        return cliente
+    return crear
+
+
+@pytest.fixture
+def cliente_admin(cliente_con_sesion):
+    return cliente_con_sesion(1, rol=1)
+
+
+class Reloj:
+    """Reemplazo de monotonic que sólo avanza cuando la prueba mueve `ahora`."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(modulo_app, monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(modulo_app, 'monotonic', reloj)
+    return reloj
+
+
+def mensajes_flash(cliente):
+    with cliente.session_transaction() as sesion:
+        return [mensaje for _, mensaje in sesion.pop('_flashes', [])]
+
+
+class CursorFalso:
+    """Cursor que anota cada sentencia y devuelve las filas preparadas en la conexión."""
+
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        if self.conexion.fallar_en and self.conexion.fallar_en in sql:
+            raise RuntimeError(f'falla simulada en: {sql}')
+        self.conexion.sentencias.append((sql, params))
+
+    def executemany(self, sql, filas):
+        for params in filas:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self.conexion.filas.pop(0) if self.conexion.filas else None
+
+    def fetchall(self):
+        return self.conexion.filas.pop(0) if self.conexion.filas else []
+
+    def close(self):
+        pass
+
+
+class ConexionFalsa:
+    def __init__(self, filas=()):
+        self.filas = list(filas)  # resultados de fetchone/fetchall, en orden
+        self.sentencias = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fallar_en = None  # fragmento de SQL que hace fallar a execute
+
+    def cursor(self, **kwargs):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+    def ejecuto(self, fragmento):
+        return any(fragmento in sql for sql, _ in self.sentencias)
+
+
+@pytest.fixture
+def base_falsa(modulo_app, monkeypatch):
+    """Reemplaza la conexión de las peticiones; cargar filas en base_falsa.filas."""
+    conexion = ConexionFalsa()
+    monkeypatch.setattr(modulo_app, 'get_db_connection', lambda: conexion)
+    return conexion
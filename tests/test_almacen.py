@@ -0,0 +1,77 @@
+import pytest
+
+
+@pytest.fixture
+def almacen(modulo_app, reloj):
+    return modulo_app.AlmacenMemoria()
+
+
+def test_agregar_solo_si_no_existe(almacen, reloj):
+    assert almacen.agregar('k', 'a', 10)
+    assert not almacen.agregar('k', 'b', 10)
+    assert almacen.obtener('k') == 'a'
+    reloj.ahora += 10
+    assert almacen.obtener('k') is None
+    assert almacen.agregar('k', 'b', 10)
+
+
+def test_buscar_por_prefijo_sin_vencidas(almacen, reloj):
+    almacen.guardar('x:1', 1, 5)
+    almacen.guardar('x:2', 2, 20)
+    almacen.guardar('y:1', 3, 20)
+    reloj.ahora += 6
+    assert almacen.buscar('x:') == {'x:2': 2}
+
+
+def test_grupo_de_campos_todo_o_nada(almacen):
+    assert almacen.agregar_campos('dia', {'7:20': 'a', '7:21': 'a'}, 60)
+    assert not almacen.agregar_campos('dia', {'7:21': 'b', '7:22': 'b'}, 60)
+    assert almacen.campos('dia') == {'7:20': 'a', '7:21': 'a'}
+
+
+def test_cada_campo_vence_por_su_cuenta(almacen, reloj):
+    almacen.agregar_campos('dia', {'7:20': 'a'}, 10)
+    reloj.ahora += 5
+    almacen.agregar_campos('dia', {'7:30': 'b'}, 10)
+    reloj.ahora += 6
+    assert almacen.campos('dia') == {'7:30': 'b'}
+    assert almacen.agregar_campos('dia', {'7:20': 'c'}, 10)
+
+
+def test_eliminar_campos_con_valor(almacen):
+    almacen.agregar_campos('dia', {'7:20': 'a', '7:21': 'b'}, 10)
+    almacen.eliminar_campos('dia', ['7:20', '7:21'], valor='a')
+    assert almacen.campos('dia') == {'7:21': 'b'}
+    almacen.eliminar_campos('dia', ['7:21'])
+    assert almacen.campos('dia') == {}
+
+
+def test_tomar_ficha_gasta_la_capacidad_y_avisa_la_espera(almacen, reloj):
+    assert [almacen.tomar_ficha('f', 3, 10) for _ in range(3)] == [0, 0, 0]
+    assert almacen.tomar_ficha('f', 3, 10) == 10
+    reloj.ahora += 4
+    assert almacen.tomar_ficha('f', 3, 10) == pytest.approx(6)
+
+
+def test_tomar_ficha_recupera_con_el_tiempo(almacen, reloj):
+    for _ in range(2):
+        almacen.tomar_ficha('f', 2, 10)
+    reloj.ahora += 10
+    assert almacen.tomar_ficha('f', 2, 10) == 0
+    assert almacen.tomar_ficha('f', 2, 10) > 0
+    # Nunca junta más fichas que la capacidad
+    reloj.ahora += 1000
+    assert [almacen.tomar_ficha('f', 2, 10) for _ in range(3)][2] > 0
+
+
+def test_cubeta_llena_no_ocupa_el_almacen(almacen, reloj):
+    almacen.tomar_ficha('f', 2, 10)
+    reloj.ahora += 10
+    assert almacen.obtener('f') is None
+    assert almacen.tomar_ficha('f', 2, 10) == 0
+
+
+def test_tomar_ficha_claves_independientes(almacen):
+    assert almacen.tomar_ficha('a', 1, 60) == 0
+    assert almacen.tomar_ficha('a', 1, 60) > 0
+    assert almacen.tomar_ficha('b', 1, 60) == 0
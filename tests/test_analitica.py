@@ -0,0 +1,97 @@
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import analitica
+
+LUNES = date(2026, 5, 4)
+SLOT = 30
+# 09:00 a 11:00 en slots de 30 minutos
+APERTURA = sum(1 << s for s in range(18, 22))
+
+PENDIENTE, COMPLETADA, CANCELADA, NO_ASISTIO = (
+    analitica.ESTADOS.index(e) + 1 for e in ('pendiente', 'completada', 'cancelada', 'no asistio')
+)
+
+
+@pytest.fixture
+def datos():
+    citas = np.array([
+        (7, 0, 9 * 60, 60, COMPLETADA),        # lunes 09:00-10:00
+        (7, 0, 10 * 60, 30, CANCELADA),        # lunes 10:00, no ocupa
+        (8, 1, 10 * 60 + 30, 30, NO_ASISTIO),  # martes 10:30
+        (7, 1, 11 * 60, 30, PENDIENTE),        # martes 11:00, fuera del horario
+    ], dtype=np.int32)
+    return analitica.calcular(citas, [7, 8, 9], LUNES, [APERTURA, APERTURA], SLOT)
+
+
+def test_horas_y_barberos(datos):
+    assert datos['barberos'] == [7, 8, 9]
+    assert datos['horas'] == [9, 10, 11]  # 11 sólo por la cita fuera del horario
+    assert datos['citas'] == 4
+
+
+def test_utilizacion_por_dia_de_la_semana_y_hora(datos):
+    lunes, martes = datos['utilizacion'][0][0], datos['utilizacion'][0][1]
+    assert lunes == [1.0, 0.0, None]
+    assert martes == [0.0, 0.0, None]
+    assert datos['utilizacion'][1][1] == [0.0, 0.5, None]
+    # Miércoles a domingo no abrieron en el rango
+    assert datos['utilizacion'][0][2:] == [[None, None, None]] * 5
+
+
+def test_utilizacion_total_y_por_barbero(datos):
+    assert datos['utilizacion_total'][0] == [0.333, 0.0, None]
+    assert datos['utilizacion_total'][1] == [0.0, 0.167, None]
+    assert datos['utilizacion_barbero'] == [0.25, 0.125, 0.0]
+
+
+def test_tasas_por_hora_de_inicio(datos):
+    assert datos['citas_por_hora'] == [[1, 1, 1], [0, 1, 0], [0, 0, 0]]
+    assert datos['tasa_cancelacion'] == [[0.0, 1.0, 0.0], [None, 0.0, None], [None, None, None]]
+    # Sólo cuentan las resueltas (completada o no asistio)
+    assert datos['tasa_no_asistio'] == [[0.0, None, None], [None, 1.0, None], [None, None, None]]
+
+
+def test_sin_citas():
+    vacio = analitica.calcular(np.zeros((0, 5), dtype=np.int32), [7], LUNES, [APERTURA], SLOT)
+    assert vacio['horas'] == [9, 10]
+    assert vacio['utilizacion'][0][0] == [0.0, 0.0]
+    assert vacio['tasa_cancelacion'] == [[None, None]]
+
+
+def test_cita_que_cruza_la_medianoche_no_se_sale_de_la_matriz():
+    citas = np.array([(7, 0, 23 * 60 + 30, 90, COMPLETADA)], dtype=np.int32)
+    abierto = 1 << 47
+    datos = analitica.calcular(citas, [7], LUNES, [abierto], SLOT)
+    assert datos['utilizacion'][0][0] == [1.0]
+
+
+def test_matriz_apertura_con_slots_cortos():
+    # 288 slots de 5 minutos: las máscaras no caben en un int64
+    abiertos = analitica.matriz_apertura([1 << 287, 1], 5)
+    assert abiertos.shape == (2, 288)
+    assert abiertos[0, 287] and abiertos.sum() == 2
+
+
+def test_leer_citas_por_lotes(monkeypatch):
+    class Cursor:
+        def __init__(self, filas):
+            self.filas = filas
+
+        def fetchmany(self, cuantas):
+            lote, self.filas = self.filas[:cuantas], self.filas[cuantas:]
+            return lote
+
+    monkeypatch.setattr(analitica, 'FILAS_POR_LOTE', 2)
+    filas = [(7, d, 540, 30, COMPLETADA) for d in range(5)]
+    assert analitica.leer_citas(Cursor(filas)).tolist() == [list(f) for f in filas]
+    assert analitica.leer_citas(Cursor([])).shape == (0, 5)
+
+
+def test_consulta_citas_une_las_tablas():
+    sql, params = analitica.consulta_citas(SLOT, LUNES, date(2026, 5, 10), ('CITA', 'CITA_archivo'))
+    assert sql.count('UNION ALL') == 1 and 'FROM CITA_archivo' in sql
+    assert sql.count('%s') == len(params)
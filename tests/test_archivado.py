@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+import pytest
+
+import archivado
+from conftest import ConexionFalsa
+
+COLUMNAS = [[('cita_id',), ('fecha',)], [('cita_id',), ('servicio_id',)], [('cita_id',), ('motivo',)]]
+
+
+def conexion(*lotes):
+    return ConexionFalsa(COLUMNAS + [[(i,) for i in lote] for lote in lotes])
+
+
+def movimientos(conn):
+    """(INSERT/DELETE, tabla) de cada sentencia que mueve filas."""
+    pasos = []
+    for sql, _ in conn.sentencias:
+        if sql.startswith('INSERT INTO'):
+            pasos.append(('INSERT', sql.split()[2]))
+        elif sql.startswith('DELETE FROM'):
+            pasos.append(('DELETE', sql.split()[2]))
+    return pasos
+
+
+def test_copia_padres_primero_y_borra_hijas_primero():
+    conn = conexion([1, 2])
+    assert archivado.archivar(conn, '2025-01-01', informar=lambda m: None) == 2
+    assert movimientos(conn) == [
+        ('INSERT', 'CITA_archivo'), ('INSERT', 'Cita_servicio_archivo'), ('INSERT', 'Cancelacion_archivo'),
+        ('DELETE', 'Cancelacion'), ('DELETE', 'Cita_servicio'), ('DELETE', 'CITA'),
+    ]
+    insert = next(sql for sql, _ in conn.sentencias if sql.startswith('INSERT INTO Cita_servicio_archivo'))
+    assert '(`cita_id`, `servicio_id`)' in insert
+    assert all(params == [1, 2] for sql, params in conn.sentencias if sql.startswith(('INSERT', 'DELETE')))
+
+
+def test_repite_lotes_hasta_uno_vacio():
+    conn = conexion([1, 2], [3])
+    informes = []
+    assert archivado.archivar(conn, '2025-01-01', tamano=2, informar=informes.append) == 3
+    lotes = [params for sql, params in conn.sentencias if sql.startswith('SELECT cita_id FROM CITA')]
+    assert lotes == [('2025-01-01', 2)] * 3
+    assert informes == ['2 cita(s) archivada(s)...', '3 cita(s) archivada(s)...']
+    # Un commit por lote movido más el del lote vacío
+    assert conn.commits == 3 and conn.rollbacks == 0
+
+
+def test_sin_citas_viejas_no_mueve_nada():
+    conn = conexion()
+    assert archivado.archivar(conn, '2025-01-01', informar=lambda m: None) == 0
+    assert movimientos(conn) == []
+    assert conn.commits == 1
+
+
+def test_falla_al_copiar_deshace_el_lote():
+    conn = conexion([1, 2])
+    conn.fallar_en = 'INSERT INTO Cancelacion_archivo'
+    with pytest.raises(RuntimeError):
+        archivado.archivar(conn, '2025-01-01', informar=lambda m: None)
+    assert conn.rollbacks == 1 and conn.commits == 0
+    assert not conn.ejecuto('DELETE FROM')
+
+
+def test_comando_usa_el_horizonte_y_rechaza_dias_invalidos(modulo_app, monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(modulo_app, 'get_db', lambda: 'conexion')
+    monkeypatch.setattr(archivado, 'archivar', lambda *args, **kwargs: llamadas.append(args) or 0)
+    runner = modulo_app.app.test_cli_runner()
+
+    resultado = runner.invoke(args=['archivar-citas', '--dias', '30', '--lote', '10'])
+    assert resultado.exit_code == 0
+    assert llamadas == [('conexion', date.today() - timedelta(days=30), 10)]
+
+    assert runner.invoke(args=['archivar-citas', '--dias', '0']).exit_code != 0
+    assert len(llamadas) == 1
@@ -0,0 +1,183 @@
+import socket
+from datetime import date, timedelta
+
+import pytest
+
+import buzon_salida
+from conftest import ConexionFalsa
+
+controller = pytest.importorskip('aiosmtpd.controller')
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Buzon:
+    """Servidor SMTP local: guarda lo que recibe y rechaza los destinatarios de `rechazar`."""
+
+    def __init__(self):
+        self.recibidos = []
+        self.rechazar = set()
+        self.al_recibir = None
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.rechazar:
+            return '550 buzón inexistente'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.al_recibir:
+            self.al_recibir()
+        self.recibidos.append((envelope.rcpt_tos, envelope.content.decode()))
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp():
+    buzon = Buzon()
+    servidor = controller.Controller(buzon, hostname='127.0.0.1', port=puerto_libre())
+    servidor.start()
+    buzon.config = buzon_salida.ConfigSMTP('127.0.0.1', servidor.port, None, None, tls=False,
+                                           remitente='citas@blank.test')
+    yield buzon
+    servidor.stop()
+
+
+def correo(correo_id, destinatario=None, intentos=0):
+    return {'correo_id': correo_id, 'destinatario': destinatario or f'cliente{correo_id}@blank.test',
+            'asunto': 'Tu cita', 'cuerpo_html': '<p>Hola</p>', 'intentos': intentos}
+
+
+def test_enviar_manda_todo_por_una_sesion(smtp):
+    enviados, fallidos = buzon_salida.enviar(smtp.config, [correo(1), correo(2)])
+    assert [c['correo_id'] for c in enviados] == [1, 2]
+    assert fallidos == []
+    assert [rcpt for rcpt, _ in smtp.recibidos] == [['cliente1@blank.test'], ['cliente2@blank.test']]
+    assert 'Subject: Tu cita' in smtp.recibidos[0][1]
+
+
+def test_destinatario_rechazado_no_frena_al_resto(smtp):
+    smtp.rechazar.add('cliente1@blank.test')
+    enviados, fallidos = buzon_salida.enviar(smtp.config, [correo(1), correo(2)])
+    assert [c['correo_id'] for c in enviados] == [2]
+    assert [(c['correo_id'], '550' in error) for c, error in fallidos] == [(1, True)]
+
+
+def test_sin_servidor_falla_todo_el_lote():
+    config = buzon_salida.ConfigSMTP('127.0.0.1', puerto_libre(), None, None, tls=False)
+    enviados, fallidos = buzon_salida.enviar(config, [correo(1), correo(2)])
+    assert enviados == []
+    assert [c['correo_id'] for c, _ in fallidos] == [1, 2]
+
+
+def test_reclamar_marca_enviando_y_hace_commit():
+    conn = ConexionFalsa([[correo(1, intentos=2)]])
+    correos = buzon_salida.reclamar(conn)
+    assert correos[0]['intentos'] == 3
+    sql, params = conn.sentencias[1]
+    assert "estado = 'enviando'" in sql and params == [buzon_salida.RECLAMO_SEGUNDOS, 1]
+    assert conn.commits == 1
+
+
+def test_reclamar_sin_pendientes_no_actualiza():
+    conn = ConexionFalsa()
+    assert buzon_salida.reclamar(conn) == []
+    assert len(conn.sentencias) == 1
+    assert conn.commits == 1
+
+
+def test_enviar_lote_no_tiene_bloqueos_abiertos_durante_el_envio(smtp):
+    conn = ConexionFalsa([[correo(1), correo(2)]])
+    commits_al_enviar = []
+    smtp.al_recibir = lambda: commits_al_enviar.append(conn.commits)
+    assert buzon_salida.enviar_lote(conn, smtp.config, informar=lambda m: None) == (2, 0)
+    # El reclamo ya se confirmó antes de hablar con el servidor
+    assert commits_al_enviar == [1, 1]
+    assert conn.commits == 2
+    sql, params = conn.sentencias[2]
+    assert "estado = 'enviado'" in sql and params == [1, 2]
+
+
+def test_registrar_reprograma_los_fallidos():
+    conn = ConexionFalsa()
+    mensajes = []
+    buzon_salida.registrar(conn, [], [(correo(4, intentos=2), 'timeout')], informar=mensajes.append)
+    sql, params = conn.sentencias[0]
+    assert "IF(intentos >= %s, 'fallido', 'pendiente')" in sql
+    assert params == ('timeout', buzon_salida.MAX_INTENTOS, buzon_salida.espera_reintento(2), 4)
+    assert mensajes == ['No se pudo enviar el correo 4 (intento 2): timeout']
+    assert conn.commits == 1
+
+
+def test_registrar_marca_el_recordatorio_al_enviarse():
+    conn = ConexionFalsa()
+    buzon_salida.registrar(conn, [correo(1), correo(2)], [])
+    sql, params = conn.sentencias[1]
+    assert sql.startswith('UPDATE CITA c JOIN correo_salida cs')
+    assert 'SET c.recordatorio_enviado_en = cs.enviado_en' in sql and params == [1, 2]
+
+
+def test_fallo_definitivo_no_marca_la_cita():
+    conn = ConexionFalsa()
+    buzon_salida.registrar(conn, [], [(correo(1, intentos=buzon_salida.MAX_INTENTOS), 'rechazado')],
+                           informar=lambda m: None)
+    assert not conn.ejecuto('UPDATE CITA')
+
+
+def cita_recordatorio(fecha):
+    return {'cita_id': 9, 'fecha': fecha, 'hora': '10:00', 'cliente_nombre': 'Ana',
+            'email': 'ana@blank.test', 'barbero_nombre': 'Luis', 'barbero_apellido': 'Pérez',
+            'servicios': 'Corte'}
+
+
+def recordatorio(modulo_app, base_falsa, fecha):
+    base_falsa.filas = [[cita_recordatorio(fecha)]]
+    with modulo_app.app.app_context():
+        modulo_app.encolar_recordatorios(fecha)
+    return base_falsa.sentencias[1][1][2]
+
+
+@pytest.mark.parametrize('dias, cuando', [(0, 'hoy'), (1, 'mañana')])
+def test_recordatorio_de_hoy_o_manana(modulo_app, base_falsa, dias, cuando):
+    cuerpo = recordatorio(modulo_app, base_falsa, date.today() + timedelta(days=dias))
+    assert f'Te esperamos {cuando} en BLANK concept' in cuerpo
+
+
+def test_recordatorio_de_otro_dia_dice_la_fecha(modulo_app, base_falsa):
+    fecha = date.today() + timedelta(days=3)
+    cuerpo = recordatorio(modulo_app, base_falsa, fecha)
+    assert f"Te esperamos el {fecha.strftime('%d/%m/%Y')} en" in cuerpo
+    assert 'mañana' not in cuerpo
+
+
+def test_encolar_recordatorios_no_marca_la_cita(modulo_app, base_falsa):
+    base_falsa.filas = [[cita_recordatorio(date(2026, 5, 4))]]
+    with modulo_app.app.app_context():
+        assert modulo_app.encolar_recordatorios(date(2026, 5, 4)) == 1
+    consulta = base_falsa.sentencias[0][0]
+    assert "co.estado IN ('pendiente','enviando')" in consulta
+    sql, params = base_falsa.sentencias[1]
+    assert sql.startswith('INSERT INTO correo_salida') and params[0] == 'ana@blank.test' and params[3] == 9
+    assert not base_falsa.ejecuto('UPDATE CITA')
+
+
+def test_lote_lento_renueva_el_reclamo_de_lo_que_falta(smtp, monkeypatch):
+    monkeypatch.setattr(buzon_salida, 'RENOVAR_CADA', 0)
+    conn = ConexionFalsa([[correo(1), correo(2), correo(3)]])
+    assert buzon_salida.enviar_lote(conn, smtp.config, informar=lambda m: None) == (3, 0)
+    renovaciones = [params for sql, params in conn.sentencias
+                    if sql.startswith('UPDATE correo_salida SET proximo_intento')]
+    segundos = buzon_salida.RECLAMO_SEGUNDOS
+    assert renovaciones == [[segundos, 1, 2, 3], [segundos, 2, 3], [segundos, 3]]
+    # Reclamo + una por renovación + el registro final
+    assert conn.commits == 5
+
+
+def test_lote_rapido_no_renueva(smtp):
+    conn = ConexionFalsa([[correo(1), correo(2)]])
+    buzon_salida.enviar_lote(conn, smtp.config, informar=lambda m: None)
+    assert not conn.ejecuto('SET proximo_intento')
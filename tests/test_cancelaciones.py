@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import mensajes_flash
+
+FECHA = date(2026, 5, 4)
+HORA = timedelta(hours=10)
+
+
+@pytest.fixture
+def liberados(modulo_app, monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(modulo_app, 'marcar_libre', lambda *args: llamadas.append(args))
+    monkeypatch.setattr(modulo_app, 'marcar_ocupado', lambda *args: llamadas.append(args))
+    return llamadas
+
+
+def test_cliente_cancela_cita_activa(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(5, 7, FECHA, HORA, 30, 'pendiente')]
+    cliente = cliente_con_sesion(5, rol=3)
+    cliente.post('/cancelar_cita', data={'cita_id': '1', 'motivo': 'Otro'})
+    assert base_falsa.ejecuto('INSERT INTO Cancelacion')
+    assert base_falsa.ejecuto('resumen_cancelaciones_dia')
+    assert len(liberados) == 1
+
+
+def test_cliente_no_cancela_dos_veces(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(5, 7, FECHA, HORA, 30, 'cancelada')]
+    cliente = cliente_con_sesion(5, rol=3)
+    respuesta = cliente.post('/cancelar_cita', data={'cita_id': '1', 'motivo': 'Otro'})
+    assert respuesta.status_code == 302
+    assert any('ya no se puede cancelar' in m for m in mensajes_flash(cliente))
+    assert not base_falsa.ejecuto('Cancelacion')
+    assert not base_falsa.ejecuto('resumen_')
+    assert liberados == []
+
+
+def test_barbero_no_cancela_cita_ya_cancelada(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(1, 7, FECHA, HORA, 30, 'cancelada')]
+    cliente = cliente_con_sesion(5, rol=2)
+    cliente.post('/barbero/cancelar_cita', data={'cita_id': '1', 'motivo': 'Enfermo'})
+    assert any('ya no se puede cancelar' in m for m in mensajes_flash(cliente))
+    assert not base_falsa.ejecuto('Cancelacion')
+    assert not base_falsa.ejecuto('resumen_')
+    assert liberados == []
+
+
+def test_cambiar_estado_rechaza_cita_inactiva(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(1, 7, FECHA, HORA, 30, 'cancelada')]
+    cliente = cliente_con_sesion(5, rol=2)
+    respuesta = cliente.post('/barbero/cambiar_estado_cita', data={'cita_id': '1', 'estado': 'confirmada'})
+    assert respuesta.status_code == 409
+    assert not base_falsa.ejecuto('UPDATE CITA')
+    assert liberados == []
+
+
+def test_confirmar_no_toca_el_indice(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(1, 7, FECHA, HORA, 30, 'pendiente')]
+    cliente = cliente_con_sesion(5, rol=2)
+    respuesta = cliente.post('/barbero/cambiar_estado_cita', data={'cita_id': '1', 'estado': 'confirmada'})
+    assert respuesta.get_json() == {'success': True, 'estado': 'confirmada'}
+    assert liberados == []
+
+
+def test_cancelar_desde_estado_libera_el_horario(cliente_con_sesion, base_falsa, liberados):
+    base_falsa.filas = [(1, 7, FECHA, HORA, 30, 'confirmada')]
+    cliente = cliente_con_sesion(5, rol=2)
+    cliente.post('/barbero/cambiar_estado_cita', data={'cita_id': '1', 'estado': 'cancelada'})
+    assert len(liberados) == 1
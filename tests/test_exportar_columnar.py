@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+import exportar_columnar
+
+
+class CursorLotes:
+    def __init__(self, filas):
+        self.filas = list(filas)
+
+    def fetchmany(self, cuantas):
+        lote, self.filas = self.filas[:cuantas], self.filas[cuantas:]
+        return lote
+
+
+def fila(cita_id, estado='completada', servicios='Corte\x1fBarba', cancelacion=None, cancelado_por=None):
+    return (cita_id, date(2026, 5, 4), timedelta(hours=10, minutes=30), 45, estado,
+            3, 'Ana Ruiz', 7, 'Luis Pérez', servicios, None, cancelacion, cancelado_por)
+
+
+VIVAS = [fila(1), fila(2, 'cancelada', None, datetime(2026, 5, 3, 18, 0), 'cliente')]
+ARCHIVO = [fila(3, 'no asistio', 'Corte'), fila(4, 'cancelada', cancelacion='2026-05-01 09:00:00',
+                                                 cancelado_por='barbero')]
+
+
+def leer(destino, formato):
+    if formato == 'parquet':
+        return pq.read_table(destino)
+    with pa.ipc.open_file(destino) as lector:
+        return lector.read_all()
+
+
+def test_lote_conserva_los_tipos():
+    tabla = pa.Table.from_batches([exportar_columnar.lote(VIVAS, exportar_columnar.esquema())])
+    datos = tabla.to_pylist()
+    assert datos[0]['hora'] == time(10, 30)
+    assert datos[0]['servicios'] == ['Corte', 'Barba']
+    assert datos[1]['servicios'] == []
+    assert datos[1]['fecha_cancelacion'] == datetime(2026, 5, 3, 18, 0)
+    assert [d['estado'] for d in datos] == ['completada', 'cancelada']
+    assert [d['cancelado_por'] for d in datos] == [None, 'cliente']
+
+
+def test_lote_rechaza_un_valor_fuera_del_diccionario():
+    with pytest.raises(ValueError, match='sistema'):
+        exportar_columnar.lote([fila(1, 'cancelada', cancelado_por='sistema')], exportar_columnar.esquema())
+
+
+@pytest.mark.parametrize('formato', sorted(exportar_columnar.FORMATOS))
+def test_varios_lotes_y_fuentes(formato, tmp_path, monkeypatch):
+    monkeypatch.setattr(exportar_columnar, 'FILAS_POR_LOTE', 1)
+    destino = tmp_path / f'citas.{formato}'
+    total = exportar_columnar.escribir([CursorLotes(VIVAS), CursorLotes(ARCHIVO)], str(destino), formato)
+    assert total == 4
+    tabla = leer(str(destino), formato)
+    assert tabla.column('cita_id').to_pylist() == [1, 2, 3, 4]
+    assert tabla.column('estado').to_pylist() == ['completada', 'cancelada', 'no asistio', 'cancelada']
+    assert tabla.column('cancelado_por').to_pylist() == [None, 'cliente', None, 'barbero']
+    assert tabla.column('fecha_cancelacion').to_pylist()[3] == datetime(2026, 5, 1, 9, 0)
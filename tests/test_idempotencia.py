@@ -0,0 +1,76 @@
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import mensajes_flash
+
+CITA = (5, 7, date(2026, 5, 4), timedelta(hours=10), 30, 'pendiente')
+
+
+@pytest.fixture
+def cliente(modulo_app, cliente_con_sesion, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'marcar_libre', lambda *args: None)
+    return cliente_con_sesion(5)
+
+
+def cancelar(cliente, clave, motivo='Otro'):
+    datos = {'cita_id': '1', 'motivo': motivo}
+    if clave:
+        datos['idempotencia'] = clave
+    return cliente.post('/cancelar_cita', data=datos)
+
+
+def test_reenvio_repite_la_respuesta_sin_tocar_la_base(cliente, base_falsa):
+    clave = uuid.uuid4().hex
+    base_falsa.filas = [CITA]
+    primera = cancelar(cliente, clave)
+    assert mensajes_flash(cliente) == ['Cita cancelada exitosamente']
+    sentencias = len(base_falsa.sentencias)
+
+    segunda = cancelar(cliente, clave)
+    assert segunda.status_code == 302
+    assert segunda.location == primera.location
+    assert mensajes_flash(cliente) == ['Cita cancelada exitosamente']
+    assert len(base_falsa.sentencias) == sentencias
+
+
+def test_otros_datos_con_la_misma_clave_son_un_envio_nuevo(cliente, base_falsa):
+    clave = uuid.uuid4().hex
+    base_falsa.filas = [CITA, CITA]
+    cancelar(cliente, clave, motivo='Otro')
+    sentencias = len(base_falsa.sentencias)
+    cancelar(cliente, clave, motivo='Enfermedad')
+    assert len(base_falsa.sentencias) > sentencias
+
+
+def test_sin_clave_siempre_se_procesa(cliente, base_falsa):
+    base_falsa.filas = [CITA, CITA]
+    cancelar(cliente, None)
+    sentencias = len(base_falsa.sentencias)
+    cancelar(cliente, None)
+    assert len(base_falsa.sentencias) > sentencias
+
+
+def test_envio_en_curso_no_se_procesa_otra_vez(modulo_app, cliente, base_falsa, monkeypatch):
+    monkeypatch.setattr(modulo_app.almacen_temporal, 'agregar', lambda *args: False)
+    monkeypatch.setattr(modulo_app.almacen_temporal, 'obtener', lambda clave: {'en_curso': True})
+    respuesta = cancelar(cliente, uuid.uuid4().hex)
+    assert respuesta.status_code == 302
+    assert mensajes_flash(cliente) == ['Tu solicitud ya se está procesando.']
+    assert base_falsa.sentencias == []
+
+
+def test_respuesta_que_no_es_redirect_no_se_recuerda(modulo_app):
+    llamadas = []
+
+    @modulo_app.idempotente
+    def vista():
+        llamadas.append(1)
+        return 'error', 400
+
+    clave = uuid.uuid4().hex
+    for _ in range(2):
+        with modulo_app.app.test_request_context('/', method='POST', data={'idempotencia': clave}):
+            vista()
+    assert len(llamadas) == 2
@@ -0,0 +1,55 @@
+from datetime import date, datetime
+
+import pytest
+
+LUNES = date(2026, 5, 4)
+MARTES = date(2026, 5, 5)
+ANTES = datetime(2026, 5, 3, 20, 0)
+
+
+@pytest.fixture
+def indice(m):
+    abierto = m.mascara_rango(9 * 60, 11 * 60)  # 09:00 a 11:00
+    return m.IndiceLibres(
+        [LUNES, MARTES],
+        {LUNES: abierto, MARTES: abierto},
+        {LUNES: {1: abierto, 2: abierto}, MARTES: {1: abierto, 2: abierto}},
+    )
+
+
+def hora(m, resultado):
+    dia, indice, barbero = resultado
+    return dia, m.hora_de_slot(indice), barbero
+
+
+def test_proximo_devuelve_el_primer_slot(m, indice):
+    assert hora(m, indice.proximo(ahora=ANTES)) == (LUNES, '09:00', 1)
+
+
+def test_ocupar_y_liberar(m, indice):
+    todo_el_dia = m.mascara_rango(9 * 60, 11 * 60)
+    indice.ocupar(1, LUNES, todo_el_dia)
+    indice.ocupar(2, LUNES, todo_el_dia)
+    assert hora(m, indice.proximo(ahora=ANTES)) == (MARTES, '09:00', 1)
+    indice.liberar(2, LUNES, m.mascara_cita('10:00', 30))
+    assert hora(m, indice.proximo(ahora=ANTES)) == (LUNES, '10:00', 2)
+
+
+def test_liberar_no_abre_fuera_del_horario(m, indice):
+    indice.ocupar(1, LUNES, m.mascara_rango(9 * 60, 11 * 60))
+    indice.liberar(1, LUNES, m.mascara_cita('12:00', 30))
+    assert indice.proximo(barbero_id=1, dia_semana=LUNES.weekday(), ahora=ANTES) is None
+
+
+def test_filtros_y_slots_seguidos(m, indice):
+    indice.ocupar(1, LUNES, m.mascara_cita('09:30', 30))
+    # Una hora seguida con el barbero 1: 09:00 ya no sirve, 10:00 sí
+    assert hora(m, indice.proximo(barbero_id=1, slots=2, ahora=ANTES)) == (LUNES, '10:00', 1)
+    assert hora(m, indice.proximo(dia_semana=MARTES.weekday(), ahora=ANTES)) == (MARTES, '09:00', 1)
+
+
+def test_excluir_y_pasados(m, indice):
+    excluir = {(1, LUNES): m.mascara_cita('09:00', 30), (2, LUNES): m.mascara_cita('09:00', 30)}
+    assert hora(m, indice.proximo(excluir=excluir, ahora=ANTES)) == (LUNES, '09:30', 1)
+    # A las 10:10 del lunes sólo queda la media hora de las 10:30
+    assert hora(m, indice.proximo(ahora=datetime(2026, 5, 4, 10, 10))) == (LUNES, '10:30', 1)
@@ -0,0 +1,55 @@
+import itertools
+import uuid
+
+import pytest
+
+from conftest import mensajes_flash
+
+IPS = (f'10.0.{n // 250}.{n % 250 + 1}' for n in itertools.count())
+
+
+@pytest.fixture
+def cliente(cliente_con_sesion):
+    # IP propia por prueba: las cubetas viven en el almacén del módulo
+    return cliente_con_sesion(None, ip=next(IPS))
+
+
+def login(cliente, email):
+    return cliente.post('/login', data={'email': email, 'password': 'x'})
+
+
+def test_rafaga_por_cuenta_se_corta_sin_tocar_la_base(modulo_app, cliente, base_falsa, monkeypatch):
+    email = f'{uuid.uuid4().hex}@blank.test'
+    capacidad = modulo_app.LIMITES_ACCESO['login'][1][0]
+    for _ in range(capacidad):
+        login(cliente, email)
+    consultas = len(base_falsa.sentencias)
+    monkeypatch.setattr(modulo_app, 'check_password_hash', lambda *args: pytest.fail('calculó el hash'))
+
+    respuesta = login(cliente, email.upper())
+    assert respuesta.status_code == 302
+    assert int(respuesta.headers['Retry-After']) > 0
+    assert len(base_falsa.sentencias) == consultas
+    assert mensajes_flash(cliente)[-1].startswith('Demasiados intentos')
+
+
+def test_otra_cuenta_desde_la_misma_ip_sigue_pasando(modulo_app, cliente, base_falsa):
+    email = f'{uuid.uuid4().hex}@blank.test'
+    for _ in range(modulo_app.LIMITES_ACCESO['login'][1][0] + 1):
+        login(cliente, email)
+    consultas = len(base_falsa.sentencias)
+    assert 'Retry-After' not in login(cliente, f'otro-{email}').headers
+    assert len(base_falsa.sentencias) > consultas
+
+
+@pytest.mark.parametrize('espera, minutos, retry_after', [(0.4, 1, '1'), (60, 1, '61'), (61, 2, '62')])
+def test_mensaje_de_espera(modulo_app, cliente, monkeypatch, espera, minutos, retry_after):
+    monkeypatch.setattr(modulo_app.almacen_temporal, 'tomar_ficha', lambda *args: espera)
+    respuesta = login(cliente, 'ana@blank.test')
+    assert respuesta.headers['Retry-After'] == retry_after
+    assert mensajes_flash(cliente) == [f'Demasiados intentos. Vuelve a intentarlo en {minutos} minuto(s).']
+
+
+def test_get_no_gasta_fichas(modulo_app, cliente, monkeypatch):
+    monkeypatch.setattr(modulo_app.almacen_temporal, 'tomar_ficha', lambda *args: pytest.fail('tomó ficha'))
+    assert cliente.get('/login').status_code == 200
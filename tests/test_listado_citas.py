@@ -0,0 +1,90 @@
+from datetime import date
+
+import pytest
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    ('2026-05-04_10:30:00_17', (date(2026, 5, 4), '10:30:00', 17)),
+    ('2026-05-04_09:05_3', (date(2026, 5, 4), '09:05:00', 3)),
+])
+def test_leer_cursor(modulo_app, valor, esperado):
+    assert modulo_app.leer_cursor(valor) == esperado
+
+
+@pytest.mark.parametrize('valor', [
+    None, '', 'basura', '2026-05-04_10:30:00', '2026-05-04_10:30:00_17_1',
+    '2026-02-30_10:30:00_1', '2026-05-04_25:00:00_1', '2026-05-04_10:30:00_x',
+    "2026-05-04_10:30:00_1 OR 1=1",
+])
+def test_cursor_invalido(modulo_app, valor):
+    assert modulo_app.leer_cursor(valor) is None
+
+
+def test_cursor_de_cita_ida_y_vuelta(modulo_app):
+    cita = {'fecha': date(2026, 5, 4), 'hora_orden': '18:45:00', 'cita_id': 250}
+    assert modulo_app.leer_cursor(modulo_app.cursor_de_cita(cita)) == (date(2026, 5, 4), '18:45:00', 250)
+
+
+@pytest.fixture
+def listado(modulo_app, cliente_admin, base_falsa, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'obtener_barberos', lambda solo_activos=True: [])
+
+    def pedir(**args):
+        cliente_admin.get('/admin/citas', query_string=args)
+        return base_falsa.sentencias[0]
+    return pedir
+
+
+def test_pagina_siguiente_sigue_desde_el_cursor(listado):
+    sql, params = listado(despues='2026-05-04_10:30:00_17')
+    assert '(c.fecha < %s OR (c.fecha = %s AND (c.hora < %s OR (c.hora = %s AND c.cita_id < %s))))' in sql
+    assert 'ORDER BY c.fecha DESC, c.hora DESC, c.cita_id DESC' in sql
+    assert params[:5] == (date(2026, 5, 4), date(2026, 5, 4), '10:30:00', '10:30:00', 17)
+
+
+def test_pagina_anterior_recorre_hacia_las_mas_nuevas(listado):
+    sql, params = listado(antes='2026-05-04_10:30:00_17')
+    assert 'c.cita_id > %s' in sql
+    assert 'ORDER BY c.fecha ASC, c.hora ASC, c.cita_id ASC' in sql
+
+
+def test_cursor_invalido_empieza_desde_el_principio(modulo_app, listado):
+    sql, params = listado(despues='no-es-un-cursor')
+    assert 'c.cita_id <' not in sql
+    assert params == (modulo_app.ADMIN_CITAS_POR_PAGINA + 1,)
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('Ana Ruiz', '+"Ana" +"Ruiz"'),
+    ('  5512  ', '+"5512"'),
+    ('ana@correo.com', '+"ana@correo.com"'),
+    ('J Pérez', '+"Pérez"'),
+    ('"Ana" ', '+"Ana"'),
+    ('a "', ''),
+    ('', ''),
+    (None, ''),
+])
+def test_busqueda_clientes(modulo_app, texto, esperado):
+    assert modulo_app.busqueda_clientes(texto) == esperado
+
+
+def test_busqueda_filtra_por_el_indice_fulltext(modulo_app):
+    condiciones, params = modulo_app.filtros_citas({'q': 'Ana 55', 'estado': 'todos'})
+    assert len(condiciones) == 1
+    assert 'MATCH(nombre, apellido, email, telefono) AGAINST (%s IN BOOLEAN MODE)' in condiciones[0]
+    assert params == ['+"Ana" +"55"']
+
+
+def test_sin_busqueda_no_filtra(modulo_app):
+    assert modulo_app.filtros_citas({'q': '  '}) == ([], [])
+
+
+def test_termino_demasiado_corto_no_devuelve_todo(modulo_app):
+    assert modulo_app.filtros_citas({'q': 'J'}) == (['1=0'], [])
+
+
+def test_termino_demasiado_corto_avisa(modulo_app, cliente_admin, base_falsa, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'obtener_barberos', lambda solo_activos=True: [])
+    respuesta = cliente_admin.get('/admin/citas', query_string={'q': 'a b'})
+    assert 'Término de búsqueda demasiado corto' in respuesta.get_data(as_text=True)
+    assert '1=0' in base_falsa.sentencias[0][0]
@@ -0,0 +1,66 @@
+from datetime import date, datetime, time, timedelta
+
+from conftest import mensajes_flash
+
+
+def horas(m, mascara):
+    return [m.hora_de_slot(i) for i in m.slots_de_mascara(mascara)]
+
+
+def test_mascara_apertura_en_grilla(m):
+    horario = {'hora_inicio': time(9, 0), 'hora_fin': time(11, 0), 'cerrado': False}
+    assert horas(m, m.mascara_apertura(horario)) == ['09:00', '09:30', '10:00', '10:30']
+
+
+def test_mascara_apertura_dia_cerrado(m):
+    assert m.mascara_apertura({'cerrado': True}) == 0
+
+
+def test_mascara_cita_toca_slots_parciales(m):
+    # 10:15 a 11:05 toca los slots de 10:00, 10:30 y 11:00
+    assert horas(m, m.mascara_cita('10:15', 50)) == ['10:00', '10:30', '11:00']
+    assert m.slots_necesarios(50) == 2
+    assert m.slots_necesarios(0) == 1
+
+
+def test_mascara_inicios_necesita_slots_seguidos(m):
+    # Libres 09:00, 09:30 y 10:30: una hora sólo puede empezar a las 09:00
+    libres = m.mascara_rango(9 * 60, 11 * 60) & ~m.mascara_cita('10:00', 30)
+    assert horas(m, libres) == ['09:00', '09:30', '10:30']
+    assert horas(m, m.mascara_inicios(libres, 2)) == ['09:00']
+
+
+def test_mascara_pasados_solo_hoy(m):
+    ahora = datetime(2026, 5, 4, 10, 10)
+    assert m.slots_de_mascara(m.mascara_pasados(ahora.date(), ahora))[-1] == 20  # 10:00
+    assert m.mascara_pasados(date(2026, 5, 5), ahora) == 0
+
+
+def test_en_grilla(m):
+    assert m.en_grilla('09:00') and m.en_grilla(time(9, 30))
+    assert not m.en_grilla('09:15')
+
+
+def test_horario_especial_fuera_de_grilla_se_rechaza(m, cliente_admin, monkeypatch):
+    # Con 09:15 el primer slot desaparecería: no debe llegar a la base de datos
+    def sin_base():
+        raise AssertionError('no debe tocar la base de datos')
+    monkeypatch.setattr(m, 'get_db', sin_base)
+
+    respuesta = cliente_admin.post('/admin/horarios', data={
+        'fecha': '2026-05-04', 'hora_apertura': '09:15', 'hora_cierre': '13:00', 'motivo': 'Inventario',
+    })
+    assert respuesta.status_code == 302
+    assert any('bloques de 30 minutos' in mensaje for mensaje in mensajes_flash(cliente_admin))
+
+
+def test_ocupacion_citas_une_las_citas_del_dia(m, base_falsa):
+    base_falsa.filas = [[
+        {'barbero_id': 7, 'fecha': date(2026, 5, 4), 'hora': timedelta(hours=10), 'duracion_minutos': 45},
+        {'barbero_id': 7, 'fecha': date(2026, 5, 4), 'hora': timedelta(hours=12), 'duracion_minutos': 30},
+        {'barbero_id': 8, 'fecha': date(2026, 5, 4), 'hora': timedelta(hours=9), 'duracion_minutos': None},
+    ]]
+    with m.app.app_context():
+        ocupados = m.ocupacion_citas(date(2026, 5, 4), date(2026, 5, 4), [7, 8])
+    assert horas(m, ocupados[(7, date(2026, 5, 4))]) == ['10:00', '10:30', '12:00']
+    assert horas(m, ocupados[(8, date(2026, 5, 4))]) == ['09:00']
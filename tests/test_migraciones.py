@@ -0,0 +1,34 @@
+import migraciones
+from conftest import ConexionFalsa
+
+
+def test_indice_de_busqueda_sin_palabras_vacias():
+    conn = ConexionFalsa()
+    migraciones.crear_indice_busqueda(conn.cursor())
+    sentencias = [sql for sql, _ in conn.sentencias]
+    assert sentencias[0] == 'SET SESSION innodb_ft_enable_stopword = OFF'
+    assert sentencias[1].startswith('CREATE FULLTEXT INDEX ft_usuario_busqueda')
+    assert sentencias[2] == 'SET SESSION innodb_ft_enable_stopword = DEFAULT'
+
+
+def test_migracion_reconstruye_el_indice_existente():
+    conn = ConexionFalsa([(1,)])  # existe_indice
+    funcion = next(f for version, _, f in migraciones.MIGRACIONES if version == 12)
+    funcion(conn.cursor())
+    assert conn.ejecuto('DROP INDEX ft_usuario_busqueda ON USUARIO')
+    assert conn.ejecuto('CREATE FULLTEXT INDEX ft_usuario_busqueda')
+
+
+def test_verificar_busqueda_encuentra_al_cliente_por_su_nombre():
+    conn = ConexionFalsa([{'usuario_id': 4, 'nombre': 'Ana'}, [{'usuario_id': 4}]])
+    assert migraciones.verificar_busqueda(conn) is None
+    assert conn.sentencias[1][1] == ('+"Ana"',)
+
+
+def test_verificar_busqueda_avisa_si_no_lo_encuentra():
+    conn = ConexionFalsa([{'usuario_id': 4, 'nombre': 'Ana'}, []])
+    assert migraciones.verificar_busqueda(conn) == 'Ana'
+
+
+def test_verificar_busqueda_sin_clientes():
+    assert migraciones.verificar_busqueda(ConexionFalsa()) is None
@@ -0,0 +1,23 @@
+from datetime import date
+
+import prueba_carga
+from conftest import ConexionFalsa
+
+
+def test_limpiar_clientes_recalcula_los_dias_borrados():
+    conn = ConexionFalsa([(date(2026, 5, 4), date(2026, 5, 9))])
+    prueba_carga.limpiar_clientes(conn)
+    sentencias = [sql for sql, _ in conn.sentencias]
+    borrado = next(i for i, sql in enumerate(sentencias) if sql.startswith('DELETE FROM CITA'))
+    resumen = next(i for i, sql in enumerate(sentencias) if sql.startswith('DELETE FROM resumen_citas_dia'))
+    assert borrado < resumen
+    assert conn.sentencias[resumen][1] == (date(2026, 5, 4), date(2026, 5, 9))
+    assert conn.ejecuto('INSERT INTO resumen_cancelaciones_dia')
+    assert conn.commits == 1
+
+
+def test_limpiar_sin_citas_no_toca_los_resumenes():
+    conn = ConexionFalsa([(None, None)])
+    prueba_carga.limpiar_clientes(conn)
+    assert not conn.ejecuto('resumen_')
+    assert conn.commits == 1
@@ -0,0 +1,77 @@
+import pytest
+
+
+class AlmacenSinBarridos:
+    """Doble del almacén compartido: falla si alguien recorre todas las claves."""
+
+    def __init__(self, almacen):
+        self._almacen = almacen
+
+    def __getattr__(self, nombre):
+        if nombre == 'buscar':
+            raise AssertionError('las retenciones no deben recorrer el almacén')
+        return getattr(self._almacen, nombre)
+
+
+@pytest.fixture
+def reloj(reloj, m, monkeypatch):
+    # Además del reloj: slots de 30 minutos (m), retenciones de 5 y un almacén propio
+    monkeypatch.setattr(m, 'RETENCION_MINUTOS', 5)
+    monkeypatch.setattr(m, 'almacen_temporal', AlmacenSinBarridos(m.AlmacenMemoria()))
+    return reloj
+
+
+def retener(c, hora, duracion=30, barbero_id=7):
+    return c.post('/retener_horario', data={
+        'barbero_id': barbero_id, 'fecha': '2026-05-04', 'hora': hora, 'duracion': duracion,
+    })
+
+
+def ajenas(modulo_app, usuario_id):
+    from datetime import date
+    dia = date(2026, 5, 4)
+    return [modulo_app.hora_de_slot(i)
+            for i in modulo_app.slots_de_mascara(modulo_app.retenciones_ajenas(usuario_id, [dia]).get((7, dia), 0))]
+
+
+def test_retener_aparta_los_slots_para_los_demas(modulo_app, cliente_con_sesion, reloj):
+    respuesta = retener(cliente_con_sesion(1), '10:00', 60)
+    assert respuesta.status_code == 200 and respuesta.get_json()['expira_en'] == 300
+    assert ajenas(modulo_app, 2) == ['10:00', '10:30']
+    assert ajenas(modulo_app, 1) == []  # las propias no cuentan
+
+
+def test_otro_cliente_no_puede_solaparse(modulo_app, cliente_con_sesion, reloj):
+    retener(cliente_con_sesion(1), '10:00', 60)
+    assert retener(cliente_con_sesion(2), '10:30').status_code == 409
+    assert retener(cliente_con_sesion(2), '09:30', 60).status_code == 409
+    assert retener(cliente_con_sesion(2), '11:00').status_code == 200
+    assert retener(cliente_con_sesion(2), '10:00', barbero_id=8).status_code == 200
+
+
+def test_la_retencion_vence(modulo_app, cliente_con_sesion, reloj):
+    retener(cliente_con_sesion(1), '10:00')
+    reloj.ahora += 301
+    assert ajenas(modulo_app, 2) == []
+    assert retener(cliente_con_sesion(2), '10:00').status_code == 200
+
+
+def test_elegir_otra_hora_suelta_la_anterior(modulo_app, cliente_con_sesion, reloj):
+    c = cliente_con_sesion(1)
+    retener(c, '10:00')
+    retener(c, '12:00')
+    assert ajenas(modulo_app, 2) == ['12:00']
+
+
+def test_soltar_no_borra_lo_que_ya_es_de_otro(modulo_app, cliente_con_sesion, reloj):
+    retener(cliente_con_sesion(1), '10:00')
+    reloj.ahora += 301
+    retener(cliente_con_sesion(2), '10:00')
+    modulo_app.soltar_retencion(1)
+    assert ajenas(modulo_app, 1) == ['10:00']
+
+
+def test_soltar_con_token_equivocado_no_hace_nada(modulo_app, cliente_con_sesion, reloj):
+    retener(cliente_con_sesion(1), '10:00')
+    modulo_app.soltar_retencion(1, 'otro-token')
+    assert ajenas(modulo_app, 2) == ['10:00']